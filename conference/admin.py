@@ -34,6 +34,11 @@ from cStringIO import StringIO
 
 log = logging.getLogger('conference')
 
+class _Echo(object):
+    # file-like object for csv.writer that returns what is written
+    def write(self, value):
+        return value
+
 class ConferenceAdmin(admin.ModelAdmin):
     list_display = ('code', 'name', '_schedule_view', '_attendee_stats')
 
@@ -66,6 +71,12 @@ class ConferenceAdmin(admin.ModelAdmin):
             url(r'^(?P<cid>[\w-]+)/stats/details.csv$',
                 v(self.stats_details_csv),
                 name='conference-ticket-stats-details-csv'),
+            url(r'^(?P<cid>[\w-]+)/stats/mail/(?P<jid>\d+)$',
+                v(self.stats_mail_job),
+                name='conference-ticket-stats-mail-job'),
+            url(r'^(?P<cid>[\w-]+)/stats/cache$',
+                v(self.stats_cache),
+                name='conference-cache-stats'),
         )
         return urls + super(ConferenceAdmin, self).get_urls()
 
@@ -121,7 +132,9 @@ class ConferenceAdmin(admin.ModelAdmin):
             { 'timetable': tt, },
             context_instance=template.RequestContext(request))
 
-    def _stat_wrapper(self, func, conf):
+    def _stat_wrapper(self, func, conf, stream=False):
+        # the drill-downs of the stats can return their rows as a generator;
+        # unless `stream` is True they are materialized for the templates.
         def wrapper(*args, **kwargs):
             result = func(conf, *args, **kwargs)
             if 'columns' not in result:
@@ -131,25 +144,27 @@ class ConferenceAdmin(admin.ModelAdmin):
                     ),
                     'data': result,
                 }
+            elif not stream and not isinstance(result['data'], list):
+                result['data'] = list(result['data'])
             result['id'] = wrapper.stat_id
             return result
         wrapper.stat_id = func.__name__
         return wrapper
 
-    def available_stats(self, conf):
+    def available_stats(self, conf, stream=False):
         stats = []
         for path in settings.ADMIN_ATTENDEE_STATS:
             func = utils.dotted_import(path)
             w = {
-                'get_data': self._stat_wrapper(func, conf),
+                'get_data': self._stat_wrapper(func, conf, stream=stream),
                 'short_description': getattr(func, 'short_description', func.__name__.replace('_', ' ').strip()),
                 'description': getattr(func, 'description', func.__doc__),
             }
             stats.append(w)
         return stats
 
-    def single_stat(self, conf, sid, code):
-        for s in self.available_stats(conf):
+    def single_stat(self, conf, sid, code, stream=False):
+        for s in self.available_stats(conf, stream=stream):
             if s['get_data'].stat_id == sid:
                 r = s['get_data']
                 s['get_data'] = lambda: r(code=code)
@@ -188,12 +203,19 @@ class ConferenceAdmin(admin.ModelAdmin):
                 else:
                     if form.cleaned_data['send_email']:
                         from django.contrib import messages
-                        c = form.send_emails(uids, request.user.email)
-                        messages.add_message(request, messages.INFO, '{0} emails sent'.format(c))
-                        form.save_email()
+                        c = form.send_emails(
+                            uids, request.user.email,
+                            conference=cid,
+                            stat_code=request.GET['code'],
+                            author=request.user)
+                        messages.add_message(request, messages.INFO, '{0} emails queued'.format(c))
                         form = AdminSendMailForm()
         else:
             form = AdminSendMailForm()
+        try:
+            mail_page = int(request.GET.get('mail_page', 1))
+        except ValueError:
+            mail_page = 1
         return render_to_response(
             'admin/conference/conference/attendee_stats_details.html',
             {
@@ -202,15 +224,15 @@ class ConferenceAdmin(admin.ModelAdmin):
                 'stat_code': '%s.%s' % (sid, rowid),
                 'form': form,
                 'preview': preview,
-                'email_log': settings.ADMIN_TICKETS_STATS_EMAIL_LOG,
+                'email_log': form.load_emails(page=mail_page),
+                'mail_jobs': models.BulkMailJob.objects\
+                    .filter(conference=cid, stat_code=request.GET['code'])[:10],
             },
             context_instance=template.RequestContext(request))
 
     def stats_details_csv(self, request, cid):
         sid, rowid = request.GET['code'].split('.')
-        stat = self.single_stat(cid, sid, rowid)
-
-        buff = StringIO()
+        stat = self.single_stat(cid, sid, rowid, stream=True)
         result = stat['get_data']()
 
         colid = []
@@ -219,16 +241,42 @@ class ConferenceAdmin(admin.ModelAdmin):
             colid.append(cid)
             colnames.append(cname)
 
-        writer = csv.writer(buff)
-        writer.writerow(colnames)
-        for row in result['data']:
-            writer.writerow([ row.get(c, '').encode('utf-8') for c in colid ])
+        def lines():
+            # the csv writer hands every row back instead of buffering it
+            writer = csv.writer(_Echo())
+            yield writer.writerow(colnames)
+            for row in result['data']:
+                yield writer.writerow([ unicode(row.get(c, '')).encode('utf-8') for c in colid ])
 
         fname = '[%s] %s.csv' % (settings.CONFERENCE, stat['short_description'])
-        r = http.HttpResponse(buff.getvalue(), content_type="text/csv")
+        r = http.StreamingHttpResponse(lines(), content_type="text/csv")
         r['content-disposition'] = 'attachment; filename="%s"' % fname
         return r
 
+    @common.decorators.render_to_json
+    def stats_mail_job(self, request, cid, jid):
+        job = get_object_or_404(models.BulkMailJob, conference=cid, id=jid)
+        return {
+            'status': job.status,
+            'total': job.total,
+            'sent': job.sent,
+            'failed': job.failed,
+        }
+
+    def stats_cache(self, request, cid):
+        from conference import cachef
+        if request.method == 'POST' and 'reset' in request.POST:
+            for wrapper in cachef.registry.values():
+                wrapper.stats.reset()
+            return redirect('admin:conference-cache-stats', cid)
+        return render_to_response(
+            'admin/conference/conference/cache_stats.html',
+            {
+                'conference': cid,
+                'report': sorted(cachef.stats_report(), key=lambda x: -x['lookups']),
+            },
+            context_instance=template.RequestContext(request))
+
 admin.site.register(models.Conference, ConferenceAdmin)
 
 class DeadlineAdmin(admin.ModelAdmin):
@@ -941,8 +989,13 @@ class ScheduleAdmin(admin.ModelAdmin):
 
     def expected_attendance(self, request):
         allevents = defaultdict(dict)
-        for e, info in models.Schedule.objects.expected_attendance(settings.CONFERENCE).items():
-            allevents[e.schedule][e] = info
+        data = dataaccess.expected_attendance(settings.CONFERENCE)
+        events = models.Event.objects\
+            .filter(schedule__conference=settings.CONFERENCE)\
+            .select_related('schedule', 'talk')
+        for e in events:
+            if e.id in data:
+                allevents[e.schedule][e] = data[e.id]
         data = {}
         for s, events in allevents.items():
             data[s] = entry = {
@@ -0,0 +1,267 @@
+# -*- coding: UTF-8 -*-
+"""
+Mass mailings of the admin stats.
+
+AdminSendMailForm.send_emails queues a BulkMailJob, with a recipient row
+for every user, and the `send_bulk_mail` command sends the queued jobs in
+batches: the messages of a batch are rendered with the tickets of all its
+users loaded by one query and sent through a single SMTP connection; every
+recipient is marked as sent (or with the error that prevented the message)
+as soon as its message is handled. A job interrupted by a crash is resumed
+from its first unhandled recipient (only the message being sent when the
+worker died can be sent twice); a job abandoned
+`settings.BULK_MAIL_ATTEMPTS` times is marked as failed.
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings as dsettings
+from django.core import mail
+from django.db import transaction
+from django.db.models import F, Q
+from django.template import Context, Template
+from django.utils import timezone
+
+from conference import models
+from conference import settings
+from p3 import models as p3models
+
+log = logging.getLogger('conference')
+
+def templates(subject, body):
+    """
+    Compiles the subject and the body of a mailing.
+    """
+    if settings.ADMIN_TICKETS_STATS_EMAIL_LOAD_LIBRARY:
+        libs = '{%% load %s %%}' % ' '.join(settings.ADMIN_TICKETS_STATS_EMAIL_LOAD_LIBRARY)
+    else:
+        libs = ''
+    return Template(libs + subject), Template(libs + body)
+
+def _tickets(users):
+    # the tickets of all the users, see p3.utils.get_tickets_assigned_to
+    tickets = defaultdict(list)
+    emails = set(u.email for u in users if u.email)
+    if emails:
+        for t in p3models.TicketConference.objects.filter(assigned_to__in=emails):
+            tickets[t.assigned_to].append(t)
+    return tickets
+
+def _render_user(tpls, user, conf, tickets):
+    tSubject, tBody = tpls
+    ctx = Context({
+        'user': user,
+        'conf': conf,
+        'tickets': tickets.get(user.email, []),
+    })
+    return tSubject.render(ctx), tBody.render(ctx)
+
+def render(tpls, users, conf=None):
+    """
+    Renders the templates returned by `templates` for every user; returns
+    the list of (subject, body, user).
+    """
+    if conf is None:
+        conf = models.Conference.objects.current()
+    tickets = _tickets(users)
+    output = []
+    for u in users:
+        subject, body = _render_user(tpls, u, conf, tickets)
+        output.append((subject, body, u))
+    return output
+
+def queue(sender, subject, body, uids, feedback_address='', conference='', stat_code='', author=None):
+    """
+    Queues a mailing to the users, every user receives one message.
+    """
+    uids = set(uids)
+    with transaction.atomic():
+        job = models.BulkMailJob.objects.create(
+            author=author,
+            conference=conference,
+            stat_code=stat_code,
+            sender=sender,
+            subject=subject,
+            body=body,
+            feedback_address=feedback_address or '',
+            total=len(uids),
+        )
+        models.BulkMailRecipient.objects.bulk_create([
+            models.BulkMailRecipient(job=job, user_id=uid) for uid in uids ],
+            batch_size=500)
+    return job
+
+def pending_jobs():
+    """
+    The jobs to send: the queued ones and the ones abandoned by a worker.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.BULK_MAIL_STALE)
+    return models.BulkMailJob.objects\
+        .filter(
+            Q(status=models.BULK_MAIL_STATUS.queued)
+            | Q(status=models.BULK_MAIL_STATUS.running, updated__lt=stale))\
+        .order_by('created')
+
+def claim(job):
+    """
+    Marks the job as running; returns False if another worker got it first.
+    """
+    claimed = models.BulkMailJob.objects\
+        .filter(id=job.id, status=job.status, updated=job.updated)\
+        .update(
+            status=models.BULK_MAIL_STATUS.running,
+            attempts=F('attempts') + 1,
+            updated=timezone.now())
+    return bool(claimed)
+
+def abandon(job):
+    """
+    Marks as failed a job that was not completed in
+    `settings.BULK_MAIL_ATTEMPTS` runs; returns False if another worker
+    changed it in the meantime.
+    """
+    abandoned = models.BulkMailJob.objects\
+        .filter(id=job.id, status=job.status, updated=job.updated)\
+        .update(status=models.BULK_MAIL_STATUS.failed, updated=timezone.now())
+    return bool(abandoned)
+
+def _record(job, recipient, error=''):
+    now = timezone.now()
+    with transaction.atomic():
+        if error:
+            models.BulkMailRecipient.objects\
+                .filter(id=recipient.id)\
+                .update(error=error[:200])
+            counters = {'failed': F('failed') + 1}
+        else:
+            models.BulkMailRecipient.objects\
+                .filter(id=recipient.id)\
+                .update(sent=now)
+            counters = {'sent': F('sent') + 1}
+        models.BulkMailJob.objects\
+            .filter(id=job.id)\
+            .update(updated=now, **counters)
+
+def send_batch(job, tpls, recipients, conf=None):
+    """
+    Sends the messages of the recipients through one connection; every
+    recipient is recorded right after its message, as sent or with the
+    error (missing address, template or SMTP failure) that stopped it.
+    Returns the number of messages sent.
+    """
+    if conf is None:
+        conf = models.Conference.objects.current()
+    users = [ r.user for r in recipients ]
+    tickets = _tickets(users)
+    connection = mail.get_connection()
+    count = 0
+    try:
+        for r in recipients:
+            user = r.user
+            if not user.email:
+                _record(job, r, 'no email address')
+                continue
+            try:
+                subject, body = _render_user(tpls, user, conf, tickets)
+            except Exception as e:
+                log.exception('mass mailing %s: cannot render the message for user %s', job.id, user.id)
+                _record(job, r, 'render error: %s' % e)
+                continue
+            try:
+                # a no-op if the connection is already open
+                connection.open()
+                connection.send_messages([
+                    mail.EmailMessage(subject, body, job.sender, [user.email]) ])
+            except Exception as e:
+                log.exception('mass mailing %s: cannot send the message to %s', job.id, user.email)
+                _record(job, r, 'send error: %s' % e)
+                # the next message reopens the connection
+                connection.close()
+                continue
+            _record(job, r)
+            count += 1
+    finally:
+        connection.close()
+    return count
+
+def run(job, batch_size=None, rate=None):
+    """
+    Sends the unsent messages of a (claimed) job, in batches of
+    `batch_size`, at most `rate` messages per second.
+    """
+    if batch_size is None:
+        batch_size = settings.BULK_MAIL_BATCH_SIZE
+    if rate is None:
+        rate = settings.BULK_MAIL_RATE
+    tpls = templates(job.subject, job.body)
+    conf = models.Conference.objects.current()
+    while True:
+        recipients = list(job.recipients\
+            .filter(sent=None, error='')\
+            .select_related('user')\
+            .order_by('id')[:batch_size])
+        if not recipients:
+            break
+        start = time.time()
+        count = send_batch(job, tpls, recipients, conf)
+        if rate:
+            wait = float(count) / rate - (time.time() - start)
+            if wait > 0:
+                time.sleep(wait)
+
+    models.BulkMailJob.objects\
+        .filter(id=job.id)\
+        .update(status=models.BULK_MAIL_STATUS.done, updated=timezone.now())
+    if job.feedback_address:
+        send_feedback(job)
+
+def send_feedback(job):
+    """
+    Sends to the author of the mailing the message and the list of the
+    recipients.
+    """
+    recipients = job.recipients\
+        .exclude(sent=None)\
+        .values_list('user__first_name', 'user__last_name', 'user__email')
+    addresses = [ '"%s %s" - %s' % x for x in recipients.iterator() ]
+    feedback_email = ("""
+message sent
+-------------------------------
+FROM: %(from_)s
+SUBJECT: %(subject)s
+BODY:
+%(body)s
+-------------------------------
+sent to:
+%(addresses)s
+""" % {
+        'from_': job.sender,
+        'subject': job.subject,
+        'body': job.body,
+        'addresses': '\n'.join(addresses),
+    })
+    mail.send_mail(
+        '[%s] feedback mass mailing (admin stats)' % settings.CONFERENCE,
+        feedback_email,
+        dsettings.DEFAULT_FROM_EMAIL,
+        recipient_list=[job.feedback_address],
+     )
+
+def run_pending(batch_size=None, rate=None):
+    """
+    Sends all the pending jobs; returns the number of jobs sent.
+    """
+    count = 0
+    for job in pending_jobs():
+        if job.attempts >= settings.BULK_MAIL_ATTEMPTS:
+            if abandon(job):
+                log.error('mass mailing %s abandoned after %d attempts', job.id, job.attempts)
+            continue
+        if not claim(job):
+            continue
+        log.info('sending mass mailing %s (%d messages)', job.id, job.total)
+        run(job, batch_size=batch_size, rate=rate)
+        count += 1
+    return count
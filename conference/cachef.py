@@ -2,14 +2,20 @@
 from django.core.cache import cache
 from django.db.models.signals import pre_delete, post_save
 from django.dispatch import Signal
+from collections import Counter, OrderedDict
+import cPickle as pickle
 import functools
 import hashlib
+import importlib
+import re
+import threading
+import time
+from inspect import getargspec, ismethod
 
 try:
     from inspect import getcallargs
 except ImportError:
     import sys
-    from inspect import getargspec, ismethod
 
     def getcallargs(func, *positional, **named):
         """Get the mapping of arguments to values.
@@ -103,12 +109,175 @@ except ImportError:
 
 WEEK = 7 * 24 * 60 * 60
 
+# named placeholders of a key template, eg. %(tid)s
+KEY_FIELD = re.compile(r'(?<!%)%\((\w+)\)')
+
+# keys matching this regexp are short enough (and safe for memcached) to be
+# used as they are, without hashing them.
+RAW_KEY = re.compile(r'^[!-~]{1,64}$')
+
+# maximum time (in seconds) a process can hold the lock used to compute a
+# missing value, and how often the other processes check for it.
+LOCK_TIMEOUT = 30
+LOCK_POLL = 0.05
+
 cache_invalidated = Signal(providing_args=['keys'])
 
+class LocalCache(object):
+    """
+    Bounded, in-process LRU cache used as a first level in front of
+    django.core.cache.
+
+    The values are stored pickled, so every hit returns a fresh copy exactly
+    like the shared cache does (callers are free to mutate what they get).
+
+    Invalidations are applied only to the process that handles the signal,
+    the other processes see the change at most after `timeout` seconds;
+    keep the timeout short.
+    """
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires < time.time():
+                return default
+            # re-insert the key to mark it as the most recently used
+            self._data[key] = (expires, value)
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.timeout, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for k in keys:
+                self._data.pop(k, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+# The functions decorated by a CacheFunction, indexed by name
+# (<prefix><key name>, eg. "conf:talk_data").
+registry = {}
+
+STATS_FIELDS = (
+    'local_hits', 'hits', 'misses', 'stale_hits', 'lock_waits',
+    'computes', 'compute_ms', 'size', 'invalidations',
+)
+
+class CacheStats(object):
+    """
+    Usage counters of a decorated function.
+
+    The counters are kept in memory and periodically (every
+    CONFERENCE_CACHEF_STATS_FLUSH_INTERVAL seconds) added to the shared
+    cache, in order to aggregate the numbers of all the processes.
+    """
+    def __init__(self, name):
+        from conference import settings
+        self.name = name
+        self.flush_interval = settings.CACHEF_STATS_FLUSH_INTERVAL
+        self.counters = Counter()
+        self._pending = Counter()
+        self._flushed = time.time()
+
+    def __getitem__(self, field):
+        return self.counters[field]
+
+    def incr(self, field, value=1):
+        self.counters[field] += value
+        self._pending[field] += value
+        self.flush()
+
+    def measure(self, func, *args, **kwargs):
+        """
+        Calls func recording the time spent and the size of the pickled result.
+        """
+        start = time.time()
+        data = func(*args, **kwargs)
+        self.incr('computes')
+        self.incr('compute_ms', int((time.time() - start) * 1000))
+        self.incr('size', len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)))
+        return data
+
+    def _key(self, field):
+        return 'cachef:stats:%s:%s' % (self.name, field)
+
+    def flush(self, force=False):
+        if not self.flush_interval or not self._pending:
+            return
+        now = time.time()
+        if not force and now - self._flushed < self.flush_interval:
+            return
+        pending, self._pending = self._pending, Counter()
+        self._flushed = now
+        for field, value in pending.items():
+            k = self._key(field)
+            try:
+                cache.incr(k, value)
+            except ValueError:
+                cache.set(k, value, None)
+
+    def shared(self):
+        """
+        Returns the counters aggregated from all the processes (or the local
+        ones if they are not shared).
+        """
+        if not self.flush_interval:
+            return dict((f, self.counters[f]) for f in STATS_FIELDS)
+        self.flush(force=True)
+        keys = dict((self._key(f), f) for f in STATS_FIELDS)
+        data = cache.get_many(keys.keys())
+        return dict((f, data.get(k, 0)) for k, f in keys.items())
+
+    def reset(self):
+        self.counters.clear()
+        self._pending.clear()
+        cache.delete_many([ self._key(f) for f in STATS_FIELDS ])
+
+def stats_report():
+    """
+    Returns the usage of every cached function, sorted by name.
+    """
+    from conference import settings
+    for m in settings.CACHEF_STATS_MODULES:
+        importlib.import_module(m)
+    output = []
+    for name, wrapper in sorted(registry.items()):
+        row = wrapper.stats.shared()
+        lookups = row['local_hits'] + row['hits'] + row['misses']
+        computes = row['computes'] or 1
+        row.update({
+            'name': name,
+            'lookups': lookups,
+            'hit_ratio': float(row['local_hits'] + row['hits']) / (lookups or 1),
+            'avg_compute_ms': float(row['compute_ms']) / computes,
+            'avg_size': row['size'] / computes,
+        })
+        output.append(row)
+    return output
+
 class CacheFunction(object):
     CACHE_MISS = object()
 
-    def __init__(self, prefix='', timeout=WEEK, fhash=None, fkey=None):
+    def __init__(self, prefix='', timeout=WEEK, fhash=None, fkey=None, local=False):
         self.prefix = prefix
         self.timeout = timeout
         if fhash is None:
@@ -117,6 +286,7 @@ class CacheFunction(object):
         if fkey is None:
             fkey = self.generate_key
         self.fkey = fkey
+        self.local = local
 
     def __call__(self, *args, **kwargs):
         if args:
@@ -126,38 +296,205 @@ class CacheFunction(object):
         else:
             return functools.partial(self._decorator, **kwargs)
 
-    def _decorator(self, func, invalidate=None, key=None, signals=(), models=(), timeout=None):
+    def _local_cache(self, local, local_size, local_timeout):
+        """
+        Returns the LocalCache for a decorated function or None if the
+        in-process cache is disabled.
+        """
+        from conference import settings
+        if local is None:
+            local = self.local
+        if local_size is None:
+            local_size = settings.CACHEF_LOCAL_SIZE
+        if local_timeout is None:
+            local_timeout = settings.CACHEF_LOCAL_TIMEOUT
+        if not local or not local_size or not local_timeout:
+            return None
+        return LocalCache(local_size, local_timeout)
+
+    def _store(self, k, data, timeout, stale):
+        if stale:
+            cache.set_many({k: data, k + ':stale': data}, timeout)
+        else:
+            cache.set(k, data, timeout)
+
+    def _fill(self, k, call, timeout, lock_timeout, stale, stats):
+        """
+        Computes a missing value and stores it in the cache; returns the tuple
+        (value, fresh).
+
+        When `lock_timeout` is set only one process at a time computes the
+        value of a key, the others return the stale copy (if the function
+        keeps one) or wait for the lock owner to store the new value.
+        """
+        if not lock_timeout:
+            data = call()
+            self._store(k, data, timeout, stale)
+            return data, True
+
+        lock_key = k + ':lock'
+        if cache.add(lock_key, 1, lock_timeout):
+            try:
+                data = call()
+                self._store(k, data, timeout, stale)
+            finally:
+                cache.delete(lock_key)
+            return data, True
+
+        stats.incr('lock_waits')
+        if stale:
+            data = cache.get(k + ':stale', self.CACHE_MISS)
+            if data is not self.CACHE_MISS:
+                stats.incr('stale_hits')
+                return data, False
+
+        deadline = time.time() + lock_timeout
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL)
+            data = cache.get(k, self.CACHE_MISS)
+            if data is not self.CACHE_MISS:
+                return data, True
+            if cache.get(lock_key) is None:
+                break
+        # the lock owner failed (or it is too slow), computes the value here
+        data = call()
+        self._store(k, data, timeout, stale)
+        return data, True
+
+    def _new_generation(self):
+        # a time based starting value guarantees that, if a generation
+        # counter is evicted from the cache, the new one does not reuse the
+        # keys computed with the old counter.
+        return int(time.time() * 1000)
+
+    def generations(self, names):
+        """
+        Returns a dict with the current generation of the passed namespaces.
+        """
+        gkeys = dict((self.fhash(n), n) for n in set(names))
+        found = cache.get_many(gkeys.keys())
+        missing = dict((k, self._new_generation()) for k in gkeys if k not in found)
+        if missing:
+            cache.set_many(missing, None)
+            found.update(missing)
+        return dict((gkeys[k], v) for k, v in found.items())
+
+    def bump(self, names):
+        """
+        Invalidates, in O(1), all the keys computed in the passed namespaces.
+        """
+        for n in names:
+            k = self.fhash(n)
+            try:
+                cache.incr(k)
+            except ValueError:
+                cache.set(k, self._new_generation(), None)
+
+    def _decorator(self, func, invalidate=None, key=None, signals=(), models=(), timeout=None,
+                   local=None, local_size=None, local_timeout=None,
+                   single_flight=False, lock_timeout=LOCK_TIMEOUT, stale=False,
+                   namespace=None):
+        """
+        `single_flight=True` uses a lock stored in the cache to be sure that
+        only one process at a time recomputes a missing key; with `stale=True`
+        (that implies single_flight) the invalidated value is kept aside and
+        returned to the other processes while the lock owner refreshes it.
+
+        `namespace` is a template (or a tuple of templates) formatted with the
+        function arguments, like `key`; every key is tied to the current
+        generation of its namespaces and the names returned by `invalidate`
+        are namespaces to bump instead of keys to delete; `invalidate` is
+        called even for the `invalidated` signals of other cached functions,
+        whose keys (in `cache_keys`) are not namespaces.
+        """
         if key is None:
             key = func.__name__
             if invalidate is None:
                 invalidate = (func.__name__,)
         if timeout is None:
             timeout = self.timeout
+        lcache = self._local_cache(local, local_size, local_timeout)
+        if callable(key):
+            name = func.__name__
+        else:
+            name = key.split('%', 1)[0].rstrip(':') or func.__name__
+        stats = CacheStats(self.prefix + name)
+        if not (single_flight or stale):
+            lock_timeout = None
+        if isinstance(namespace, basestring):
+            namespace = (namespace,)
+
+        if self.fkey == self.generate_key:
+            build_key = self.compile_key(key, func)
+        else:
+            build_key = lambda args, kwargs: self.fkey(key, func, args, kwargs)
+        build_namespaces = [
+            self.compile_template(ns, func, self.prefix + 'ns:')
+            for ns in namespace or () ]
+
+        def namespaces(args, kwargs):
+            return [ b(args, kwargs) for b in build_namespaces ]
+
+        def make_key(args, kwargs, gens=None):
+            k = build_key(args, kwargs)
+            if namespace:
+                names = namespaces(args, kwargs)
+                if gens is None:
+                    gens = self.generations(names)
+                k += ''.join(':%s' % gens[n] for n in names)
+            return self.fhash(k)
 
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            k = self.fhash(self.fkey(key, func, args, kwargs))
+            k = make_key(args, kwargs)
+            if lcache is not None:
+                data = lcache.get(k, self.CACHE_MISS)
+                if data is not self.CACHE_MISS:
+                    stats.incr('local_hits')
+                    return data
             data = cache.get(k, self.CACHE_MISS)
+            fresh = True
             if data is self.CACHE_MISS:
-                data = func(*args, **kwargs)
-                cache.set(k, data, timeout)
+                stats.incr('misses')
+                data, fresh = self._fill(
+                    k, lambda: stats.measure(func, *args, **kwargs),
+                    timeout, lock_timeout, stale, stats)
+            else:
+                stats.incr('hits')
+            if lcache is not None and fresh:
+                lcache.set(k, data)
             return data
 
+        def drop(keys):
+            """
+            Invalidates the passed keys (the namespaces for a function with a
+            `namespace`), for the writes that do not emit the model signals.
+            """
+            if isinstance(keys, basestring):
+                keys = (keys,)
+            if namespace:
+                self.bump([ self.prefix + 'ns:' + k for k in keys ])
+                if lcache is not None:
+                    lcache.clear()
+            else:
+                prefixed = [ self.prefix + k for k in keys ]
+                hashed = map(self.fhash, prefixed)
+                cache.delete_many(hashed)
+                if lcache is not None:
+                    lcache.delete_many(hashed)
+            stats.incr('invalidations', len(keys))
+            wrapper.invalidated.send(wrapper, cache_keys=keys)
+
         if invalidate:
             def iwrapper(sender, **kwargs):
-                try:
+                if 'cache_keys' in kwargs and not namespace:
                     keys = kwargs['cache_keys']
-                except KeyError:
-                    if callable(invalidate):
-                        keys = invalidate(sender, **kwargs)
-                    else:
-                        keys = invalidate
+                elif callable(invalidate):
+                    keys = invalidate(sender, **kwargs)
+                else:
+                    keys = invalidate
                 if keys:
-                    if isinstance(keys, basestring):
-                        keys = (keys,)
-                    prefixed = [ self.prefix + k for k in keys ]
-                    cache.delete_many(map(self.fhash, prefixed))
-                    wrapper.invalidated.send(wrapper, cache_keys=keys)
+                    drop(keys)
 
             for s in signals:
                 s.connect(iwrapper, weak=False)
@@ -166,9 +503,13 @@ class CacheFunction(object):
                 post_save.connect(iwrapper, sender=m, weak=False)
                 pre_delete.connect(iwrapper, sender=m, weak=False)
 
-        def get_from_cache(fargs):
-            cache_keys = {}
-            for ix, farg in enumerate(fargs):
+        def cache_keys_of(fargs):
+            """
+            Returns the cache keys of a list of calls; every element of
+            `fargs` is an args tuple, a kwargs dict or an (args, kwargs) pair.
+            """
+            calls = []
+            for farg in fargs:
                 if isinstance(farg, (list, tuple))\
                     and len(farg) == 2\
                     and isinstance(farg[0], (list, tuple))\
@@ -180,27 +521,160 @@ class CacheFunction(object):
                 else:
                     args = farg
                     kwargs = {}
-                k = self.fhash(self.fkey(key, func, args, kwargs))
-                cache_keys[k] = (ix, farg)
+                calls.append((args, kwargs))
+
+            gens = None
+            if namespace:
+                names = []
+                for args, kwargs in calls:
+                    names.extend(namespaces(args, kwargs))
+                gens = self.generations(names)
+
+            return [ make_key(args, kwargs, gens) for args, kwargs in calls ]
+
+        def get_from_cache(fargs):
+            cache_keys = {}
+            for ix, k in enumerate(cache_keys_of(fargs)):
+                cache_keys[k] = (ix, fargs[ix])
 
-            results = cache.get_many(cache_keys.keys())
             output = [ self.CACHE_MISS ] * len(fargs)
-            for k, v in cache_keys.items():
-                ix = v[0]
+            remote = cache_keys.keys()
+            if lcache is not None:
+                remote = []
+                for k, v in cache_keys.items():
+                    data = lcache.get(k, self.CACHE_MISS)
+                    if data is self.CACHE_MISS:
+                        remote.append(k)
+                    else:
+                        stats.incr('local_hits')
+                        output[v[0]] = data
+
+            results = cache.get_many(remote) if remote else {}
+            for k in remote:
+                ix = cache_keys[k][0]
                 try:
                     output[ix] = results[k]
                 except KeyError:
                     pass
+                else:
+                    stats.incr('hits')
+                    if lcache is not None:
+                        lcache.set(k, output[ix])
             return output
+
+        def set_many_to_cache(fargs, values):
+            """
+            Stores, with a single set_many, the values of a list of calls
+            (`fargs` has the same format used by get_from_cache).
+            """
+            data = {}
+            for k, v in zip(cache_keys_of(fargs), values):
+                data[k] = v
+                if stale:
+                    data[k + ':stale'] = v
+                if lcache is not None:
+                    lcache.set(k, v)
+            if data:
+                cache.set_many(data, timeout)
+
+        def batch(ids, preload):
+            """
+            Batch version of a function with the signature `f(id, preload=None)`.
+
+            Returns the value for every id; the cache misses are computed
+            passing the preload data built by `preload(missing_ids)` (a dict
+            id -> preload) and stored with a single set_many.
+            """
+            ids = list(ids)
+            cached = get_from_cache([ (x,) for x in ids ])
+            missing = []
+            seen = set()
+            for x, v in zip(ids, cached):
+                if v is self.CACHE_MISS and x not in seen:
+                    seen.add(x)
+                    missing.append(x)
+            if not missing:
+                return cached
+
+            stats.incr('misses', len(missing))
+            data = preload(missing)
+            computed = dict((x, stats.measure(func, x, preload=data[x])) for x in missing)
+            set_many_to_cache([ (x,) for x in missing ], [ computed[x] for x in missing ])
+            return [ computed[x] if v is self.CACHE_MISS else v for x, v in zip(ids, cached) ]
+
         wrapper.get_from_cache = get_from_cache
+        wrapper.set_many_to_cache = set_many_to_cache
+        wrapper.batch = batch
+        wrapper.invalidate = drop
         wrapper.invalidated = Signal(providing_args=['cache_keys'])
+        wrapper.local_cache = lcache
+        wrapper.stats = stats
+        registry[stats.name] = wrapper
         return wrapper
 
     def hash_key(self, key):
         if isinstance(key, unicode):
             key = key.encode('utf-8')
+        if RAW_KEY.match(key):
+            return key
         return hashlib.md5(key).hexdigest()
 
+    def compile_template(self, template, func, prefix):
+        """
+        Returns a function (args, kwargs) -> prefix + template % <func arguments>.
+
+        The position of every placeholder among the function arguments is
+        computed here, so the returned function does not need getcallargs
+        unless the call passes the arguments in an unusual way.
+        """
+        def generic(args, kwargs):
+            return prefix + template % getcallargs(func, *args, **kwargs)
+
+        names = KEY_FIELD.findall(template)
+        if not names:
+            if '%' in template.replace('%%', ''):
+                return generic
+            k = prefix + template % {}
+            return lambda args, kwargs: k
+        try:
+            fargs, varargs, varkw, defaults = getargspec(func)
+        except TypeError:
+            return generic
+        if ismethod(func) or varargs or varkw or not all(n in fargs for n in names):
+            return generic
+
+        positional = KEY_FIELD.sub('%', template)
+        defaults = dict(zip(fargs[len(fargs) - len(defaults or ()):], defaults or ()))
+        fields = [ (fargs.index(n), n) for n in names ]
+
+        def build(args, kwargs):
+            values = []
+            nargs = len(args)
+            for ix, n in fields:
+                if ix < nargs:
+                    values.append(args[ix])
+                elif n in kwargs:
+                    values.append(kwargs[n])
+                elif n in defaults:
+                    values.append(defaults[n])
+                else:
+                    # let getcallargs raise the right exception
+                    return generic(args, kwargs)
+            return prefix + positional % tuple(values)
+        return build
+
+    def compile_key(self, key, func):
+        """
+        Precompiled version of generate_key for the function `func`; returns
+        a function (args, kwargs) -> key.
+        """
+        if callable(key):
+            return lambda args, kwargs: key(func, *args, **kwargs)
+        if not KEY_FIELD.search(key) and '%' in key.replace('%%', ''):
+            # positional template, eg. "data:%s:%s"
+            return lambda args, kwargs: self.generate_key(key, func, args, kwargs)
+        return self.compile_template(key, func, self.prefix)
+
     def generate_key(self, key, func, args, kwargs):
         if callable(key):
             return key(func, *args, **kwargs)
@@ -35,10 +35,8 @@ def _dump_fields(o):
 
 
 def _i_deadlines(sender, **kw):
-    years = set(x.year for x in models.Deadline.objects.all().values_list('date', flat=True))
-    years.add(None)
-    languages = set([ l[0] for l in settings.LANGUAGES ])
-    return [ 'deadlines:%s:%s' % (l, y) for l in languages for y in years ]
+    # every deadlines:<lang>:<year> key lives in the same namespace
+    return 'deadlines'
 
 def deadlines(lang, year=None):
     qs = models.Deadline.objects\
@@ -66,6 +64,7 @@ def deadlines(lang, year=None):
 
 deadlines = cache_me(
     models=(models.Deadline, models.DeadlineContent),
+    namespace='deadlines',
     key='deadlines:%(lang)s:%(year)s',
     timeout=5*60)(deadlines, _i_deadlines)
 
@@ -136,12 +135,10 @@ def _i_schedule_data(sender, **kw):
 
 schedule_data = cache_me(
     models=(models.Schedule, models.Track),
+    local=True,
     key='schedule:%(sid)s')(schedule_data, _i_schedule_data)
 
-def schedules_data(sids):
-    cached = zip(sids, schedule_data.get_from_cache([ (x,) for x in sids ]))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+def _preload_schedules(missing):
     preload = {}
     schedules = models.Schedule.objects\
         .filter(id__in=missing)
@@ -156,15 +153,10 @@ def schedules_data(sids):
         }
     for t in tracks:
         preload[t.schedule_id]['tracks'].append(t)
+    return preload
 
-    output = []
-    for ix, e in enumerate(cached):
-        sid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = schedule_data(sid, preload=preload[sid])
-        output.append(val)
-
-    return output
+def schedules_data(sids):
+    return schedule_data.batch(sids, _preload_schedules)
 
 def talk_data(tid, preload=None):
     if preload is None:
@@ -241,12 +233,11 @@ def _i_talk_data(sender, **kw):
 
 talk_data = cache_me(
     models=(models.Talk, models.Speaker, models.TalkSpeaker, comments.get_model()),
+    local=True,
+    stale=True,
     key='talk_data:%(tid)s')(talk_data, _i_talk_data)
 
-def talks_data(tids):
-    cached = zip(tids, talk_data.get_from_cache([ (x,) for x in tids ]))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+def _preload_talks(missing):
     preload = {}
     talks = models.Talk.objects\
         .filter(id__in=missing)
@@ -303,15 +294,10 @@ def talks_data(tids):
     # talk_data uses profile_data, we try to fetch all the data of the speaker
     # because we need to optimize the number of needed queries.
     profiles_data(pids)
+    return preload
 
-    output = []
-    for ix, e in enumerate(cached):
-        tid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = talk_data(tid, preload=preload[tid])
-        output.append(val)
-
-    return output
+def talks_data(tids):
+    return talk_data.batch(tids, _preload_talks)
 
 def speaker_data(sid, preload=None):
     if preload is None:
@@ -361,12 +347,10 @@ def _i_speaker_data(sender, **kw):
 
 speaker_data = cache_me(
     models=(models.Speaker, models.Talk, models.TalkSpeaker, models.AttendeeProfile, User),
+    local=True,
     key='speaker_data:%(sid)s')(speaker_data, _i_speaker_data)
 
-def speakers_data(sids):
-    cached = zip(sids, speaker_data.get_from_cache([ (x,) for x in sids ]))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+def _preload_speakers(missing):
     preload = {}
     speakers = models.Speaker.objects\
         .filter(user__in=missing)
@@ -387,15 +371,10 @@ def speakers_data(sids):
             'talk__conference': t['talk__conference'],
             'talk__type': t['talk__type'],
         })
+    return preload
 
-    output = []
-    for ix, e in enumerate(cached):
-        sid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = speaker_data(sid, preload=preload[sid])
-        output.append(val)
-
-    return output
+def speakers_data(sids):
+    return speaker_data.batch(sids, _preload_speakers)
 
 def event_data(eid, preload=None):
     if preload is None:
@@ -455,6 +434,8 @@ def _i_event_data(sender, **kw):
 
 event_data = cache_me(
     models=(models.Event, models.Talk, models.Schedule, models.Track),
+    local=True,
+    stale=True,
     key='event:%(eid)s')(event_data, _i_event_data)
 
 def tags():
@@ -502,27 +483,18 @@ def tags_for_talks(conference=None, status=None):
     return list(qs)
 
 def _i_tags_for_talks(sender, **kw):
-    statuses = [ x[0] for x in models.TALK_STATUS ]
+    # a talk affects only the keys of its conference, a tag the keys of
+    # every conference.
     if sender is models.Talk:
-        conf = [ kw['instance'].conference ]
-    else:
-        conf = models.Conference.objects.all().values_list('code', flat=True)
-    return [ 'talks_data:%s:%s' % (c, s) for s in statuses for c in conf ]
+        return 'talks_data:%s' % kw['instance'].conference
+    return 'talks_data'
 
 tags_for_talks = cache_me(
     models=(models.Talk, models.ConferenceTaggedItem, models.ConferenceTag,),
+    namespace=('talks_data', 'talks_data:%(conference)s'),
     key='talks_data:%(conference)s:%(status)s')(tags_for_talks, _i_tags_for_talks)
 
-def events(eids=None, conf=None):
-    if eids is None:
-        eids = models.Event.objects\
-            .filter(schedule__conference=conf)\
-            .values_list('id', flat=True)\
-            .order_by('start_time')
-
-    cached = zip(eids, event_data.get_from_cache([ (x,) for x in eids ]))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+def _preload_events(missing):
     preload = {}
     events = models.Event.objects\
         .filter(id__in=missing)\
@@ -550,15 +522,15 @@ def events(eids=None, conf=None):
             .filter(id__in=events.values('schedule_id').distinct())\
             .values_list('id', flat=True)
     )
+    return preload
 
-    output = []
-    for ix, e in enumerate(cached):
-        eid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = event_data(eid, preload=preload[eid])
-        output.append(val)
-
-    return output
+def events(eids=None, conf=None):
+    if eids is None:
+        eids = models.Event.objects\
+            .filter(schedule__conference=conf)\
+            .values_list('id', flat=True)\
+            .order_by('start_time')
+    return event_data.batch(eids, _preload_events)
 
 def _i_profile_data(sender, **kw):
     if sender is models.AttendeeProfile:
@@ -636,12 +608,10 @@ def profile_data(uid, preload=None):
 
 profile_data = cache_me(
     models=(models.AttendeeProfile, models.Speaker, models.TalkSpeaker, User),
+    local=True,
     key='profile:%(uid)s')(profile_data, _i_profile_data)
 
-def profiles_data(pids):
-    cached = zip(pids, profile_data.get_from_cache([ (x,) for x in pids ]))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+def _preload_profiles(missing):
     preload = {}
     profiles = models.AttendeeProfile.objects\
         .filter(user__in=missing)\
@@ -662,15 +632,10 @@ def profiles_data(pids):
 
     for b in bios:
         preload[b.object_id]['bio'] = b
+    return preload
 
-    output = []
-    for ix, e in enumerate(cached):
-        pid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = profile_data(pid, preload=preload[pid])
-        output.append(val)
-
-    return output
+def profiles_data(pids):
+    return profile_data.batch(pids, _preload_profiles)
 
 def fares(conference):
     output = []
@@ -704,6 +669,83 @@ user_votes = cache_me(
     models=(models.VotoTalk,),
     key='user_votes:%(uid)s:%(conference)s')(user_votes, _i_user_votes)
 
+def voting_catalogue(conference):
+    """
+    The part of the voting page that is the same for every user: the
+    proposed talks in speaker order, with their ordinal number (the position
+    by creation date), type, language, tags and speakers, and the indexes
+    of the talk ids by type, language and tag.
+    """
+    talks = list(models.Talk.objects\
+        .proposed(conference=conference)\
+        .values('id', 'type', 'language', 'created'))
+    tids = [ t['id'] for t in talks ]
+    speakers = defaultdict(list)
+    for r in models.TalkSpeaker.objects\
+            .filter(talk__in=tids)\
+            .values('talk', 'speaker__user__first_name', 'speaker__user__last_name'):
+        speakers[r['talk']].append((r['speaker__user__first_name'], r['speaker__user__last_name']))
+    tags = defaultdict(list)
+    talk_tags = set()
+    ctt = ContentType.objects.get_for_model(models.Talk)
+    for oid, name in models.ConferenceTaggedItem.objects\
+            .filter(content_type=ctt)\
+            .values_list('object_id', 'tag__name'):
+        talk_tags.add(name)
+        tags[oid].append(name)
+
+    for ix, t in enumerate(sorted(talks, key=lambda x: (x['created'], x['id']))):
+        t['ordinal'] = ix
+    # same order of the ORDER BY on the speaker names used by the view: a
+    # talk is listed with its first speaker, the talks without speakers last
+    def key(t):
+        names = sorted(speakers[t['id']])
+        return (not names, names[:1], t['id'])
+    talks.sort(key=key)
+
+    by_type = defaultdict(set)
+    by_language = defaultdict(set)
+    by_tag = defaultdict(set)
+    output = []
+    for t in talks:
+        tid = t['id']
+        by_type[t['type']].add(tid)
+        by_language[t['language']].add(tid)
+        for name in tags[tid]:
+            by_tag[name].add(tid)
+        output.append({
+            'id': tid,
+            'ordinal': t['ordinal'],
+            'type': t['type'],
+            'language': t['language'],
+            'tags': sorted(tags[tid]),
+            'speakers': [ u'%s %s' % x for x in sorted(speakers[tid]) ],
+        })
+    return {
+        'talks': output,
+        'types': dict(by_type),
+        'languages': dict(by_language),
+        'tags': dict(by_tag),
+        # the tags used by any talk, also of the other conferences
+        'talk_tags': talk_tags,
+    }
+
+def _i_voting_catalogue(sender, **kw):
+    o = kw['instance']
+    if sender is models.Talk:
+        return 'voting_catalogue:%s' % o.conference
+    elif sender is models.TalkSpeaker:
+        return 'voting_catalogue:%s' % o.talk.conference
+    elif o.content_type.app_label == 'conference' and o.content_type.model == 'talk':
+        # the list of the tags used by the talks is shared by all the
+        # conferences
+        return [ 'voting_catalogue:%s' % x
+            for x in models.Conference.objects.all().values_list('code', flat=True) ]
+
+voting_catalogue = cache_me(
+    models=(models.Talk, models.TalkSpeaker, models.ConferenceTaggedItem),
+    key='voting_catalogue:%(conference)s')(voting_catalogue, _i_voting_catalogue)
+
 def user_events_interest(uid, conference):
     """
     Get the interesting events for the selected user, conference.
@@ -749,14 +791,16 @@ conference_booking_status = cache_me(
 def expected_attendance(conference):
     data = models.Schedule.objects.expected_attendance(conference)
     vals = data.values()
-    max_score = max([ x['score'] for x in vals ])
+    max_score = max([ x['score'] for x in vals ] or [0])
     for x in vals:
         x['score_normalized'] = x['score'] / (max_score or 1)
     return data
 
 def _i_expected_attendance(sender, **kw):
-    if sender is models.EventInterest:
+    if sender in (models.EventInterest, models.EventBooking):
         conf = kw['instance'].event.schedule.conference
+    elif sender is models.Event:
+        conf = kw['instance'].schedule.conference
     elif sender is models.Track:
         conf = kw['instance'].schedule.conference
     elif sender is models.EventTrack:
@@ -764,6 +808,6 @@ def _i_expected_attendance(sender, **kw):
     return 'expected_attendance:%s' % conf
 
 expected_attendance = cache_me(
-    models=(models.EventInterest, models.Track, models.EventTrack,),
+    models=(models.EventInterest, models.EventBooking, models.Event, models.Track, models.EventTrack,),
     key='expected_attendance:%(conference)s')(expected_attendance, _i_expected_attendance)
 
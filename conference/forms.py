@@ -2,7 +2,6 @@
 from django import forms
 from django.conf import settings as dsettings
 from django.contrib.admin import widgets as admin_widgets
-from django.core import mail
 from django.db import transaction
 from django.forms import widgets
 from django.forms.utils import flatatt
@@ -13,44 +12,12 @@ from django.utils.translation import ugettext as _
 from conference import models
 from conference import settings
 
-from p3 import utils as p3utils
-
 from taggit.forms import TagField
 
 import logging
 
 log = logging.getLogger('conference.tags')
 
-### Helpers
-
-def mass_mail(messages, data, addresses, feedback_address):
-
-    # Mass send the emails
-    mail.send_mass_mail(messages)
-
-    # Send feedback mail
-    ctx = dict(data)
-    ctx['addresses'] = '\n'.join(addresses)
-    feedback_email = ("""
-message sent
--------------------------------
-FROM: %(from_)s
-SUBJECT: %(subject)s
-BODY:
-%(body)s
--------------------------------
-sent to:
-%(addresses)s
-""" % ctx)
-    mail.send_mail(
-        '[%s] feedback mass mailing (admin stats)' % settings.CONFERENCE,
-        feedback_email,
-        dsettings.DEFAULT_FROM_EMAIL,
-        recipient_list=[feedback_address],
-     )
-
-###
-
 def validate_tags(tags):
     """
     Returns only tags that are already present in the database
@@ -523,93 +490,41 @@ class AdminSendMailForm(forms.Form):
         if real:
             self.fields['send_email'].required = True
 
-    def load_emails(self):
-        if not settings.ADMIN_TICKETS_STATS_EMAIL_LOG:
-            return []
-        try:
-            f = file(settings.ADMIN_TICKETS_STATS_EMAIL_LOG)
-        except:
-            return []
-        output = []
-        while True:
-            try:
-                msg = {
-                    'from_': eval(f.readline()).strip(),
-                    'subject': eval(f.readline()).strip(),
-                    'body': eval(f.readline()).strip(),
-                }
-            except:
-                break
-            f.readline()
-            if msg['from_']:
-                output.append(msg)
-            else:
-                break
-        return reversed(output)
+    def load_emails(self, page=1, per_page=10):
+        """
+        A page of the mass mailings sent from the admin, the newest first.
+        """
+        from django.core.paginator import Paginator, InvalidPage
 
-    def save_email(self):
-        if not settings.ADMIN_TICKETS_STATS_EMAIL_LOG:
-            return False
-        data = self.cleaned_data
-        with file(settings.ADMIN_TICKETS_STATS_EMAIL_LOG, 'a') as f:
-            f.write('%s\n' % repr(data['from_']))
-            f.write('%s\n' % repr(data['subject']))
-            f.write('%s\n' % repr(data['body']))
-            f.write('------------------------------------------\n')
-        return True
+        pages = Paginator(models.BulkMailJob.objects.order_by('-created'), per_page)
+        try:
+            return pages.page(page)
+        except InvalidPage:
+            return pages.page(pages.num_pages)
 
     def preview(self, *uids):
-        from django.template import Template, Context
         from django.contrib.auth.models import User
+        from conference import bulkmail
 
         data = self.cleaned_data
+        tpls = bulkmail.templates(data['subject'], data['body'])
+        return bulkmail.render(tpls, list(User.objects.filter(id__in=uids)))
 
-        if settings.ADMIN_TICKETS_STATS_EMAIL_LOAD_LIBRARY:
-            libs = '{%% load %s %%}' % ' '.join(settings.ADMIN_TICKETS_STATS_EMAIL_LOAD_LIBRARY)
-        else:
-            libs = ''
-        tSubject = Template(libs + data['subject'])
-        tBody = Template(libs + data['body'])
-
-        conf = models.Conference.objects.current()
-
-        output = []
-        for u in User.objects.filter(id__in=uids):
-            ctx = Context({
-                'user': u,
-                'conf': conf,
-                'tickets': p3utils.get_tickets_assigned_to(u),
-            })
-            output.append((
-                tSubject.render(ctx),
-                tBody.render(ctx),
-                u,
-            ))
-        return output
-
-    def send_emails(self, uids, feedback_address):
-        messages = []
-        addresses = []
-        data = self.cleaned_data
+    def send_emails(self, uids, feedback_address, conference='', stat_code='', author=None):
+        """
+        Queues the messages to the users, sent in background by the
+        `send_bulk_mail` command; returns the number of messages.
+        """
+        from conference import bulkmail
 
-        # Make sure we don't send duplicate emails to the same uid
-        uids = list(set(uids))
-
-        # Prepare emails
-        for sbj, body, user in self.preview(*uids):
-            messages.append((sbj, body, data['from_'], [user.email]))
-            addresses.append('"%s %s" - %s' % (user.first_name, user.last_name, user.email))
-
-        # Mass send the emails (in a separate process)
-        import multiprocessing
-        process = multiprocessing.Process(
-            target=mass_mail,
-            args=(messages, data, addresses, feedback_address))
-        process.daemon=True
-        process.start()
-        # Let it run until completion without joining it again
-        process = None
-        return len(messages)
+        data = self.cleaned_data
+        job = bulkmail.queue(
+            data['from_'], data['subject'], data['body'], uids,
+            feedback_address=feedback_address,
+            conference=conference,
+            stat_code=stat_code,
+            author=author)
+        return job.total
 
 class AttendeeLinkDescriptionForm(forms.Form):
     message = forms.CharField(label='A note to yourself (when you met this persone, why you want to stay in touch)', widget=forms.Textarea)
@@ -3,33 +3,50 @@ from datetime import datetime
 
 # FIXME: We can use an external library.
 
-def encode(line):
+def fold(line):
+    """
+    Yields the pieces of a content line folded at 75 octets, in a single
+    pass; a line is never cut in the middle of a multi-byte UTF-8 sequence.
+    """
     if isinstance(line, unicode):
         line = line.encode('utf-8')
     if not line.endswith('\r\n'):
         line += '\r\n'
-    if len(line) > 75:
-        fold = [ line ]
-        while len(fold[-1]) > 75:
-            l = fold[-1]
-            # 73, because it will be added CRLF
-            pos = 73
-            # It's a bad idea to truncate the string (maybe UTF-8) with a random number,
-            # because I will break a multi-bytes sequence and the file will be unreadable.
-            while True:
-                ready = fold[-1][:pos]
-                try:
-                    ready.decode('utf-8')
-                except UnicodeDecodeError:
-                    pos -= 1
-                    if pos == 0:
-                        raise ValueError('cannot encode: %s' % line)
-                else:
-                    break
-            fold[-1] = ready
-            fold.append(' ' + l[pos:])
-        line = '\r\n'.join(fold)
-    return line
+    start = 0
+    prefix = ''
+    while len(line) - start + len(prefix) > 75:
+        # 73, because it will be added CRLF
+        pos = start + 73 - len(prefix)
+        # step back to the first byte of a multi-byte sequence
+        while pos > start and (ord(line[pos]) & 0xC0) == 0x80:
+            pos -= 1
+        if pos == start:
+            raise ValueError('cannot encode: %s' % line)
+        yield prefix + line[start:pos] + '\r\n'
+        start = pos
+        prefix = ' '
+    yield prefix + line[start:]
+
+def encode(line):
+    return ''.join(fold(line))
+
+def stream(component, chunk_size=16*1024):
+    """
+    Encodes the component yielding chunks of about `chunk_size` bytes, to be
+    used with a StreamingHttpResponse without keeping the whole document in
+    memory.
+    """
+    chunk = []
+    size = 0
+    for line in component.encode():
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
 
 def content(name, value, params=None):
     if params:
@@ -108,6 +125,17 @@ class Component(dict):
                 yield line
         yield content('END', self.name)
 
+class Encoded(object):
+    """
+    A component already encoded (for example a cached VEVENT), usable as
+    subcomponent of a Component.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def encode(self):
+        yield self.data
+
 class Event(Component):
     def __init__(
         self,
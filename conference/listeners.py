@@ -1,8 +1,8 @@
 # -*- coding: UTF-8 -*-
-from conference.models import Talk, Event, TalkSpeaker
+from conference.models import Talk, Event, TalkSpeaker, VotoTalk
 
 from django.dispatch import Signal
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from conference import settings
 
 import logging
@@ -88,3 +88,38 @@ post_save.connect(on_talk_saved, sender=TalkSpeaker)
 # Also I draw the event because there is a custom acion in the admin that
 # sets all the talks present in the schedule as accepted.
 post_save.connect(on_talk_saved, sender=Event)
+
+# The pairwise table of the talk voting (conference.ranking) is updated at
+# every vote change; the ranking module is imported lazily because it needs
+# NumPy.
+def _on_vote_pre_save(sender, **kw):
+    o = kw['instance']
+    o._old_vote = None
+    if o.pk:
+        o._old_vote = VotoTalk.objects\
+            .filter(pk=o.pk)\
+            .values_list('vote', flat=True)\
+            .first()
+
+def _on_vote_saved(sender, **kw):
+    from conference import ranking
+    o = kw['instance']
+    ranking.update_preferences(o.user_id, {o.talk_id: (getattr(o, '_old_vote', None), o.vote)})
+
+def _on_vote_deleted(sender, **kw):
+    from conference import ranking
+    o = kw['instance']
+    ranking.update_preferences(o.user_id, {o.talk_id: (o.vote, None)})
+
+def _on_talk_created(sender, **kw):
+    if kw['created'] and not kw.get('raw'):
+        from conference import ranking
+        ranking.add_talk_preferences(kw['instance'])
+
+pre_save.connect(_on_vote_pre_save, sender=VotoTalk)
+post_save.connect(_on_vote_saved, sender=VotoTalk)
+post_delete.connect(_on_vote_deleted, sender=VotoTalk)
+post_save.connect(_on_talk_created, sender=Talk)
+
+# the listeners that keep the talk search up to date
+import conference.search
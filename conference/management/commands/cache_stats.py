@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from conference import cachef
+
+from optparse import make_option
+
+class Command(BaseCommand):
+    """
+    Shows the usage of the functions cached with conference.cachef
+    (aggregated from all the processes).
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--sort',
+            action='store',
+            dest='sort',
+            default='name',
+            help='Sort by this column (name, lookups, hit_ratio, misses, avg_compute_ms, avg_size, invalidations)',
+        ),
+        make_option('--reset',
+            action='store_true',
+            dest='reset',
+            default=False,
+            help='Reset the counters',
+        ),
+    )
+    def handle(self, *args, **options):
+        report = cachef.stats_report()
+        if options['reset']:
+            for row in report:
+                cachef.registry[row['name']].stats.reset()
+            return
+
+        sort = options['sort']
+        report.sort(key=lambda x: x[sort], reverse=sort != 'name')
+        print '%-40s %10s %7s %10s %10s %10s %10s %8s' % (
+            'function', 'lookups', 'hit %', 'misses', 'stale', 'avg ms', 'avg size', 'inval.')
+        for row in report:
+            print '%-40s %10d %6.1f%% %10d %10d %10.1f %10d %8d' % (
+                row['name'], row['lookups'], row['hit_ratio'] * 100, row['misses'],
+                row['stale_hits'], row['avg_compute_ms'], row['avg_size'], row['invalidations'])
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import ast
+
+from django.core.management.base import BaseCommand, CommandError
+from conference import models
+from conference import settings
+
+class Command(BaseCommand):
+    """
+    Imports the mailings logged in settings.CONFERENCE_ADMIN_TICKETS_STATS_EMAIL_LOG
+    (or in the file passed as argument) in the history of the admin
+    mailings; the file was written with three repr() lines per mailing
+    (from, subject and body) followed by a separator.
+    """
+    def handle(self, *args, **options):
+        try:
+            path = args[0]
+        except IndexError:
+            path = settings.ADMIN_TICKETS_STATS_EMAIL_LOG
+        if not path:
+            raise CommandError('log file not specified')
+
+        jobs = []
+        with open(path) as f:
+            while True:
+                lines = [ f.readline() for _ in range(4) ]
+                if not lines[0]:
+                    break
+                try:
+                    from_, subject, body = [ ast.literal_eval(l.strip()).strip() for l in lines[:3] ]
+                except Exception:
+                    raise CommandError('invalid record: %r' % lines)
+                jobs.append(models.BulkMailJob(
+                    sender=from_,
+                    subject=subject,
+                    body=body,
+                    status=models.BULK_MAIL_STATUS.done,
+                ))
+        models.BulkMailJob.objects.bulk_create(jobs)
+        print '%d mailings imported' % len(jobs)
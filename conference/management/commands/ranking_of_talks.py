@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from django.core.management.base import BaseCommand, CommandError
 from conference import models
+from conference import ranking
 from conference import utils
 
 from collections import defaultdict
@@ -19,7 +20,19 @@ class Command(BaseCommand):
             action='store_true',
             dest='show_input',
             default=False,
-            help='Show the input data piped to votengine',
+            help='Show the votes in the voteengine input format',
+        ),
+        make_option('--snapshot',
+            action='store_true',
+            dest='snapshot',
+            default=False,
+            help='Use the pairwise table kept up to date at every vote (the missing vote is settings.CONFERENCE_VOTING_MISSING_VOTE)',
+        ),
+        make_option('--rebuild',
+            action='store_true',
+            dest='rebuild',
+            default=False,
+            help='Rebuild the pairwise table from the votes before the --snapshot',
         ),
     )
     def handle(self, *args, **options):
@@ -39,5 +52,11 @@ class Command(BaseCommand):
             votes = qs.count()
             users = qs.distinct().count()
             print '%d talks / %d users / %d votes' % (talks.count(), users, votes)
-            for ix, t in enumerate(utils.ranking_of_talks(talks, missing_vote=options['missing_vote'])):
+            if options['snapshot']:
+                if options['rebuild']:
+                    ranking.build_preferences(conference)
+                ranked = [ t for t, _ in ranking.snapshot(talks) ]
+            else:
+                ranked = utils.ranking_of_talks(talks, missing_vote=options['missing_vote'])
+            for ix, t in enumerate(ranked):
                 print ix+1, '-', t.id, '-', t.type, '-', t.language, '-', t.title.encode('utf-8')
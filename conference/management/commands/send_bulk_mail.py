@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.core.management.base import BaseCommand
+from conference import bulkmail
+
+from optparse import make_option
+
+class Command(BaseCommand):
+    """
+    Sends the mass mailings queued from the admin stats; with --loop keeps
+    running and looks for new mailings every --interval seconds.
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--loop',
+            action='store_true',
+            dest='loop',
+            default=False,
+            help='Keep running, waiting for new mailings',
+        ),
+        make_option('--interval',
+            action='store',
+            dest='interval',
+            default=30,
+            type='int',
+            help='Seconds between two looks for new mailings (with --loop)',
+        ),
+        make_option('--batch-size',
+            action='store',
+            dest='batch_size',
+            default=None,
+            type='int',
+            help='Messages sent through the same connection (default settings.CONFERENCE_BULK_MAIL_BATCH_SIZE)',
+        ),
+        make_option('--rate',
+            action='store',
+            dest='rate',
+            default=None,
+            type='float',
+            help='Max messages per second (default settings.CONFERENCE_BULK_MAIL_RATE)',
+        ),
+    )
+    def handle(self, *args, **options):
+        while True:
+            count = bulkmail.run_pending(batch_size=options['batch_size'], rate=options['rate'])
+            if count:
+                print '%d mailings sent' % count
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
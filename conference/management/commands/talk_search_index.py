@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from conference import models
+from conference import search
+
+class Command(BaseCommand):
+    """
+    Rebuilds the documents of the talk search and, on PostgreSQL, creates
+    their GIN index (needed once, after that they are kept up to date by
+    conference.search).
+    """
+    def handle(self, *args, **options):
+        search.rebuild()
+        print '%d talks indexed' % models.TalkSearchDocument.objects.filter(deleted=False).count()
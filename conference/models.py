@@ -912,54 +912,31 @@ class ScheduleManager(models.Manager):
         """
         return settings.SCHEDULE_ATTENDEES(conference, forecast)
 
-    def events_score_by_attendance(self, conference):
+    def events_score_by_attendance(self, conference, events=None, index=None):
         """
         Using events Interest returns a "Presence score" for each event;
         The score is proportional to the number of people who have expressed
         interest in that event.
+
+        `events` (with their `index`, see Event.objects.overlap_index) are
+        the events of the conference, if already loaded.
         """
         # I consider it an expression of interest, interest > 0, as the will to
-        # participate in an event and add the user among the participants. If the user
-        # has voted the most contemporary events. I consider his presence in proportion
-        # (so events can have fractional score)
-        events = defaultdict(set)
-        for x in EventInterest.objects\
-                    .filter(event__schedule__conference=conference, interest__gt=0)\
-                    .select_related('event__schedule'):
-            events[x.event].add(x.user_id)
+        # participate in an event and add the user among the participants.
         # In addition to EventInterest keep account of EventBooking,
         # the confidence in these cases in even greater.
-        for x in EventBooking.objects\
-                    .filter(event__schedule__conference=conference)\
-                    .select_related('event__schedule'):
-            events[x.event].add(x.user_id)
-
-        # Associate to each event the number of votes it has obtained;
-        # the operation is complicated by the fact that not all votes have the
-        # same weight; if a user has marked as +1 two events to occur
-        # Parallel obviously can not participate in both, so the
-        # his vote should be scaled
-        scores = defaultdict(lambda: 0.0)
-        for evt, users in events.items():
-            group = list(Event.objects.group_events_by_times(events, event=evt))[0]
-            while users:
-                u = users.pop()
-                # what is the presence of `` evt` u` for the event? If `u` does not take
-                # part in no other event of the same group, then 1, otherwise a value proportional
-                # to the number of events of interest.
-                found = [ evt ]
-                for other in group:
-                    if other != evt:
-                        try:
-                            events[other].remove(u)
-                        except KeyError:
-                            pass
-                        else:
-                            found.append(other)
-                score = 1.0 / len(found)
-                for f in found:
-                    scores[f.id] += score
-        return scores
+        pairs = set(EventInterest.objects\
+            .filter(event__schedule__conference=conference, interest__gt=0)\
+            .values_list('event', 'user'))
+        pairs.update(EventBooking.objects\
+            .filter(event__schedule__conference=conference)\
+            .values_list('event', 'user'))
+
+        if events is None:
+            events = Event.objects\
+                .filter(schedule__conference=conference)\
+                .select_related('schedule', 'talk')
+        return Event.objects.presence_scores(events, pairs, index=index)
 
     def expected_attendance(self, conference, factor=0.85):
         """
@@ -971,10 +948,9 @@ class ScheduleManager(models.Manager):
                     .values('event', 'track__seats'):
             seats_available[row['event']] += row['track__seats']
 
-        scores = self.events_score_by_attendance(conference)
-        events = Event.objects\
+        events = list(Event.objects\
             .filter(schedule__conference=conference)\
-            .select_related('schedule')
+            .select_related('schedule', 'talk'))
 
         output = {}
         # Now I have to make the forecast of the participants for each event,
@@ -984,16 +960,14 @@ class ScheduleManager(models.Manager):
         # me an indication of how many people are expected for the event.
         forecasts = self.attendees(conference, forecast=True)
 
-        # to calculate the score for a time band I have to do a double for the
-        # events, to limit the number of internal iterations I group events per day
-        event_by_day = defaultdict(set)
-        for e in events:
-            event_by_day[e.schedule_id].add(e)
+        # the events in the same time band of every event are computed once,
+        # with a sweep over the events of each day.
+        index = Event.objects.overlap_index(events)
+        scores = self.events_score_by_attendance(conference, events=events, index=index)
 
         for event in events:
             score = scores[event.id]
-            group = list(Event.objects\
-                .group_events_by_times(event_by_day[event.schedule_id], event=event))[0]
+            group = index[event]
 
             group_score = sum([ scores[e.id] for e in group ])
             if group_score:
@@ -1052,10 +1026,13 @@ class Track(models.Model):
         return self.track
 
 class EventManager(models.Manager):
-    def group_events_by_times(self, events, event=None):
+    def overlap_index(self, events):
         """
-        Groups the events, obviously belonging to different track, which they overlap in time.
-        Return a generator that at each iteration returns a group (list) of events.
+        Returns a dict event -> list of the events (the event itself included)
+        of the same day that overlap with it in time.
+
+        The events of every day are sorted by start time and swept once,
+        comparing each event only with the ones still running.
         """
         def overlap(range1, range2):
             # http://stackoverflow.com/questions/9044084/efficient-data-range-overlap-calculation-in-python
@@ -1064,25 +1041,108 @@ class EventManager(models.Manager):
             _overlap = (earliest_end - latest_start)
             return _overlap.days == 0 and _overlap.seconds > 0
 
-        def extract_group(event, events):
-            group = []
-            r0 = event.get_time_range()
-            for ix in reversed(range(len(events))):
-                r1 = events[ix].get_time_range()
-                if r0[0].date() == r1[0].date() and overlap(r0, r1):
-                    group.append(events.pop(ix))
-            return group
+        ranges = {}
+        by_day = defaultdict(list)
+        for e in events:
+            r = e.get_time_range()
+            ranges[e] = r
+            by_day[r[0].date()].append(e)
+
+        index = {}
+        for day_events in by_day.values():
+            day_events.sort(key=lambda x: ranges[x][0])
+            running = []
+            for e in day_events:
+                r0 = ranges[e]
+                index[e] = [e] if overlap(r0, r0) else []
+                running = [ x for x in running if ranges[x][1] > r0[0] ]
+                for x in running:
+                    if overlap(r0, ranges[x]):
+                        index[e].append(x)
+                        index[x].append(e)
+                running.append(e)
+        return index
+
+    def presence_scores(self, events, pairs, index=None):
+        """
+        Returns a dict event id -> "presence score", given the (event id,
+        user id) pairs of the users that want to attend the events.
+
+        Not all the expressions of interest have the same weight: a user who
+        wants to attend two events in parallel obviously can not participate
+        in both, so for every event the presence of a user is 1 divided by
+        the number of the events overlapping with it that the user wants to
+        attend (so events can have fractional score).
+
+        The events overlap only with the events of the same day, so every
+        day is a users x events matrix of the interests multiplied by the
+        events x events matrix of the overlaps.
+        """
+        import numpy
+
+        events = list(events)
+        if index is None:
+            index = self.overlap_index(events)
+        by_day = defaultdict(list)
+        day_of = {}
+        for e in events:
+            by_day[e.schedule.date].append(e)
+            day_of[e.id] = e.schedule.date
+        pairs_by_day = defaultdict(list)
+        for eid, uid in pairs:
+            if eid in day_of:
+                pairs_by_day[day_of[eid]].append((eid, uid))
+
+        scores = defaultdict(lambda: 0.0)
+        for day, day_pairs in pairs_by_day.items():
+            day_events = by_day[day]
+            cols = dict((e.id, ix) for ix, e in enumerate(day_events))
+            users = {}
+            rows = [ users.setdefault(uid, len(users)) for _, uid in day_pairs ]
+            interest = numpy.zeros((len(users), len(day_events)))
+            interest[rows, [ cols[eid] for eid, _ in day_pairs ]] = 1
+
+            overlap = numpy.zeros((len(day_events), len(day_events)))
+            for e in day_events:
+                overlap[cols[e.id], [ cols[x.id] for x in index[e] ]] = 1
+            # an event without duration does not overlap even with itself
+            overlap[numpy.diag_indices_from(overlap)] = 1
+
+            attended = numpy.maximum(interest.dot(overlap), 1)
+            for e, score in zip(day_events, (interest / attended).sum(axis=0)):
+                if score:
+                    scores[e.id] = float(score)
+        return scores
+
+    def group_events_by_times(self, events, event=None, index=None):
+        """
+        Groups the events, obviously belonging to different track, which they overlap in time.
+        Return a generator that at each iteration returns a group (list) of events.
+
+        `index` is the overlap_index of the events, if already available.
+        """
+        events = list(events)
+        if index is None:
+            index = self.overlap_index(events + ([event] if event and event not in events else []))
 
         if event:
-            group = extract_group(event, list(events))
-            yield group
+            members = set(events)
+            yield [ x for x in index[event] if x in members ]
         else:
             sorted_events = sorted(
                 filter(lambda x: x.get_duration() > 0, events),
                 key=lambda x: x.get_duration())
+            remaining = set(sorted_events)
             while sorted_events:
                 evt0 = sorted_events.pop()
-                group = [evt0] + extract_group(evt0, sorted_events)
+                if evt0 not in remaining:
+                    continue
+                remaining.discard(evt0)
+                group = [evt0]
+                for x in index[evt0]:
+                    if x in remaining:
+                        remaining.discard(x)
+                        group.append(x)
                 yield group
 
 class Event(models.Model):
@@ -1340,15 +1400,161 @@ class Quote(models.Model):
     class Meta:
         ordering = ['conference', 'who']
 
+class VotoTalkManager(models.Manager):
+    def save_votes(self, uid, conference, votes):
+        """
+        Saves, in a single transaction, the votes of a user for the talks of
+        a conference; `votes` is a dict talk id -> vote where a missing vote
+        (None or 0) removes the previous one.
+
+        The rows are written with bulk queries that do not emit the model
+        signals, so the pairwise table of the ranking and the user_votes
+        cache are updated here once for the whole batch. Returns the
+        number of the changed votes.
+        """
+        from conference import dataaccess, ranking
+        with transaction.atomic():
+            current = dict(self\
+                .select_for_update()\
+                .filter(user=uid, talk__in=votes.keys())\
+                .values_list('talk', 'vote'))
+            changes = {}
+            create = []
+            update = defaultdict(list)
+            delete = []
+            for tid, vote in votes.items():
+                vote = vote or None
+                old = current.get(tid)
+                if vote == old:
+                    continue
+                changes[tid] = (old, vote)
+                if vote is None:
+                    delete.append(tid)
+                elif old is None:
+                    create.append(VotoTalk(user_id=uid, talk_id=tid, vote=vote))
+                else:
+                    update[vote].append(tid)
+            if not changes:
+                return 0
+            if delete:
+                # VotoTalk has no dependent rows, the delete does not need
+                # the collector (and its per-row signals)
+                self.filter(user=uid, talk__in=delete)._raw_delete(self.db)
+            for vote, tids in update.items():
+                self.filter(user=uid, talk__in=tids).update(vote=vote)
+            if create:
+                self.bulk_create(create)
+            ranking.update_preferences(uid, changes)
+        # outside the transaction, a concurrent read must not cache the old
+        # votes again
+        dataaccess.user_votes.invalidate('user_votes:%s:%s' % (uid, conference))
+        return len(changes)
+
 class VotoTalk(models.Model):
     user = models.ForeignKey('auth.User')
     talk = models.ForeignKey(Talk)
     vote = models.DecimalField(max_digits=5, decimal_places=2)
 
+    objects = VotoTalkManager()
+
     class Meta:
         unique_together = (('user', 'talk'),)
         verbose_name = 'Talk voting'
         verbose_name_plural = 'Talk votings'
+
+class VotePreference(models.Model):
+    """
+    The pairwise table of the talk voting, updated at every VotoTalk change:
+    `count` is the number of users that prefer `talk` to `other` (a talk
+    not voted by a user counts as settings.VOTING_MISSING_VOTE); see
+    conference.ranking.
+    """
+    talk = models.ForeignKey(Talk, related_name='+')
+    other = models.ForeignKey(Talk, related_name='+')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('talk', 'other'),)
+
+class TSVectorField(models.TextField):
+    """
+    A tsvector column on PostgreSQL, a text column (left empty) on the other
+    databases; the value is written with sql by conference.search.
+    """
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'tsvector'
+        return super(TSVectorField, self).db_type(connection)
+
+class TalkSearchDocument(models.Model):
+    """
+    The text of a talk indexed by the talk search (see conference.search),
+    split by relevance: the title, the speaker names and the body (the
+    abstracts and the tags).
+    """
+    # no cascade: the document of a deleted talk is replaced by a tombstone
+    # by conference.search, that can rebuild it while the talk is deleted
+    talk = models.OneToOneField(Talk, primary_key=True, related_name='+',
+        on_delete=models.DO_NOTHING, db_constraint=False)
+    conference = models.CharField(max_length=20, db_index=True)
+    status = models.CharField(max_length=8)
+    title = models.TextField()
+    speakers = models.TextField()
+    body = models.TextField()
+    # the talk has been deleted; kept so that the in-memory indexes of the
+    # other processes see the deletion with the other changes
+    deleted = models.BooleanField(default=False)
+    # PostgreSQL only, the weighted title, speakers and body
+    vector = TSVectorField(null=True, editable=False)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+BULK_MAIL_STATUS = Choices(
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+class BulkMailJob(models.Model):
+    """
+    A mass mailing from the admin stats, sent in background by the
+    `send_bulk_mail` command (see conference.bulkmail); the jobs are also
+    the history of the mailings shown in the admin.
+    """
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated = models.DateTimeField(auto_now=True)
+    author = models.ForeignKey('auth.User', null=True, blank=True, related_name='+',
+        on_delete=models.SET_NULL)
+    # the stat whose users are the recipients
+    conference = models.CharField(max_length=20)
+    stat_code = models.CharField(max_length=100, blank=True)
+    sender = models.CharField(max_length=100)
+    subject = models.TextField()
+    body = models.TextField()
+    feedback_address = models.EmailField(blank=True)
+    status = models.CharField(max_length=8, choices=BULK_MAIL_STATUS, default=BULK_MAIL_STATUS.queued)
+    total = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # how many times the job has been started, the first run and the resumes
+    attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('-created',)
+        index_together = (('conference', 'stat_code'),)
+
+    def __unicode__(self):
+        return '%s (%s)' % (self.subject, self.status)
+
+class BulkMailRecipient(models.Model):
+    job = models.ForeignKey(BulkMailJob, related_name='recipients')
+    user = models.ForeignKey('auth.User', related_name='+')
+    sent = models.DateTimeField(null=True, blank=True)
+    error = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        unique_together = (('job', 'user'),)
+        index_together = (('job', 'sent'),)
 #
 #def _clear_track_cache(sender, **kwargs):
 #    if hasattr(sender, 'schedule_id'):
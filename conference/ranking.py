@@ -0,0 +1,234 @@
+# -*- coding: UTF-8 -*-
+"""
+In-process Schulze ranking of the talks, computed from the VotoTalk rows.
+
+It gives the same ranking as the voteengine (`-m schulze` with the talks
+sorted by creation date as tie breaker) that was run as a subprocess, but
+the pairwise matrix and the strongest paths are computed with NumPy.
+
+The pairwise matrix of a conference can also be kept in the VotePreference
+table, updated at every vote change, so that `snapshot` ranks the talks
+without reading all the votes.
+"""
+from collections import defaultdict
+
+import numpy
+from django.db import transaction
+from django.db.models import Count, F
+
+from conference import settings
+from conference.models import Talk, VotePreference, VotoTalk
+
+
+def ballots(tids, missing_vote=5):
+    """
+    Returns a matrix users x talks with the votes of every user that voted
+    at least one of the talks in `tids`; a talk not voted by the user gets
+    the `missing_vote` value.
+    """
+    index = dict((tid, ix) for ix, tid in enumerate(tids))
+    votes = VotoTalk.objects\
+        .filter(talk__in=tids)\
+        .values_list('user', 'talk', 'vote')
+    users = {}
+    rows, cols, values = [], [], []
+    for uid, tid, vote in votes:
+        rows.append(users.setdefault(uid, len(users)))
+        cols.append(index[tid])
+        values.append(float(vote))
+
+    output = numpy.empty((len(users), len(tids)))
+    output.fill(missing_vote)
+    output[rows, cols] = values
+    return output
+
+def pairwise(votes):
+    """
+    Given the users x talks matrix of the votes returns the matrix d where
+    d[i, j] is the number of users that prefer the talk i to the talk j.
+    """
+    n = votes.shape[1]
+    d = numpy.zeros((n, n))
+    # the votes take few distinct values, so every level is a single
+    # matrix product: the users that gave `level` to i and less to j.
+    below = numpy.zeros(votes.shape)
+    for level in numpy.unique(votes):
+        at = (votes == level).astype(float)
+        d += at.T.dot(below)
+        below += at
+    return d.astype(numpy.int64)
+
+def strongest_paths(d):
+    """
+    The Schulze strongest paths (computed on the margins, d[i, j] - d[j, i])
+    with a vectorized Floyd-Warshall.
+    """
+    p = d - d.T
+    for k in xrange(p.shape[0]):
+        p = numpy.maximum(p, numpy.minimum(p[:, k, None], p[None, k, :]))
+    return p
+
+def schulze_order(p, tiebreaker):
+    """
+    Returns the order of the candidates according to the strongest paths
+    `p`; `tiebreaker` is the list of the candidates in order of preference,
+    among the undefeated candidates the first one in the tiebreaker wins.
+    """
+    wins = p > p.T
+    defeats = wins.sum(axis=0)
+    done = numpy.zeros(len(tiebreaker), dtype=bool)
+    order = []
+    for _ in xrange(len(tiebreaker)):
+        for c in tiebreaker:
+            if not done[c] and defeats[c] == 0:
+                break
+        else:
+            raise ValueError('the strongest paths are not a ranking')
+        done[c] = True
+        order.append(c)
+        defeats -= wins[c]
+    return order
+
+def _rank(talks, d):
+    tiebreaker = sorted(range(len(talks)), key=lambda ix: talks[ix].created)
+    p = strongest_paths(d)
+    scores = (p > p.T).sum(axis=1)
+    return [ (talks[ix], int(scores[ix])) for ix in schulze_order(p, tiebreaker) ]
+
+def ranking(talks, missing_vote=5):
+    """
+    Returns the list of (talk, score) sorted by the Schulze ranking; the
+    score is the number of talks beaten by the talk.
+    """
+    talks = list(talks)
+    tids = [ t.id for t in talks ]
+    return _rank(talks, pairwise(ballots(tids, missing_vote=missing_vote)))
+
+def snapshot(talks):
+    """
+    Same as `ranking` (with settings.VOTING_MISSING_VOTE) but the pairwise
+    matrix is read from the VotePreference table, built at the first call
+    for a conference.
+    """
+    talks = list(talks)
+    tids = [ t.id for t in talks ]
+    if tids and not VotePreference.objects.filter(talk__in=tids).exists():
+        for conference in set(t.conference for t in talks):
+            build_preferences(conference)
+
+    index = dict((tid, ix) for ix, tid in enumerate(tids))
+    d = numpy.zeros((len(tids), len(tids)), dtype=numpy.int64)
+    rows = VotePreference.objects\
+        .filter(talk__in=tids, other__in=tids)\
+        .values_list('talk', 'other', 'count')
+    for talk, other, count in rows:
+        d[index[talk], index[other]] = count
+    return _rank(talks, d)
+
+def build_preferences(conference):
+    """
+    (Re)builds, from all the votes, the VotePreference rows of the talks of
+    the conference.
+    """
+    tids = list(Talk.objects\
+        .filter(conference=conference)\
+        .values_list('id', flat=True))
+    d = pairwise(ballots(tids, missing_vote=settings.VOTING_MISSING_VOTE))
+    rows = [
+        VotePreference(talk_id=a, other_id=b, count=int(d[i, j]))
+        for i, a in enumerate(tids)
+        for j, b in enumerate(tids)
+        if i != j ]
+    with transaction.atomic():
+        VotePreference.objects.filter(talk__conference=conference).delete()
+        VotePreference.objects.bulk_create(rows, batch_size=5000)
+
+def _vote(vote):
+    if vote is None:
+        return float(settings.VOTING_MISSING_VOTE)
+    return float(vote)
+
+def update_preferences(uid, changes):
+    """
+    Applies to the VotePreference table the changes of the votes of a user;
+    `changes` is a dict talk id -> (old vote, new vote), None is a missing
+    vote, and all the talks must be of the same conference.
+
+    A vote change affects only the pairs of its talk, so the update costs
+    a few queries regardless of the number of voters. Nothing is done if
+    the table of the conference has not been built yet.
+    """
+    changes = dict(
+        (tid, (_vote(old), _vote(new)))
+        for tid, (old, new) in changes.items()
+        if _vote(old) != _vote(new))
+    if not changes:
+        return
+    first = next(iter(changes))
+    talks = set(VotePreference.objects\
+        .filter(talk=first)\
+        .values_list('other', flat=True))
+    if not talks:
+        return
+    talks.add(first)
+
+    votes = dict(
+        (tid, _vote(vote))
+        for tid, vote in VotoTalk.objects\
+            .filter(user=uid, talk__in=talks)\
+            .values_list('talk', 'vote'))
+    # the changes are applied one after the other, starting from the
+    # ballot as it was before all of them.
+    for tid, (old, new) in changes.items():
+        votes[tid] = old
+
+    with transaction.atomic():
+        for tid, (old, new) in changes.items():
+            rows = defaultdict(list)
+            cols = defaultdict(list)
+            for other in talks:
+                if other == tid:
+                    continue
+                v = votes.get(other, _vote(None))
+                delta = int(new > v) - int(old > v)
+                if delta:
+                    rows[delta].append(other)
+                delta = int(v > new) - int(v > old)
+                if delta:
+                    cols[delta].append(other)
+            for delta, others in rows.items():
+                VotePreference.objects\
+                    .filter(talk=tid, other__in=others)\
+                    .update(count=F('count') + delta)
+            for delta, others in cols.items():
+                VotePreference.objects\
+                    .filter(talk__in=others, other=tid)\
+                    .update(count=F('count') + delta)
+            votes[tid] = new
+
+def add_talk_preferences(talk):
+    """
+    Adds the pairs of a new talk to the VotePreference table of its
+    conference (if it has been built).
+    """
+    others = list(Talk.objects\
+        .filter(conference=talk.conference)\
+        .exclude(id=talk.id)\
+        .values_list('id', flat=True))
+    if not others or not VotePreference.objects.filter(talk=others[0]).exists():
+        return
+    # nobody voted the new talk, it counts as a missing vote for everybody
+    missing = settings.VOTING_MISSING_VOTE
+    def voters(**kw):
+        return dict(VotoTalk.objects\
+            .filter(talk__in=others, **kw)\
+            .values('talk')\
+            .annotate(n=Count('user'))\
+            .values_list('talk', 'n'))
+    better = voters(vote__gt=missing)
+    worse = voters(vote__lt=missing)
+    rows = []
+    for other in others:
+        rows.append(VotePreference(talk_id=other, other_id=talk.id, count=better.get(other, 0)))
+        rows.append(VotePreference(talk_id=talk.id, other_id=other, count=worse.get(other, 0)))
+    VotePreference.objects.bulk_create(rows, batch_size=5000)
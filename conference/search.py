@@ -0,0 +1,281 @@
+# -*- coding: UTF-8 -*-
+"""
+Full-text search of the talks of all the conferences.
+
+Every talk has a TalkSearchDocument with its title, speaker names,
+abstracts and tags, rebuilt by the same signals that invalidate
+dataaccess.talk_data (plus the abstracts and the tags, that talk_data
+does not track); the documents of the existing talks are built by the
+`talk_search_index` command. The document of a deleted talk is replaced
+by a tombstone. The listeners are connected by conference.listeners, so
+the changes made outside of the web processes are indexed too.
+
+On PostgreSQL the documents are searched with the database full-text
+search, through the tsvector column written with every document and its
+GIN index (created by `talk_search_index`, syncdb does not know GIN
+indexes); on the other databases with an inverted index that every
+process keeps in memory and refreshes, before a search, with the
+documents changed (or deleted) since the previous one.
+"""
+import math
+import re
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+
+from conference import dataaccess
+from conference import models
+
+# weights of the fields of a document, for the in-memory index; on
+# PostgreSQL the same role is played by the A/B/D labels of setweight.
+WEIGHTS = (
+    ('title', 1.0),
+    ('speakers', 0.4),
+    ('body', 0.1),
+)
+
+_words = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text):
+    return [ w for w in _words.findall(text.lower()) if len(w) > 1 ]
+
+def talk_documents(tids):
+    """
+    Returns the TalkSearchDocument (unsaved) of the talks.
+    """
+    ctt = ContentType.objects.get_for_model(models.Talk)
+    body = defaultdict(list)
+    for oid, text in models.MultilingualContent.objects\
+            .filter(content_type=ctt, object_id__in=tids, content='abstracts')\
+            .values_list('object_id', 'body'):
+        body[oid].append(text)
+    for oid, name in models.ConferenceTaggedItem.objects\
+            .filter(content_type=ctt, object_id__in=tids)\
+            .values_list('object_id', 'tag__name'):
+        body[oid].append(name)
+    speakers = defaultdict(list)
+    for tid, first, last in models.TalkSpeaker.objects\
+            .filter(talk__in=tids)\
+            .values_list('talk', 'speaker__user__first_name', 'speaker__user__last_name'):
+        speakers[tid].append(u'%s %s' % (first, last))
+
+    output = []
+    talks = models.Talk.objects\
+        .filter(id__in=tids)\
+        .values('id', 'conference', 'status', 'title', 'sub_title')
+    for t in talks:
+        output.append(models.TalkSearchDocument(
+            talk_id=t['id'],
+            conference=t['conference'],
+            status=t['status'],
+            title=u'%s %s' % (t['title'], t['sub_title']),
+            speakers=u'\n'.join(speakers[t['id']]),
+            body=u'\n'.join(body[t['id']]),
+        ))
+    return output
+
+def _update_vectors(tids):
+    # the tsvector of the documents, PostgreSQL only
+    if connection.vendor != 'postgresql' or not tids:
+        return
+    sql = '''
+        UPDATE %s SET vector =
+            setweight(to_tsvector('english', title), 'A') ||
+            setweight(to_tsvector('english', speakers), 'B') ||
+            setweight(to_tsvector('english', body), 'D')
+        WHERE talk_id = ANY(%%s)
+    ''' % models.TalkSearchDocument._meta.db_table
+    cursor = connection.cursor()
+    cursor.execute(sql, [list(tids)])
+
+def create_vector_index():
+    """
+    Creates, if missing, the GIN index of the tsvector column (PostgreSQL
+    only).
+    """
+    if connection.vendor != 'postgresql':
+        return
+    table = models.TalkSearchDocument._meta.db_table
+    name = '%s_vector_gin' % table
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s',
+        [table, name])
+    if cursor.fetchone() is None:
+        cursor.execute('CREATE INDEX %s ON %s USING gin(vector)' % (name, table))
+
+def index_talks(tids):
+    """
+    Rebuilds the search documents of the talks; the talks that no longer
+    exist get a tombstone.
+    """
+    tids = list(tids)
+    docs = talk_documents(tids)
+    found = set(d.talk_id for d in docs)
+    for tid in tids:
+        if tid not in found:
+            docs.append(models.TalkSearchDocument(talk_id=tid, deleted=True))
+    models.TalkSearchDocument.objects.filter(talk__in=tids).delete()
+    models.TalkSearchDocument.objects.bulk_create(docs)
+    _update_vectors(found)
+
+def rebuild():
+    """
+    Rebuilds the search documents of all the talks.
+    """
+    create_vector_index()
+    tids = list(models.Talk.objects.values_list('id', flat=True))
+    models.TalkSearchDocument.objects.filter(deleted=False).delete()
+    for ix in range(0, len(tids), 500):
+        chunk = tids[ix:ix+500]
+        models.TalkSearchDocument.objects.bulk_create(talk_documents(chunk))
+        _update_vectors(chunk)
+
+class InvertedIndex(object):
+    """
+    In-memory inverted index of the search documents: every term is mapped
+    to the weight it has in every talk.
+    """
+    # a document saved by a transaction committed after the previous refresh
+    # can have an older `updated`; the overlap picks it up.
+    OVERLAP = timedelta(seconds=60)
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.docs = {}
+        self.updated = None
+        self.lock = threading.Lock()
+
+    def add(self, doc):
+        self.remove(doc.talk_id)
+        terms = defaultdict(float)
+        for field, weight in WEIGHTS:
+            for term in tokenize(getattr(doc, field)):
+                terms[term] += weight
+        for term, weight in terms.items():
+            self.postings[term][doc.talk_id] = weight
+        self.docs[doc.talk_id] = (doc.conference, doc.status, terms.keys())
+
+    def remove(self, tid):
+        try:
+            terms = self.docs.pop(tid)[2]
+        except KeyError:
+            return
+        for term in terms:
+            p = self.postings[term]
+            p.pop(tid, None)
+            if not p:
+                del self.postings[term]
+
+    def refresh(self):
+        """
+        Loads the documents changed since the previous refresh and drops the
+        ones of the talks deleted in the meantime (their tombstones).
+        """
+        qs = models.TalkSearchDocument.objects.defer('vector')
+        if self.updated is None:
+            qs = qs.filter(deleted=False)
+        else:
+            qs = qs.filter(updated__gte=self.updated - self.OVERLAP)
+        for doc in qs:
+            if doc.deleted:
+                self.remove(doc.talk_id)
+            else:
+                self.add(doc)
+            if self.updated is None or doc.updated > self.updated:
+                self.updated = doc.updated
+
+    def search(self, query):
+        """
+        Returns the list of (talk id, score) of the talks with all the terms
+        of the query, sorted by score (tf-idf).
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        n = float(len(self.docs) or 1)
+        scores = None
+        for term in terms:
+            p = self.postings.get(term)
+            if not p:
+                return []
+            idf = math.log(1 + n / len(p))
+            if scores is None:
+                scores = dict((tid, w * idf) for tid, w in p.items())
+            else:
+                scores = dict((tid, s + p[tid] * idf) for tid, s in scores.items() if tid in p)
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+
+_index = InvertedIndex()
+
+def _search_memory(query):
+    with _index.lock:
+        _index.refresh()
+        return [
+            (tid, score, _index.docs[tid][0], _index.docs[tid][1])
+            for tid, score in _index.search(query) ]
+
+def _search_postgresql(query):
+    table = models.TalkSearchDocument._meta.db_table
+    sql = '''
+        SELECT talk_id, ts_rank(vector, q), conference, status
+        FROM %s, plainto_tsquery('english', %%s) q
+        WHERE vector @@ q AND NOT deleted
+        ORDER BY 2 DESC, 1
+    ''' % table
+    cursor = connection.cursor()
+    cursor.execute(sql, [query])
+    return cursor.fetchall()
+
+def search_talks(query, conference=None, visible=None, limit=20):
+    """
+    Searches the talks with all the words of `query` in their title, sub
+    title, abstracts, tags or speaker names; returns up to `limit` (talk
+    id, score) sorted by relevance.
+
+    `visible`, if passed, is called with the conference and the status of
+    every matching talk to filter the results.
+    """
+    if connection.vendor == 'postgresql':
+        rows = _search_postgresql(query)
+    else:
+        rows = _search_memory(query)
+    output = []
+    for tid, score, conf, status in rows:
+        if conference and conf != conference:
+            continue
+        if visible is not None and not visible(conf, status):
+            continue
+        output.append((tid, score))
+        if len(output) == limit:
+            break
+    return output
+
+def _on_talk_data_invalidated(sender, **kw):
+    tids = []
+    for k in kw['cache_keys']:
+        try:
+            tids.append(int(k.rsplit(':', 1)[1]))
+        except (IndexError, ValueError):
+            pass
+    if tids:
+        index_talks(tids)
+
+def _on_generic_changed(sender, **kw):
+    o = kw['instance']
+    if o.content_type_id == ContentType.objects.get_for_model(models.Talk).id:
+        index_talks([ o.object_id ])
+
+def _on_talk_deleted(sender, **kw):
+    # the talk is gone, its document becomes a tombstone
+    index_talks([ kw['instance'].id ])
+
+dataaccess.talk_data.invalidated.connect(_on_talk_data_invalidated)
+post_save.connect(_on_generic_changed, sender=models.MultilingualContent)
+post_save.connect(_on_generic_changed, sender=models.ConferenceTaggedItem)
+post_delete.connect(_on_generic_changed, sender=models.ConferenceTaggedItem)
+post_delete.connect(_on_talk_deleted, sender=models.Talk)
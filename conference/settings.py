@@ -126,6 +126,18 @@ TICKET_BADGE_PROG_ARGS = getattr(settings, 'CONFERENCE_TICKET_BADGE_PROG_ARGS',
 TICKET_BADGE_PROG_ARGS_ADMIN = getattr(settings, 'CONFERENCE_TICKET_BADGE_PROG_ARGS', ['-e', '0', '-p', 'A4', '-n', '2'])
 TICKET_BADGE_PREPARE_FUNCTION = getattr(settings, 'CONFERENCE_TICKET_BADGE_PREPARE_FUNCTION', lambda tickets: [])
 
+# Size (number of keys per decorated function) and timeout (in seconds) of the
+# in-process cache that cachef.CacheFunction puts in front of django cache for
+# the functions decorated with `local=True`; a size of 0 disables it.
+CACHEF_LOCAL_SIZE = getattr(settings, 'CONFERENCE_CACHEF_LOCAL_SIZE', 0)
+CACHEF_LOCAL_TIMEOUT = getattr(settings, 'CONFERENCE_CACHEF_LOCAL_TIMEOUT', 30)
+
+# How often (in seconds) every process adds its cachef usage counters to the
+# shared cache (0 keeps the counters local to the process), and the modules
+# that define the cached functions shown by the cache_stats command.
+CACHEF_STATS_FLUSH_INTERVAL = getattr(settings, 'CONFERENCE_CACHEF_STATS_FLUSH_INTERVAL', 60)
+CACHEF_STATS_MODULES = getattr(settings, 'CONFERENCE_CACHEF_STATS_MODULES', ('conference.dataaccess',))
+
 SCHEDULE_ATTENDEES = getattr(settings, 'CONFERENCE_SCHEDULE_ATTENDEES', lambda schedule, forecast=False: 0)
 
 ADMIN_ATTENDEE_STATS = getattr(settings, 'CONFERENCE_ADMIN_ATTENDEE_STATS', ())
@@ -156,13 +168,28 @@ TALK_SUBMISSION_NOTIFICATION_EMAIL = getattr(
 
 TALK_TYPES_TO_BE_VOTED = getattr(settings, 'CONFERENCE_VOTING_TALK_TYPES', DEFAULT_VOTING_TALK_TYPES)
 
-# absolute path of a file used to log the email sent from the admin (tickets
-# stats section); the log file is also used to show a list of "last recently
-# sent email" in the admin page.
+# The vote given to the talks not voted by a user when the talks are ranked
+# with the incremental pairwise table (conference.ranking.snapshot).
+VOTING_MISSING_VOTE = getattr(settings, 'CONFERENCE_VOTING_MISSING_VOTE', 5)
+
+# absolute path of the file where the email sent from the admin (tickets
+# stats section) were logged; the history is now kept by the BulkMailJob
+# model and the file is only read by the `import_admin_email_log` command.
 ADMIN_TICKETS_STATS_EMAIL_LOG = getattr(settings, 'CONFERENCE_ADMIN_TICKETS_STATS_EMAIL_LOG', None)
 
 ADMIN_TICKETS_STATS_EMAIL_LOAD_LIBRARY = getattr(settings, 'CONFERENCE_ADMIN_TICKETS_STATS_EMAIL_LOAD_LIBRARY', ['conference'])
 
+# The mass mailings of the admin stats are sent by the `send_bulk_mail`
+# command (see conference.bulkmail): BATCH_SIZE messages are rendered and
+# sent through the same SMTP connection, at most RATE messages per second
+# (0 disables the limit); a running job not updated for STALE seconds is
+# considered abandoned by a dead worker and is resumed, unless it has already
+# been started ATTEMPTS times: then it is marked as failed.
+BULK_MAIL_BATCH_SIZE = getattr(settings, 'CONFERENCE_BULK_MAIL_BATCH_SIZE', 100)
+BULK_MAIL_RATE = getattr(settings, 'CONFERENCE_BULK_MAIL_RATE', 10)
+BULK_MAIL_STALE = getattr(settings, 'CONFERENCE_BULK_MAIL_STALE', 600)
+BULK_MAIL_ATTEMPTS = getattr(settings, 'CONFERENCE_BULK_MAIL_ATTEMPTS', 3)
+
 def _VIDEO_COVER_EVENTS(conference):
     from conference import dataaccess
     return [ x['id'] for x in dataaccess.events(conf=conference) ]
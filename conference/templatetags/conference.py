@@ -523,11 +523,8 @@ def overbooked_events(context, conference):
     """
     c = _request_cache(context['request'], 'schedules_overbook')
     if not c:
-        data = models.Schedule.objects.expected_attendance(conference)
-        for k, v in data.items():
-            if not v['overbook']:
-                del data[k]
-        c['items'] = data
+        data = dataaccess.expected_attendance(conference)
+        c['items'] = dict((k, v) for k, v in data.items() if v['overbook'])
     return c['items']
 
 @register.simple_tag(takes_context=True)
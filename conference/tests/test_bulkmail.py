@@ -0,0 +1,128 @@
+# -*- coding: UTF-8 -*-
+from datetime import timedelta
+
+import mock
+from django.core import mail
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from django_factory_boy import auth as auth_factories
+
+from conference import bulkmail
+from conference.models import BULK_MAIL_STATUS, BulkMailJob
+from conference.tests.factories.conference import ConferenceFactory
+
+
+class TestBulkMail(TestCase):
+    def setUp(self):
+        self.conference = ConferenceFactory()
+        self.users = [ auth_factories.UserFactory() for _ in range(5) ]
+        settings = override_settings(CONFERENCE_CONFERENCE=self.conference.code)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def _queue(self, **kw):
+        return bulkmail.queue(
+            'info@example.com', 'Hi {{ user.first_name }}', 'Welcome to {{ conf.code }}',
+            [ u.id for u in self.users ], conference=self.conference.code, **kw)
+
+    def test_queue(self):
+        job = self._queue()
+        self.assertEqual(job.status, BULK_MAIL_STATUS.queued)
+        self.assertEqual(job.total, 5)
+        self.assertEqual(job.recipients.count(), 5)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_run_in_batches(self):
+        job = self._queue(feedback_address='staff@example.com')
+        self.assertEqual(bulkmail.run_pending(batch_size=2, rate=0), 1)
+
+        job = BulkMailJob.objects.get(id=job.id)
+        self.assertEqual(job.status, BULK_MAIL_STATUS.done)
+        self.assertEqual(job.sent, 5)
+        # five messages plus the feedback
+        self.assertEqual(len(mail.outbox), 6)
+        messages = dict((m.to[0], m) for m in mail.outbox)
+        u = self.users[0]
+        self.assertEqual(messages[u.email].subject, 'Hi %s' % u.first_name)
+        self.assertEqual(messages[u.email].body, 'Welcome to %s' % self.conference.code)
+        self.assertEqual(bulkmail.run_pending(rate=0), 0)
+
+    def test_resume(self):
+        job = self._queue()
+        # a worker died after sending the first two messages
+        sent = job.recipients.order_by('id')[:2].values_list('id', flat=True)
+        job.recipients.filter(id__in=list(sent)).update(sent=timezone.now())
+        BulkMailJob.objects.filter(id=job.id).update(
+            status=BULK_MAIL_STATUS.running,
+            sent=2,
+            updated=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(bulkmail.run_pending(rate=0), 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(BulkMailJob.objects.get(id=job.id).sent, 5)
+
+    def test_errors_recorded_per_recipient(self):
+        job = self._queue()
+        broken, unsent = self.users[0], self.users[1]
+        render = bulkmail._render_user
+        def _render_user(tpls, user, conf, tickets):
+            if user.id == broken.id:
+                raise ValueError('broken template')
+            return render(tpls, user, conf, tickets)
+
+        backend = mail.get_connection().__class__
+        send_messages = backend.send_messages
+        def _send_messages(self, messages):
+            if messages[0].to == [unsent.email]:
+                raise IOError('connection lost')
+            return send_messages(self, messages)
+
+        with mock.patch.object(bulkmail, '_render_user', _render_user), \
+                mock.patch.object(backend, 'send_messages', _send_messages):
+            self.assertEqual(bulkmail.run_pending(rate=0), 1)
+
+        job = BulkMailJob.objects.get(id=job.id)
+        self.assertEqual(job.status, BULK_MAIL_STATUS.done)
+        self.assertEqual((job.sent, job.failed), (3, 2))
+        self.assertEqual(len(mail.outbox), 3)
+        errors = dict(job.recipients.exclude(error='').values_list('user', 'error'))
+        self.assertEqual(errors, {
+            broken.id: 'render error: broken template',
+            unsent.id: 'send error: connection lost',
+        })
+
+    def test_failed_after_attempts(self):
+        job = self._queue()
+        BulkMailJob.objects.filter(id=job.id).update(
+            status=BULK_MAIL_STATUS.running,
+            attempts=3,
+            updated=timezone.now() - timedelta(days=1))
+
+        with mock.patch.object(bulkmail.settings, 'BULK_MAIL_ATTEMPTS', 3):
+            self.assertEqual(bulkmail.run_pending(rate=0), 0)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(BulkMailJob.objects.get(id=job.id).status, BULK_MAIL_STATUS.failed)
+        self.assertEqual(bulkmail.run_pending(rate=0), 0)
+
+    def test_running_job_not_resumed(self):
+        job = self._queue()
+        BulkMailJob.objects.filter(id=job.id).update(status=BULK_MAIL_STATUS.running)
+        self.assertEqual(bulkmail.run_pending(rate=0), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class TestMailHistory(TestCase):
+    def test_pages(self):
+        from conference.forms import AdminSendMailForm
+        for ix in range(12):
+            bulkmail.queue('info@example.com', 'mailing %d' % ix, 'body', [])
+        form = AdminSendMailForm()
+
+        page = form.load_emails()
+        self.assertEqual(len(page.object_list), 10)
+        self.assertTrue(page.has_next())
+        page = form.load_emails(page=2)
+        self.assertEqual(len(page.object_list), 2)
+        # out of range pages show the oldest mailings
+        self.assertEqual(form.load_emails(page=99).number, 2)
@@ -0,0 +1,299 @@
+import mock
+from django.core.cache import cache
+from django.dispatch import Signal
+from django.test import TestCase, override_settings
+
+from conference.cachef import CacheFunction, LocalCache
+
+
+class TestLocalCache(TestCase):
+    def test_lru_eviction(self):
+        lcache = LocalCache(max_size=2, timeout=60)
+        lcache.set('a', 1)
+        lcache.set('b', 2)
+        # touch 'a', so 'b' becomes the least recently used key
+        self.assertEqual(lcache.get('a'), 1)
+        lcache.set('c', 3)
+
+        self.assertEqual(len(lcache), 2)
+        self.assertEqual(lcache.get('a'), 1)
+        self.assertIsNone(lcache.get('b'))
+        self.assertEqual(lcache.get('c'), 3)
+
+    def test_timeout(self):
+        lcache = LocalCache(max_size=10, timeout=60)
+        with mock.patch('conference.cachef.time.time', return_value=1000):
+            lcache.set('a', 1)
+        with mock.patch('conference.cachef.time.time', return_value=1061):
+            self.assertIsNone(lcache.get('a'))
+
+    def test_returns_a_copy(self):
+        lcache = LocalCache(max_size=10, timeout=60)
+        lcache.set('a', {'x': 1})
+        lcache.get('a')['x'] = 2
+        self.assertEqual(lcache.get('a'), {'x': 1})
+
+
+class TestCacheFunctionLocal(TestCase):
+    def setUp(self):
+        self.cache_me = CacheFunction(prefix='test:')
+        self.calls = []
+
+        def data(oid):
+            self.calls.append(oid)
+            return {'id': oid}
+        self.data = self.cache_me(
+            local=True, local_size=10, local_timeout=60,
+            key='data:%(oid)s')(data, lambda sender, **kw: 'data:%s' % kw['oid'])
+
+    def test_local_hit(self):
+        self.assertEqual(self.data(1), {'id': 1})
+        self.assertEqual(self.data(1), {'id': 1})
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(self.data.stats['misses'], 1)
+        self.assertEqual(self.data.stats['local_hits'], 1)
+
+    def test_get_from_cache(self):
+        self.data(1)
+        output = self.data.get_from_cache([(1,), (2,)])
+        self.assertEqual(output, [{'id': 1}, CacheFunction.CACHE_MISS])
+
+    def test_invalidation(self):
+        signal = Signal(providing_args=['oid'])
+        data = self.cache_me(
+            local=True, local_size=10, local_timeout=60, signals=(signal,),
+            key='data:%(oid)s')(lambda oid: self.calls.append(oid), lambda sender, **kw: 'data:%s' % kw['oid'])
+        data(1)
+        signal.send(None, oid=1)
+        data(1)
+        self.assertEqual(self.calls, [1, 1])
+        self.assertEqual(data.stats['invalidations'], 1)
+
+    def test_local_disabled(self):
+        data = self.cache_me(local=False)(lambda oid: self.calls.append(oid))
+        self.assertIsNone(data.local_cache)
+        data(1)
+        data(1)
+        self.assertEqual(self.calls, [1, 1])
+
+
+class TestCacheFunctionSingleFlight(TestCase):
+    def setUp(self):
+        self.cache_me = CacheFunction(prefix='test:')
+        self.calls = []
+
+        def data(oid):
+            self.calls.append(oid)
+            return {'id': oid}
+        self.func = data
+
+    @mock.patch('conference.cachef.cache')
+    def test_lock_owner_computes(self, mock_cache):
+        mock_cache.get.return_value = CacheFunction.CACHE_MISS
+        mock_cache.add.return_value = True
+        data = self.cache_me(single_flight=True, key='data:%(oid)s')(self.func)
+
+        self.assertEqual(data(1), {'id': 1})
+        self.assertEqual(self.calls, [1])
+        self.assertTrue(mock_cache.add.called)
+        self.assertTrue(mock_cache.delete.called)
+
+    @mock.patch('conference.cachef.cache')
+    def test_stale_while_revalidate(self, mock_cache):
+        def get(k, default=None):
+            if k.endswith(':stale'):
+                return {'id': 'stale'}
+            return default
+        mock_cache.get.side_effect = get
+        mock_cache.add.return_value = False
+        data = self.cache_me(stale=True, key='data:%(oid)s')(self.func)
+
+        self.assertEqual(data(1), {'id': 'stale'})
+        self.assertEqual(self.calls, [])
+        self.assertEqual(data.stats['stale_hits'], 1)
+
+    @mock.patch('conference.cachef.LOCK_POLL', 0)
+    @mock.patch('conference.cachef.cache')
+    def test_wait_for_lock_owner(self, mock_cache):
+        values = [CacheFunction.CACHE_MISS, {'id': 'fresh'}]
+        mock_cache.get.side_effect = lambda k, default=None: values.pop(0)
+        mock_cache.add.return_value = False
+        data = self.cache_me(single_flight=True, key='data:%(oid)s')(self.func)
+
+        self.assertEqual(data(1), {'id': 'fresh'})
+        self.assertEqual(self.calls, [])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class TestCacheFunctionNamespace(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cache_me = CacheFunction(prefix='test:')
+        self.signal = Signal(providing_args=['ns'])
+        self.calls = []
+
+        def data(conf, status):
+            self.calls.append((conf, status))
+            return (conf, status)
+        self.data = self.cache_me(
+            signals=(self.signal,),
+            namespace=('data', 'data:%(conf)s'),
+            key='data:%(conf)s:%(status)s')(data, lambda sender, **kw: kw['ns'])
+
+    def test_cached(self):
+        self.data('ep1', 'accepted')
+        self.data('ep1', 'accepted')
+        self.assertEqual(self.calls, [('ep1', 'accepted')])
+
+    def test_bump_one_namespace(self):
+        self.data('ep1', 'accepted')
+        self.data('ep2', 'accepted')
+        self.signal.send(None, ns='data:ep1')
+        self.data('ep1', 'accepted')
+        self.data('ep2', 'accepted')
+        self.assertEqual(self.calls, [
+            ('ep1', 'accepted'), ('ep2', 'accepted'), ('ep1', 'accepted')])
+
+    def test_keys_of_other_functions_are_not_namespaces(self):
+        self.data('ep1', 'accepted')
+        self.signal.send(None, ns='data:ep1', cache_keys=['talk:1'])
+        self.data('ep1', 'accepted')
+        self.assertEqual(self.calls, [('ep1', 'accepted'), ('ep1', 'accepted')])
+
+    def test_explicit_invalidation(self):
+        self.data('ep1', 'accepted')
+        self.data('ep2', 'accepted')
+        self.data.invalidate('data:ep1')
+        self.data('ep1', 'accepted')
+        self.data('ep2', 'accepted')
+        self.assertEqual(self.calls, [
+            ('ep1', 'accepted'), ('ep2', 'accepted'), ('ep1', 'accepted')])
+
+    def test_bump_parent_namespace(self):
+        self.data('ep1', 'accepted')
+        self.data('ep2', 'proposed')
+        self.signal.send(None, ns='data')
+        self.assertEqual(
+            self.data.get_from_cache([('ep1', 'accepted'), ('ep2', 'proposed')]),
+            [CacheFunction.CACHE_MISS, CacheFunction.CACHE_MISS])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class TestCacheFunctionBatch(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cache_me = CacheFunction(prefix='test:')
+        self.preloaded = []
+
+        def data(oid, preload=None):
+            return {'id': oid, 'preload': preload}
+        self.data = self.cache_me(key='data:%(oid)s')(data)
+
+    def preload(self, missing):
+        self.preloaded.append(missing)
+        return dict((x, x * 10) for x in missing)
+
+    def test_batch(self):
+        self.data(1)
+        output = self.data.batch([1, 2, 3, 2], self.preload)
+
+        self.assertEqual(self.preloaded, [[2, 3]])
+        self.assertEqual([x['id'] for x in output], [1, 2, 3, 2])
+        self.assertEqual([x['preload'] for x in output], [None, 20, 30, 20])
+
+    def test_batch_stores_misses(self):
+        with mock.patch('conference.cachef.cache.set_many') as set_many:
+            self.data.batch([1, 2, 3], self.preload)
+        self.assertEqual(set_many.call_count, 1)
+        self.assertEqual(len(set_many.call_args[0][0]), 3)
+
+        self.data.batch([1, 2, 3], self.preload)
+        self.assertEqual(len(self.preloaded), 2)
+
+    def test_set_many_to_cache(self):
+        self.data.set_many_to_cache([(1,), (2,)], ['one', 'two'])
+        self.assertEqual(self.data.get_from_cache([(1,), (2,), (3,)]),
+                         ['one', 'two', CacheFunction.CACHE_MISS])
+
+
+class TestCacheStats(TestCase):
+    def test_registry_name(self):
+        from conference.cachef import registry
+        cache_me = CacheFunction(prefix='test:')
+        data = cache_me(key='data:%(oid)s')(lambda oid: oid)
+        self.assertEqual(data.stats.name, 'test:data')
+        self.assertIs(registry['test:data'], data)
+
+    def test_counters(self):
+        cache_me = CacheFunction(prefix='test:')
+        data = cache_me(key='counters:%(oid)s')(lambda oid: 'x' * 100)
+        data(1)
+        data(2)
+        self.assertEqual(data.stats['misses'], 2)
+        self.assertEqual(data.stats['computes'], 2)
+        self.assertTrue(data.stats['size'] > 200)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    })
+    def test_shared_counters(self):
+        from conference.cachef import CacheStats
+        stats = CacheStats('test:shared')
+        stats.flush_interval = 60
+        stats.incr('hits', 3)
+        self.assertEqual(stats.shared()['hits'], 3)
+
+        other = CacheStats('test:shared')
+        other.flush_interval = 60
+        other.incr('hits', 2)
+        self.assertEqual(other.shared()['hits'], 5)
+
+        stats.reset()
+        self.assertEqual(other.shared()['hits'], 0)
+
+
+class TestKeyBuilder(TestCase):
+    def setUp(self):
+        self.cache_me = CacheFunction(prefix='test:')
+
+        def deadlines(lang, year=None):
+            pass
+        self.func = deadlines
+
+    def test_same_keys_of_generate_key(self):
+        calls = [
+            (('en',), {}),
+            (('en', 2018), {}),
+            (('en',), {'year': 2018}),
+            ((), {'lang': 'it'}),
+        ]
+        for key in ('deadlines:%(lang)s:%(year)s', 'deadlines:%s', 'deadlines', 'a%%b:%(lang)s'):
+            build = self.cache_me.compile_key(key, self.func)
+            for args, kwargs in calls:
+                if key == 'deadlines:%s' and len(args) != 1:
+                    continue
+                self.assertEqual(
+                    build(args, kwargs),
+                    self.cache_me.generate_key(key, self.func, args, kwargs))
+
+    def test_missing_argument(self):
+        build = self.cache_me.compile_key('deadlines:%(lang)s', self.func)
+        with self.assertRaises(TypeError):
+            build((), {})
+
+    def test_short_keys_are_not_hashed(self):
+        self.assertEqual(self.cache_me.hash_key('test:talk_data:1'), 'test:talk_data:1')
+        self.assertEqual(len(self.cache_me.hash_key('test:' + 'x' * 100)), 32)
+        self.assertEqual(len(self.cache_me.hash_key(u'test:caff\xe8')), 32)
+        self.assertEqual(len(self.cache_me.hash_key('test:with space')), 32)
+
+    def test_no_md5_for_short_keys(self):
+        build = self.cache_me.compile_key('deadlines:%(lang)s:%(year)s', self.func)
+        with mock.patch('conference.cachef.hashlib.md5') as md5:
+            key = self.cache_me.hash_key(build(('en',), {}))
+        self.assertFalse(md5.called)
+        self.assertEqual(key, build(('en',), {}))
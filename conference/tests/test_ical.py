@@ -0,0 +1,42 @@
+# -*- coding: UTF-8 -*-
+from datetime import datetime
+
+from django.test import TestCase
+
+from conference import ical
+
+
+def unfold(data):
+    return data.replace('\r\n ', '')
+
+
+class TestFold(TestCase):
+    def test_short_line(self):
+        self.assertEqual(ical.encode('SUMMARY:talk'), 'SUMMARY:talk\r\n')
+
+    def test_long_line(self):
+        line = 'DESCRIPTION:' + 'x' * 200
+        encoded = ical.encode(line)
+        for piece in encoded.split('\r\n')[:-1]:
+            self.assertTrue(len(piece) <= 73)
+        self.assertEqual(unfold(encoded), line + '\r\n')
+
+    def test_multibyte_sequences_are_not_split(self):
+        line = u'SUMMARY:' + u'caff\xe8 €' * 30
+        encoded = ical.encode(line)
+        for piece in encoded.split('\r\n')[:-1]:
+            piece.decode('utf-8')
+        self.assertEqual(unfold(encoded).decode('utf-8'), line + u'\r\n')
+
+
+class TestStream(TestCase):
+    def test_chunks(self):
+        events = [
+            ical.Event(uid=x, start=datetime(2018, 7, 23, 9, 0), summary='talk %s' % x)
+            for x in range(50) ]
+        cal = ical.Calendar('test', events)
+        chunks = list(ical.stream(cal, chunk_size=1024))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(c) >= 1024 for c in chunks[:-1]))
+        self.assertEqual(''.join(chunks), ''.join(cal.encode()))
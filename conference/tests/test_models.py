@@ -0,0 +1,177 @@
+import datetime
+import random
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django_factory_boy import auth as auth_factories
+
+from conference import dataaccess, ranking
+from conference.models import Event, Schedule, VotePreference, VotoTalk
+from conference.tests.factories.conference import ConferenceFactory
+from conference.tests.factories.talk import TalkFactory
+
+
+def _legacy_group(event, events):
+    # group_events_by_times(events, event=event) before the overlap index:
+    # every event compared with all the others.
+    def overlap(range1, range2):
+        latest_start = max(range1[0], range2[0])
+        earliest_end = min(range1[1], range2[1])
+        _overlap = (earliest_end - latest_start)
+        return _overlap.days == 0 and _overlap.seconds > 0
+
+    group = []
+    r0 = event.get_time_range()
+    for e in events:
+        r1 = e.get_time_range()
+        if r0[0].date() == r1[0].date() and overlap(r0, r1):
+            group.append(e)
+    return group
+
+
+def _synthetic_schedule(days=5, tracks=10):
+    """
+    Unsaved events of a conference with `days` days and `tracks` tracks,
+    every track filled from 9:00 to 18:00 with events of random length.
+    """
+    rnd = random.Random(42)
+    events = []
+    eid = 1
+    for day in range(days):
+        schedule = Schedule(id=day + 1, date=datetime.date(2018, 7, 23) + datetime.timedelta(days=day))
+        for track in range(tracks):
+            minutes = 9 * 60 + rnd.choice((0, 15))
+            while minutes < 18 * 60:
+                duration = rnd.choice((0, 30, 45, 60, 90, 180))
+                events.append(Event(
+                    id=eid,
+                    schedule=schedule,
+                    start_time=datetime.time(minutes // 60, minutes % 60),
+                    duration=duration))
+                eid += 1
+                minutes += duration or 15
+    return events
+
+
+class TestEventOverlapIndex(TestCase):
+    def test_same_groups_of_the_pairwise_comparison(self):
+        events = _synthetic_schedule(days=2, tracks=4)
+        index = Event.objects.overlap_index(events)
+        for e in events:
+            self.assertEqual(
+                sorted(x.id for x in index[e]),
+                sorted(x.id for x in _legacy_group(e, events)))
+
+    def test_group_events_by_times(self):
+        events = _synthetic_schedule(days=1, tracks=3)
+        event = events[5]
+        group = list(Event.objects.group_events_by_times(events, event=event))[0]
+        self.assertEqual(
+            sorted(x.id for x in group),
+            sorted(x.id for x in _legacy_group(event, events)))
+
+        grouped = []
+        for group in Event.objects.group_events_by_times(events):
+            grouped.extend(x.id for x in group)
+        self.assertEqual(
+            sorted(grouped),
+            sorted(x.id for x in events if x.get_duration() > 0))
+
+    def test_full_schedule(self):
+        # 5 days / 10 tracks: the groups of all the events, as needed by
+        # expected_attendance, are the ones of the per-event comparison
+        # limited to the events of the same day.
+        events = _synthetic_schedule(days=5, tracks=10)
+        by_day = {}
+        for e in events:
+            by_day.setdefault(e.schedule_id, []).append(e)
+
+        index = Event.objects.overlap_index(events)
+        self.assertEqual(len(index), len(events))
+        for e in events:
+            group = index[e]
+            self.assertEqual(set(x.schedule_id for x in group) - set([e.schedule_id]), set())
+            self.assertEqual(
+                sorted(x.id for x in group),
+                sorted(x.id for x in _legacy_group(e, by_day[e.schedule_id])))
+
+
+class TestPresenceScores(TestCase):
+    def _events(self):
+        schedule = Schedule(id=1, date=datetime.date(2018, 7, 23))
+        def event(eid, hour, duration):
+            return Event(id=eid, schedule=schedule, start_time=datetime.time(hour, 0), duration=duration)
+        # 1 and 2 in parallel, 3 later, 4 without duration
+        return [ event(1, 9, 60), event(2, 9, 60), event(3, 11, 60), event(4, 9, 0) ]
+
+    def test_parallel_events(self):
+        events = self._events()
+        pairs = [
+            # in parallel: half presence each
+            (1, 100), (2, 100),
+            # not in parallel: full presence
+            (1, 200), (3, 200),
+            (4, 300),
+        ]
+        scores = Event.objects.presence_scores(events, pairs)
+        self.assertEqual(dict(scores), {1: 1.5, 2: 0.5, 3: 1.0, 4: 1.0})
+
+    def test_same_scores_of_the_per_user_count(self):
+        events = _synthetic_schedule(days=2, tracks=4)
+        index = Event.objects.overlap_index(events)
+        rnd = random.Random(7)
+        pairs = set((rnd.choice(events).id, rnd.randint(1, 50)) for _ in range(400))
+
+        wanted = {}
+        for eid, uid in pairs:
+            wanted.setdefault(uid, set()).add(eid)
+        expected = {}
+        for e in events:
+            for uid, eids in wanted.items():
+                if e.id in eids:
+                    found = set(x.id for x in index[e]) | set([e.id])
+                    expected[e.id] = expected.get(e.id, 0) + 1.0 / len(found & eids)
+
+        scores = Event.objects.presence_scores(events, pairs, index=index)
+        self.assertEqual(sorted(scores), sorted(expected))
+        for eid, score in expected.items():
+            self.assertAlmostEqual(scores[eid], score)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestSaveVotes(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.conference = ConferenceFactory()
+        self.talks = [ TalkFactory(conference=self.conference.code) for _ in range(4) ]
+        self.user = auth_factories.UserFactory()
+        VotoTalk.objects.create(user=self.user, talk=self.talks[0], vote=Decimal(7))
+        VotoTalk.objects.create(user=self.user, talk=self.talks[1], vote=Decimal(3))
+        VotoTalk.objects.create(user=auth_factories.UserFactory(), talk=self.talks[2], vote=Decimal(10))
+        ranking.build_preferences(self.conference.code)
+
+    def _preferences(self):
+        return sorted(VotePreference.objects.values_list('talk', 'other', 'count'))
+
+    def test_save_votes(self):
+        t = self.talks
+        self.assertEqual(
+            dataaccess.user_votes(self.user.id, self.conference.code),
+            {t[0].id: Decimal(7), t[1].id: Decimal(3)})
+
+        changed = VotoTalk.objects.save_votes(self.user.id, self.conference.code, {
+            t[0].id: None,
+            t[1].id: Decimal(3),
+            t[2].id: Decimal(8),
+            t[3].id: Decimal(8),
+        })
+        self.assertEqual(changed, 3)
+        self.assertEqual(
+            dataaccess.user_votes(self.user.id, self.conference.code),
+            {t[1].id: Decimal(3), t[2].id: Decimal(8), t[3].id: Decimal(8)})
+
+        incremental = self._preferences()
+        ranking.build_preferences(self.conference.code)
+        self.assertEqual(incremental, self._preferences())
+
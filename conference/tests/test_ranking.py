@@ -0,0 +1,161 @@
+import random
+from decimal import Decimal
+
+import numpy
+from django.test import TestCase
+from django_factory_boy import auth as auth_factories
+
+from conference import ranking
+from conference.models import VotePreference, VotoTalk
+from conference.tests.factories.conference import ConferenceFactory
+from conference.tests.factories.talk import TalkFactory
+
+
+def _voteengine_order(votes, tiebreaker):
+    # the algorithm of voteengine-0.99 (-m schulze -tie ...), loop by loop
+    n = len(tiebreaker)
+    pw = [ [0] * n for _ in range(n) ]
+    for ballot in votes:
+        for i in range(n):
+            for j in range(n):
+                if ballot[i] > ballot[j]:
+                    pw[i][j] += 1
+    for i in range(n):
+        for j in range(i + 1, n):
+            m = pw[i][j] - pw[j][i]
+            pw[i][j] = m
+            pw[j][i] = -m
+    for k in range(n):
+        for i in range(n):
+            for j in range(n):
+                pw[i][j] = max(pw[i][j], min(pw[i][k], pw[k][j]))
+    winmat = [ [ int(i != j and pw[i][j] > pw[j][i]) for j in range(n) ] for i in range(n) ]
+
+    done = [0] * n
+    while True:
+        for i in tiebreaker:
+            if done[i]:
+                continue
+            for j in range(n):
+                if i == j or done[j]:
+                    continue
+                if winmat[j][i] > 0:
+                    break
+            else:
+                break
+        else:
+            break
+        done[i] = 1
+        for j in range(n):
+            if not done[j]:
+                winmat[i][j] = 1
+
+    wins = [ sum(1 for j in range(n) if winmat[i][j] > winmat[j][i]) for i in range(n) ]
+    return [ i for w, i in sorted([ (wins[i], i) for i in range(n) ], reverse=True) ]
+
+
+class TestSchulze(TestCase):
+    def test_same_order_of_voteengine(self):
+        rnd = random.Random(7)
+        for _ in range(20):
+            n = rnd.randint(2, 12)
+            votes = numpy.array([
+                [ rnd.choice((0, 1, 3, 5, 7, 10)) for _ in range(n) ]
+                for _ in range(rnd.randint(1, 30)) ], dtype=float)
+            tiebreaker = range(n)
+            rnd.shuffle(tiebreaker)
+
+            p = ranking.strongest_paths(ranking.pairwise(votes))
+            self.assertEqual(
+                ranking.schulze_order(p, tiebreaker),
+                _voteengine_order(votes.tolist(), tiebreaker))
+
+    def test_pairwise(self):
+        votes = numpy.array([
+            [10, 5, 5],
+            [0, 7, 5],
+        ], dtype=float)
+        self.assertEqual(ranking.pairwise(votes).tolist(), [
+            [0, 1, 1],
+            [1, 0, 1],
+            [1, 0, 0],
+        ])
+
+
+class TestRanking(TestCase):
+    def test_ranking(self):
+        conf = ConferenceFactory()
+        talks = [ TalkFactory(conference=conf.code) for _ in range(3) ]
+        for votes in ((10, 5, 0), (7, 3, 0), (0, 10, 5)):
+            user = auth_factories.UserFactory()
+            for talk, vote in zip(talks, votes):
+                VotoTalk.objects.create(user=user, talk=talk, vote=Decimal(vote))
+
+        output = ranking.ranking(talks)
+        self.assertEqual([ t for t, _ in output ], talks)
+        self.assertEqual([ score for _, score in output ], [2, 1, 0])
+
+    def test_missing_vote(self):
+        conf = ConferenceFactory()
+        talks = [ TalkFactory(conference=conf.code) for _ in range(2) ]
+        user = auth_factories.UserFactory()
+        VotoTalk.objects.create(user=user, talk=talks[0], vote=Decimal(3))
+
+        self.assertEqual([ t for t, _ in ranking.ranking(talks, missing_vote=5) ], talks[::-1])
+        self.assertEqual([ t for t, _ in ranking.ranking(talks, missing_vote=0) ], talks)
+
+
+class TestPreferences(TestCase):
+    def _table(self, talks):
+        rows = VotePreference.objects\
+            .filter(talk__in=talks)\
+            .values_list('talk', 'other', 'count')
+        return dict(((t, o), c) for t, o, c in rows)
+
+    def _rebuilt(self, talks):
+        ranking.build_preferences(talks[0].conference)
+        return self._table(talks)
+
+    def test_incremental_updates(self):
+        conf = ConferenceFactory()
+        talks = [ TalkFactory(conference=conf.code) for _ in range(4) ]
+        users = [ auth_factories.UserFactory() for _ in range(3) ]
+        VotoTalk.objects.create(user=users[0], talk=talks[0], vote=Decimal(10))
+        ranking.build_preferences(talks[0].conference)
+
+        VotoTalk.objects.create(user=users[0], talk=talks[1], vote=Decimal(3))
+        VotoTalk.objects.create(user=users[1], talk=talks[2], vote=Decimal(7))
+        v = VotoTalk.objects.create(user=users[2], talk=talks[1], vote=Decimal(0))
+        v.vote = Decimal(10)
+        v.save()
+        VotoTalk.objects.filter(user=users[0], talk=talks[0]).delete()
+        talks.append(TalkFactory(conference=conf.code))
+        VotoTalk.objects.create(user=users[1], talk=talks[4], vote=Decimal(1))
+
+        table = self._table(talks)
+        self.assertEqual(len(table), 5 * 4)
+        self.assertEqual(table, self._rebuilt(talks))
+
+    def test_batch_of_changes(self):
+        conf = ConferenceFactory()
+        talks = [ TalkFactory(conference=conf.code) for _ in range(3) ]
+        user = auth_factories.UserFactory()
+        VotoTalk.objects.create(user=user, talk=talks[0], vote=Decimal(7))
+        ranking.build_preferences(talks[0].conference)
+
+        changes = {talks[0].id: (Decimal(7), Decimal(1)), talks[1].id: (None, Decimal(10))}
+        VotoTalk.objects.filter(user=user, talk=talks[0]).update(vote=Decimal(1))
+        VotoTalk.objects.bulk_create([VotoTalk(user=user, talk=talks[1], vote=Decimal(10))])
+        ranking.update_preferences(user.id, changes)
+
+        self.assertEqual(self._table(talks), self._rebuilt(talks))
+
+    def test_snapshot(self):
+        conf = ConferenceFactory()
+        talks = [ TalkFactory(conference=conf.code) for _ in range(3) ]
+        for votes in ((10, 5, 0), (7, 3, 0), (0, 10, 5)):
+            user = auth_factories.UserFactory()
+            for talk, vote in zip(talks, votes):
+                VotoTalk.objects.create(user=user, talk=talk, vote=Decimal(vote))
+
+        self.assertEqual(ranking.snapshot(talks), ranking.ranking(talks))
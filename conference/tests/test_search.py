@@ -0,0 +1,101 @@
+# -*- coding: UTF-8 -*-
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django_factory_boy import auth as auth_factories
+
+from conference import search
+from conference.models import TalkSearchDocument
+from conference.tests.factories.conference import ConferenceFactory
+from conference.tests.factories.speaker import SpeakerFactory
+from conference.tests.factories.talk import TalkFactory, TalkSpeakerFactory
+
+
+class TestInvertedIndex(TestCase):
+    def _doc(self, tid, title, speakers='', body=''):
+        return TalkSearchDocument(
+            talk_id=tid, conference='ep', status='accepted',
+            title=title, speakers=speakers, body=body)
+
+    def test_all_the_terms(self):
+        index = search.InvertedIndex()
+        index.add(self._doc(1, 'Async Python'))
+        index.add(self._doc(2, 'Python packaging'))
+        self.assertEqual([ t for t, _ in index.search('python') ], [1, 2])
+        self.assertEqual([ t for t, _ in index.search('python async') ], [1])
+        self.assertEqual(index.search('rust'), [])
+
+    def test_title_before_body(self):
+        index = search.InvertedIndex()
+        index.add(self._doc(1, 'Packaging', body='a talk about django'))
+        index.add(self._doc(2, 'Django at scale'))
+        self.assertEqual([ t for t, _ in index.search('django') ], [2, 1])
+
+    def test_remove(self):
+        index = search.InvertedIndex()
+        index.add(self._doc(1, 'Async Python'))
+        index.add(self._doc(1, 'Sync Python'))
+        self.assertEqual(index.search('async'), [])
+        index.remove(1)
+        self.assertEqual(index.search('python'), [])
+        self.assertEqual(dict(index.postings), {})
+
+
+class TestSearchTalks(TestCase):
+    def setUp(self):
+        search._index = search.InvertedIndex()
+        self.conference = ConferenceFactory()
+
+    def test_incremental_index(self):
+        talk = TalkFactory(title='Unicode in depth', status='accepted')
+        TalkSpeakerFactory(talk=talk, speaker=SpeakerFactory(user__first_name='Ada', user__last_name='Lovelace'))
+        talk.setAbstract(u'The encodings and the codecs of Python')
+
+        for query in ('unicode', 'lovelace', 'codecs'):
+            self.assertEqual([ t for t, _ in search.search_talks(query) ], [talk.id])
+
+        talk.title = 'Text in depth'
+        talk.save()
+        self.assertEqual(search.search_talks('unicode'), [])
+        self.assertEqual([ t for t, _ in search.search_talks('text') ], [talk.id])
+
+        talk.delete()
+        self.assertEqual(search.search_talks('text'), [])
+
+    def test_deletion_seen_by_other_processes(self):
+        talk = TalkFactory(title='Unicode in depth', status='accepted')
+        tid = talk.id
+        other = search.InvertedIndex()
+        other.refresh()
+        self.assertEqual([ t for t, _ in other.search('unicode') ], [tid])
+
+        talk.delete()
+        self.assertTrue(TalkSearchDocument.objects.get(talk=tid).deleted)
+        # only the changed documents are loaded
+        with self.assertNumQueries(1):
+            other.refresh()
+        self.assertEqual(other.search('unicode'), [])
+        self.assertNotIn(tid, other.docs)
+
+    def test_filters(self):
+        accepted = TalkFactory(title='Python tricks', status='accepted')
+        proposed = TalkFactory(title='Python tips', status='proposed')
+
+        self.assertEqual(
+            set(t for t, _ in search.search_talks('python')),
+            set([accepted.id, proposed.id]))
+        self.assertEqual(
+            [ t for t, _ in search.search_talks('python', visible=lambda c, s: s != 'proposed') ],
+            [accepted.id])
+        self.assertEqual(search.search_talks('python', conference='other'), [])
+
+    def test_view(self):
+        TalkFactory(title='Python tricks', status='accepted')
+        TalkFactory(title='Python tips', status='proposed')
+        user = auth_factories.UserFactory(password='password1234', is_staff=True)
+        self.client.login(username=user.username, password='password1234')
+
+        response = self.client.get(reverse('conference-talk-search'), {'q': 'python'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)), 2)
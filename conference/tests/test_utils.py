@@ -0,0 +1,114 @@
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from conference.tests.factories.conference import ConferenceFactory
+from conference.tests.factories.event import EventFactory, EventTrackFactory
+from conference.utils import TimeTable2, _track_overlaps
+from p3.tests.factories.schedule import ScheduleFactory
+from p3.tests.factories.track import TrackFactory
+
+
+def _event(eid, start, duration, tracks=('t1',), tags=()):
+    return {
+        'id': eid,
+        'time': datetime(2018, 7, 23, 9) + timedelta(seconds=start * 60),
+        'duration': duration,
+        'tracks': list(tracks),
+        'tags': set(tags),
+    }
+
+
+class TestTimeTable2Overlaps(TestCase):
+    def _timetable(self, events):
+        tt = TimeTable2(None, {})
+        tt._tracks = ['t1', 't2']
+        tt.addEvents(events)
+        return tt
+
+    def test_track_overlaps(self):
+        e1 = _event(1, 0, 60)
+        e2 = _event(2, 30, 60)
+        e3 = _event(3, 60, 30)
+        e4 = _event(4, 200, 30)
+        e5 = _event(5, 40, 0)
+        overlaps = _track_overlaps([e1, e2, e3, e4, e5])
+        self.assertEqual(
+            dict((e['id'], c) for e, c in overlaps.values()),
+            {1: 1, 2: 2, 3: 1})
+
+    def test_intersection(self):
+        e1 = _event(1, 0, 60)
+        e2 = _event(2, 30, 60)
+        e3 = _event(3, 120, 30)
+        tt = self._timetable([e1, e2, e3])
+        list(tt.iterOnTracks())
+        self.assertEqual(e1['intersection'], 1)
+        self.assertEqual(e2['intersection'], 1)
+        self.assertNotIn('intersection', e3)
+
+    def test_intersection_on_more_tracks(self):
+        e1 = _event(1, 0, 60, tracks=('t1', 't2'))
+        e2 = _event(2, 30, 60, tracks=('t1',))
+        e3 = _event(3, 30, 60, tracks=('t2',))
+        tt = self._timetable([e1, e2, e3])
+        list(tt.iterOnTracks())
+        self.assertEqual(e1['intersection'], 2)
+
+    def test_incremental_updates(self):
+        e1 = _event(1, 0, 60)
+        tt = self._timetable([e1])
+        list(tt.iterOnTracks())
+        self.assertNotIn('intersection', e1)
+
+        e2 = _event(2, 30, 60, tags=('special',))
+        tt.addEvents([e2])
+        list(tt.iterOnTracks())
+        list(tt.iterOnTracks())
+        self.assertEqual(e1['intersection'], 1)
+
+        tt.removeEventsByTag('special')
+        list(tt.iterOnTracks())
+        self.assertNotIn('intersection', e1)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class TestTimeTable2ForConference(TestCase):
+    def _conference(self, days):
+        conference = ConferenceFactory()
+        for day in range(days):
+            schedule = ScheduleFactory(
+                conference=conference.code,
+                date=conference.conference_start + timedelta(days=day))
+            track = TrackFactory(schedule=schedule)
+            for hour in (9, 10, 11):
+                event = EventFactory(
+                    schedule=schedule, talk=None, custom='event',
+                    start_time=time(hour, 0), duration=45)
+                EventTrackFactory(event=event, track=track)
+        return conference
+
+    def _count_queries(self, conference):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            tts = TimeTable2.forConference(conference.code)
+        return len(queries), tts
+
+    def test_timetables(self):
+        conference = self._conference(days=2)
+        _, tts = self._count_queries(conference)
+        self.assertEqual(len(tts), 2)
+        for sid, tt in tts:
+            events = [ e for track, evs in tt.iterOnTracks() for e in evs ]
+            self.assertEqual(len(events), 3)
+            self.assertTrue(all(e['schedule_id'] == sid for e in events))
+
+    def test_constant_queries(self):
+        one_day, _ = self._count_queries(self._conference(days=1))
+        three_days, _ = self._count_queries(self._conference(days=3))
+        self.assertEqual(one_day, three_days)
@@ -1,6 +1,7 @@
 import unittest
 
 from django.core import serializers
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.test import TestCase, override_settings
 from django_factory_boy import auth as auth_factories
@@ -9,7 +10,8 @@ from conference.tests.factories.attendee_profile import AttendeeProfileFactory
 from conference.tests.factories.conference import ConferenceFactory
 from conference.tests.factories.fare import SponsorFactory
 from conference.tests.factories.speaker import SpeakerFactory
-from conference.tests.factories.talk import TalkFactory
+from conference import dataaccess
+from conference.tests.factories.talk import TalkFactory, TalkSpeakerFactory
 from p3.tests.factories.schedule import ScheduleFactory
 from p3.tests.factories.talk import P3TalkFactory
 
@@ -244,3 +246,32 @@ class TestView(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
     
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestVotingCatalogue(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_catalogue(self):
+        conference = ConferenceFactory()
+        t1 = TalkFactory(status='proposed', type='t_30', language='en', conference=conference.code)
+        t2 = TalkFactory(status='proposed', type='t_45', language='it', conference=conference.code)
+        t3 = TalkFactory(status='proposed', type='r_180', language='en', conference=conference.code)
+        TalkFactory(status='accepted', conference=conference.code)
+        TalkSpeakerFactory(talk=t1, speaker=SpeakerFactory(user__first_name='Zoe'))
+        TalkSpeakerFactory(talk=t2, speaker=SpeakerFactory(user__first_name='Anna'))
+
+        data = dataaccess.voting_catalogue(conference.code)
+        self.assertEqual([ t['id'] for t in data['talks'] ], [t2.id, t1.id, t3.id])
+        self.assertEqual([ t['ordinal'] for t in data['talks'] ], [1, 0, 2])
+        self.assertEqual(data['types'], {'t_30': {t1.id}, 't_45': {t2.id}, 'r_180': {t3.id}})
+        self.assertEqual(data['languages'], {'en': {t1.id, t3.id}, 'it': {t2.id}})
+
+        with self.assertNumQueries(0):
+            dataaccess.voting_catalogue(conference.code)
+
+        t3.language = 'it'
+        t3.save()
+        data = dataaccess.voting_catalogue(conference.code)
+        self.assertEqual(data['languages'], {'it': {t2.id, t3.id}, 'en': {t1.id}})
@@ -13,6 +13,7 @@ urlpatterns = patterns('conference.views',
     url(r'^speakers/(?P<slug>[\w-]+)', 'speaker', name='conference-speaker'),
 
     url(r'^talks/report', 'talk_report', name='conference-talk-report'),
+    url(r'^talks/search$', 'talk_search', name='conference-talk-search'),
     url(r'^talks/(?P<slug>[\w-]+)/video$', 'talk_video', name='conference-talk-video'),
     url(r'^talks/(?P<slug>[\w-]+)/video.mp4$', 'talk_video', name='conference-talk-video-mp4'),
     url(r'^talks/(?P<slug>[\w-]+).xml$', 'talk_xml', name='conference-talk-xml'),
@@ -91,22 +91,12 @@ def _input_for_ranking_of_talks(talks, missing_vote=5):
     return '\n'.join(vinput)
 
 def ranking_of_talks(talks, missing_vote=5):
-    import conference
-    vengine = os.path.join(os.path.dirname(conference.__file__), 'utils', 'voteengine-0.99', 'voteengine.py')
-
-    talks_map = dict((t.id, t) for t in talks)
-    in_ = _input_for_ranking_of_talks(talks_map.values(), missing_vote=missing_vote)
-
-    pipe = subprocess.Popen(
-        [vengine],
-        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        close_fds=True
-    )
-    out, err = pipe.communicate(in_)
-    if pipe.returncode != 0:
-        raise RuntimeError("voteengine.py exits with code: %s; %s" % (pipe.returncode, err))
-
-    return [ talks_map[int(tid)] for tid in re.findall(r'\d+', out.split('\n')[-2]) ]
+    """
+    Returns the talks sorted by the Schulze ranking of the users votes (see
+    conference.ranking).
+    """
+    from conference import ranking
+    return [ t for t, score in ranking.ranking(talks, missing_vote=missing_vote) ]
 
 def voting_results():
     """
@@ -133,22 +123,56 @@ def voting_results():
             return results
     return None
 
+from bisect import bisect_left, bisect_right
 from datetime import datetime, date, timedelta, time
-from conference.models import Event, Track
+from conference.models import Event, Schedule, Track
+
+def _track_overlaps(events):
+    """
+    Given the events of a track returns a dict id(event) -> (event, number of
+    the other events that overlap with it); only the events with at least
+    one overlap are present.
+
+    Two sorted lists, of the start and the end times, are enough to count the
+    overlaps of an event with two bisects: O(n log n) instead of comparing
+    every pair of events.
+    """
+    spans = []
+    for e in events:
+        start = e['time']
+        end = start + timedelta(seconds=e['duration'] * 60)
+        # an event without duration can't overlap with anything
+        if end > start:
+            spans.append((e, start, end))
+    starts = sorted(x[1] for x in spans)
+    ends = sorted(x[2] for x in spans)
+    output = {}
+    for e, start, end in spans:
+        # events started before the end of `e` minus the ones already
+        # finished at its start, minus `e` itself
+        count = bisect_left(starts, end) - bisect_right(ends, start) - 1
+        if count:
+            output[id(e)] = (e, count)
+    return output
 
 class TimeTable2(object):
-    def __init__(self, sid, events):
+    def __init__(self, sid, events, tracks=None):
         """
         events -> dict(track -> list(events))
+        tracks -> track names in the right order (loaded from the db if None)
         """
         self.sid = sid
-        self._analyzed = False
         self.events = events
+        # overlaps already computed, by track, and the tracks to re-analyze
+        self._overlaps = {}
+        self._dirty = set(events)
         # Track list in the right order
-        self._tracks = list(Track.objects\
-            .filter(schedule=sid)\
-            .order_by('order')\
-            .values_list('track', flat=True))
+        if tracks is None:
+            tracks = Track.objects\
+                .filter(schedule=sid)\
+                .order_by('order')\
+                .values_list('track', flat=True)
+        self._tracks = list(tracks)
 
     def __str__(self):
         return 'TimeTable2: %s - %s' % (self.sid, ', '.join(self._tracks))
@@ -165,14 +189,15 @@ class TimeTable2(object):
                     self.events[t].append(e)
                 except KeyError:
                     self.events[t] = [e]
-        self._analyzed = False
+                self._dirty.add(t)
 
     def removeEventsByTag(self, *tags):
         tags = set(tags)
-        for events in self.events.values():
+        for track, events in self.events.items():
             for ix, e in reversed(list(enumerate(events))):
                 if e['tags'] & tags:
                     del events[ix]
+                    self._dirty.add(track)
 
     @classmethod
     def fromEvents(cls, sid, eids):
@@ -189,6 +214,61 @@ class TimeTable2(object):
 
         return cls(sid, dict(tracks))
 
+    @classmethod
+    def fromSchedules(cls, sids, eids=None):
+        """
+        Returns a list of (schedule id, TimeTable2), in the order of `sids`,
+        using a fixed number of queries regardless of the number of schedules.
+
+        `eids`, if specified, is a dict schedule id -> event ids that limits
+        the events of every timetable; by default all the events of the
+        schedules are used (as in fromSchedule).
+        """
+        from conference import dataaccess
+        sids = list(sids)
+        schedules = dataaccess.schedules_data(sids)
+        if eids is None:
+            eids = defaultdict(list)
+            for row in EventTrack.objects\
+                        .filter(event__schedule__in=sids)\
+                        .values('event', 'event__schedule')\
+                        .distinct():
+                eids[row['event__schedule']].append(row['event'])
+
+        wanted = set(sids)
+        by_schedule = defaultdict(list)
+        all_eids = set()
+        for sid, ids in eids.items():
+            if sid in wanted:
+                all_eids.update(ids)
+        for e in dataaccess.events(eids=list(all_eids)):
+            by_schedule[e['schedule_id']].append(e)
+
+        output = []
+        for sch in schedules:
+            tracks = sorted(sch['tracks'].values(), key=lambda x: x.order)
+            events = by_schedule[sch['id']]
+            events.sort(key=lambda x: x['time'])
+            tt_events = defaultdict(list)
+            for e in events:
+                for t in e['tracks']:
+                    tt_events[t].append(e)
+            tt = cls(sch['id'], dict(tt_events), tracks=[ t.track for t in tracks ])
+            output.append((sch['id'], tt))
+        return output
+
+    @classmethod
+    def forConference(cls, conf):
+        """
+        Returns the list of (schedule id, TimeTable2) of every day of the
+        conference, sorted by date.
+        """
+        sids = Schedule.objects\
+            .filter(conference=conf)\
+            .order_by('date')\
+            .values_list('id', flat=True)
+        return cls.fromSchedules(sids)
+
     @classmethod
     def fromTracks(cls, tids):
         """
@@ -223,30 +303,27 @@ class TimeTable2(object):
         return cls.fromEvents(sid, qs)
 
     def _analyze(self):
-        if self._analyzed:
+        """
+        Computes, for every event, the number of overlapping ("stacked")
+        events in the same tracks; only the tracks changed since the last
+        call are analyzed again.
+        """
+        dirty = self._dirty & set(self._tracks)
+        self._dirty = set()
+        if not dirty:
             return
-        # step 1 - I try "stacked" events
-        for t in self._tracks:
-            events = {}
-            timeline = []
-            for e in self.events.get(t, []):
-                row = (e['time'], e['time'] + timedelta(seconds=e['duration'] * 60), e['id'])
-                events[e['id']] = e
-                timeline.append(row)
-            for ix, e1 in enumerate(timeline):
-                for e2 in timeline[ix+1:]:
-                    # http://stackoverflow.com/questions/9044084/efficient-data-range-overlap-calculation-in-python
-                    latest_start = max(e1[0], e2[0])
-                    earliest_end = min(e1[1], e2[1])
-                    overlap = (earliest_end - latest_start)
-                    if overlap.seconds > 0 and overlap.days >= 0:
-                        for eid in (e1[2], e2[2]):
-                            e = events[eid]
-                            try:
-                                e['intersection'] += 1
-                            except KeyError:
-                                e['intersection'] = 1
-        self._analyzed = True
+        touched = {}
+        for t in dirty:
+            events = self.events.get(t, [])
+            self._overlaps[t] = _track_overlaps(events)
+            for e in events:
+                touched[id(e)] = e
+        for key, e in touched.items():
+            count = sum(o[key][1] for o in self._overlaps.values() if key in o)
+            if count:
+                e['intersection'] = count
+            else:
+                e.pop('intersection', None)
 
     def iterOnTracks(self, start=None):
         """
@@ -348,7 +425,7 @@ class TimeTable2(object):
                     if end and e['time'].time() > end:
                         del evs[ix]
 
-        return TimeTable2(self.sid, events)
+        return TimeTable2(self.sid, events, tracks=self._tracks)
 
     def adjustTimes(self, start=None, end=None):
         """
@@ -709,10 +786,12 @@ def archive_dir(directory):
     tar.close()
     return archive.getvalue()
 
-def timetables2ical(tts, altf=lambda d, comp: d):
+def event2ical(e, sdata, altf=lambda d, comp: d):
+    """
+    Returns the ical.Event of an event (as returned by dataaccess.event_data)
+    of the schedule `sdata`.
+    """
     from conference import ical
-    from conference import dataaccess
-    from datetime import timedelta
     from django.utils.html import strip_tags
 
     import pytz
@@ -720,47 +799,61 @@ def timetables2ical(tts, altf=lambda d, comp: d):
     utc = pytz.utc
     tz = timezone(dsettings.TIME_ZONE)
 
-    cal = altf({
-        'uid': '1',
-        'events': [],
-    }, 'calendar')
+    track = strip_tags(sdata['tracks'][e['tracks'][0]].title)
+    # iCal supports dates in a different timezone to UTC through TZID parameter:
+    # DTSTART;TZID=Europe/Rome:20120702T093000
+    #
+    # So, decided to convert the time in UTC.
+    start = utc.normalize(tz.localize(e['time']).astimezone(utc))
+    end = utc.normalize(tz.localize(e['time'] + timedelta(seconds=e['duration']*60)).astimezone(utc))
+    ce = {
+        'uid': e['id'],
+        'start': start,
+        #'duration': timedelta(seconds=e['duration']*60),
+        'end': end,
+        'location': 'Track: %s' % track,
+    }
+    if e['talk']:
+        url = dsettings.DEFAULT_URL_PREFIX + reverse('conference-talk', kwargs={'slug': e['talk']['slug']})
+        ce['summary'] = (e['talk']['title'], {'ALTREP': url})
+    else:
+        ce['summary'] = e['name']
+    return ical.Event(**altf(ce, 'event'))
+
+def timetables_events(tts):
+    """
+    Returns the events of the timetables in the calendar order, every event
+    only once.
+    """
+    output = []
     for tt in tts:
-        sdata = dataaccess.schedule_data(tt.sid)
-        for time, events in tt.iterOnTimes():
+        for _, events in tt.iterOnTimes():
             uniq = set()
             for e in events:
                 if e['id'] in uniq:
                     continue
                 uniq.add(e['id'])
-                track = strip_tags(sdata['tracks'][e['tracks'][0]].title)
-                # iCal supports dates in a different timezone to UTC through TZID parameter:
-                # DTSTART;TZID=Europe/Rome:20120702T093000
-                #
-                # So, decided to convert the time in UTC.
-                start = utc.normalize(tz.localize(e['time']).astimezone(utc))
-                end = utc.normalize(tz.localize(e['time'] + timedelta(seconds=e['duration']*60)).astimezone(utc))
-                ce = {
-                    'uid': e['id'],
-                    'start': start,
-                    #'duration': timedelta(seconds=e['duration']*60),
-                    'end': end,
-                    'location': 'Track: %s' % track,
-                }
-                if e['talk']:
-                    url = dsettings.DEFAULT_URL_PREFIX + reverse('conference-talk', kwargs={'slug': e['talk']['slug']})
-                    ce['summary'] = (e['talk']['title'], {'ALTREP': url})
-                else:
-                    ce['summary'] = e['name']
-                cal['events'].append(ical.Event(**altf(ce, 'event')))
+                output.append(e)
+    return output
+
+def timetables2ical(tts, altf=lambda d, comp: d):
+    from conference import ical
+    from conference import dataaccess
+
+    cal = altf({
+        'uid': '1',
+        'events': [],
+    }, 'calendar')
+    schedules = {}
+    for e in timetables_events(tts):
+        sid = e['schedule_id']
+        if sid not in schedules:
+            schedules[sid] = dataaccess.schedule_data(sid)
+        cal['events'].append(event2ical(e, schedules[sid], altf))
     return ical.Calendar(**cal)
 
 def conference2ical(conf, altf=lambda d, comp: d):
-    from conference import models
-
-    sids = models.Schedule.objects\
-        .filter(conference=conf)\
-        .values_list('id', flat=True)
-    tts = map(TimeTable2.fromSchedule, sids)
+    tts = [ tt for sid, tt in TimeTable2.forConference(conf) ]
     return timetables2ical(tts, altf=altf)
 
 def oembed(url, **kw):
@@ -25,6 +25,7 @@ from common.decorators import render_to_json
 from common.decorators import render_to_template
 from conference import dataaccess
 from conference import models
+from conference import search
 from conference import settings
 from conference import utils
 from conference.decorators import speaker_access, talk_access, profile_access
@@ -136,6 +137,46 @@ def talk_xml(request, slug, talk, full_access):
         'talk': talk,
     }
 
+@render_to_json
+def talk_search(request):
+    """
+    Full-text search of the talks of all the conferences (or of the
+    `conference` passed), as a ranked list.
+    """
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 100)
+    except ValueError:
+        return http.HttpResponseBadRequest('limit malformed')
+    # the same rules of talk_access: the proposed talks are visible only to
+    # the staff or, during the community voting, to the users that can vote.
+    if request.user.is_staff:
+        visible = None
+    else:
+        conf = models.Conference.objects.current()
+        voting = settings.VOTING_OPENED(conf, request.user) and settings.VOTING_ALLOWED(request.user)
+        def visible(conference, status):
+            return status != 'proposed' or (voting and conference == conf.code)
+
+    results = search.search_talks(
+        request.GET.get('q', ''),
+        conference=request.GET.get('conference') or None,
+        visible=visible,
+        limit=limit)
+    talks = dataaccess.talks_data([ tid for tid, _ in results ])
+    output = []
+    for (tid, score), t in zip(results, talks):
+        output.append({
+            'id': tid,
+            'conference': t['conference'],
+            'title': t['title'],
+            'slug': t['slug'],
+            'status': t['status'],
+            'speakers': [ s['name'] for s in t['speakers'] ],
+            'url': reverse('conference-talk', kwargs={'slug': t['slug']}),
+            'score': score,
+        })
+    return output
+
 def talk_video(request, slug):  # pragma: no cover
     tlk = get_object_or_404(models.Talk, slug=slug)
 
@@ -185,10 +226,9 @@ def talk_video(request, slug):  # pragma: no cover
 def conference_xml(request, conference):
     conference = get_object_or_404(models.Conference, code=conference)
     talks = models.Talk.objects.filter(conference=conference)
-    schedules = [
-        (s, utils.TimeTable2.fromSchedule(s.id))
-        for s in models.Schedule.objects.filter(conference=conference.code)
-    ]
+    schedules = models.Schedule.objects.filter(conference=conference.code)
+    timetables = dict(utils.TimeTable2.fromSchedules([ s.id for s in schedules ]))
+    schedules = [ (s, timetables[s.id]) for s in schedules ]
     return {
         'conference': conference,
         'talks': talks,
@@ -500,31 +540,25 @@ def voting(request):
         if not voting_allowed:
             return http.HttpResponseBadRequest('anonymous user not allowed')
 
-        data = dict((x.id, x) for x in talks)
+        # all the votes are validated before saving any of them
+        data = set(t['id'] for t in dataaccess.voting_catalogue(conf.code)['talks'])
+        votes = {}
         for k, v in filter(lambda x: x[0].startswith('vote-'), request.POST.items()):
             try:
-                talk = data[int(k[5:])]
-            except KeyError:
-                return http.HttpResponseBadRequest('invalid talk')
+                tid = int(k[5:])
             except ValueError:
                 return http.HttpResponseBadRequest('id malformed')
+            if tid not in data:
+                return http.HttpResponseBadRequest('invalid talk')
             if not v:
-                models.VotoTalk.objects.filter(user=request.user, talk=talk).delete()
+                votes[tid] = None
             else:
                 try:
-                    vote = Decimal(v)
-                except ValueError:
+                    votes[tid] = Decimal(v)
+                except (ValueError, ArithmeticError):
                     return http.HttpResponseBadRequest('vote malformed')
-                try:
-                    o = models.VotoTalk.objects.get(user=request.user, talk=talk)
-                except models.VotoTalk.DoesNotExist:
-                    o = models.VotoTalk(user=request.user, talk=talk)
-                if not vote:
-                    if o.id:
-                        o.delete()
-                else:
-                    o.vote = vote
-                    o.save()
+        if votes:
+            models.VotoTalk.objects.save_votes(request.user.id, conf.code, votes)
         if request.is_ajax():
             return http.HttpResponse('')
         else:
@@ -567,16 +601,11 @@ def voting(request):
                 widget=ReadonlyTagWidget(),
             )
 
-        # I want to associate with each talk a "unique" number to display next to the title to be able to easily find.
-        ordinal = dict()
-        for ix, t in enumerate(talks.order_by('created').values_list('id', flat=True)):
-            ordinal[t] = ix
-
-        user_votes = models.VotoTalk.objects.filter(user=request.user.id)
-
-        # Start by sorting talks by name
-        talks = talks.order_by('speakers__user__first_name',
-                               'speakers__user__last_name')
+        # The talks, with their "unique" number to display next to the title,
+        # and the indexes to filter them are shared by all the users; only
+        # the votes of the user are merged over them.
+        catalogue = dataaccess.voting_catalogue(conf.code)
+        votes = dataaccess.user_votes(request.user.id, conf.code)
 
         if request.GET:
             form = OptionForm(data=request.GET)
@@ -591,59 +620,48 @@ def voting(request):
                 'tags': '',
                 'order': 'random',
             }
+
+        selected = []
         # if options['abstracts'] == 'not-voted':
-        #     talks = talks.exclude(id__in=user_votes.values('talk_id'))
+        #     selected.append(set(t['id'] for t in catalogue['talks']) - set(votes))
         if options['talk_type'] in (tchar
                                     for (tchar, tdef) in settings.TALK_TYPES_TO_BE_VOTED):
-            talks = talks.filter(type__startswith=options['talk_type'])
+            ids = set()
+            for ttype, tids in catalogue['types'].items():
+                if ttype.startswith(options['talk_type']):
+                    ids |= tids
+            selected.append(ids)
 
         if options['language'] in (lcode
                                    for (lcode, ldef) in settings.TALK_SUBMISSION_LANGUAGES):
-            talks = talks.filter(language=options['language'])
+            selected.append(catalogue['languages'].get(options['language'], set()))
 
         if options['tags']:
             # if options['tags'] ends us a tag not associated with any talk I results
             # in a query that results from scratch; to avoid this limit the usable tag
             # as a filter to those associated with talk.
-            allowed = set()
-            ctt = ContentType.objects.get_for_model(models.Talk)
-            for t, usage in dataaccess.tags().items():
-                for cid, oid in usage:
-                    if cid == ctt.id:
-                        allowed.add(t.name)
-                        break
-            tags = set(options['tags']) & allowed
+            tags = set(options['tags']) & catalogue['talk_tags']
             if tags:
-                talks = talks.filter(id__in=models.ConferenceTaggedItem.objects\
-                    .filter(
-                        content_type__app_label='conference', content_type__model='talk',
-                        tag__name__in=tags)\
-                    .values('object_id')
-                )
-
-        talk_order = options['order']
-        votes = dict((x.talk_id, x) for x in user_votes)
-
-        # As talks are sorted by a model connected via a m2m can I have repeated the talk, and
-        # distinct does not apply in these case.
-        #
-        # It can only filtered in python, at this point I take this opportunity to engage
-        # votes user using a single loop.
-        dups = set()
-        def filter_vote(t):
-            if t['id'] in dups:
-                return False
-            dups.add(t['id'])
-            t['user_vote'] = votes.get(t['id'])
-            t['ordinal'] = ordinal[t['id']]
-            return True
-        talks = filter(filter_vote, talks.values('id'))
+                ids = set()
+                for t in tags:
+                    ids |= catalogue['tags'].get(t, set())
+                selected.append(ids)
+
+        talks = []
+        for t in catalogue['talks']:
+            if all(t['id'] in ids for ids in selected):
+                talks.append({
+                    'id': t['id'],
+                    'ordinal': t['ordinal'],
+                    'user_vote': votes.get(t['id']),
+                })
 
         # Fix talk order, if necessary
+        talk_order = options['order']
         if talk_order == 'vote':
             def key(x):
-                if x['user_vote']:
-                    return x['user_vote'].vote
+                if x['user_vote'] is not None:
+                    return x['user_vote']
                 else:
                     return Decimal('-99.99')
             talks = reversed(sorted(reversed(talks), key=key))
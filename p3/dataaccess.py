@@ -1,10 +1,19 @@
 # -*- coding: UTF-8 -*-
+import hashlib
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+
 from conference import cachef
 from conference import dataaccess as cdata
+from conference import ical
 from conference import models as cmodels
+from conference import utils as cutils
 from assopy import models as amodels
 from assopy import utils as autils
 from p3 import models
+from p3 import utils
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 
@@ -64,6 +73,7 @@ def _i_profile_data(sender, **kw):
 profile_data = cache_me(
     signals=(cdata.profile_data.invalidated,),
     models=(models.P3Profile,),
+    local=True,
     key='profile:%(uid)s')(profile_data, _i_profile_data)
 
 
@@ -87,12 +97,10 @@ def _i_talk_data(sender, **kw):
 talk_data = cache_me(
     signals=(cdata.talk_data.invalidated,),
     models=(models.P3Talk,),
+    local=True,
     key='talk:%(tid)s')(talk_data, _i_talk_data)
 
-def profiles_data(uids):
-    cached = zip(uids, profile_data.get_from_cache([ (x,) for x in uids ]))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+def _preload_profiles(missing):
     preload = {}
     profiles = models.P3Profile.objects\
         .filter(profile__in=missing)\
@@ -117,15 +125,10 @@ def profiles_data(uids):
         preload[spk.speaker_id]['speaker'] = spk
 
     cdata.profiles_data(missing)
+    return preload
 
-    output = []
-    for ix, e in enumerate(cached):
-        pid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = profile_data(pid, preload=preload[pid])
-        output.append(val)
-
-    return output
+def profiles_data(uids):
+    return profile_data.batch(uids, _preload_profiles)
 
 def _user_ticket(user, conference):
     q1 = user.ticket_set.all()\
@@ -289,3 +292,234 @@ def tags():
 tags = cache_me(
     signals=(cdata.tags.invalidated,),
     models=(models.P3Profile, cmodels.AttendeeProfile))(tags)
+
+def _ical_events(conference, events):
+    """
+    Encodes the VEVENT blocks of the passed events (as returned by
+    event_data) of the conference calendar; returns a dict that maps every
+    event id to a dict with the block without and with the abstract.
+    """
+    altfs = dict(
+        (abstract, utils.ical_altf(conference, abstract=abstract))
+        for abstract in (False, True))
+    schedules = {}
+    output = {}
+    for e in events:
+        sid = e['schedule_id']
+        if sid not in schedules:
+            schedules[sid] = cdata.schedule_data(sid)
+        output[e['id']] = dict(
+            (abstract, ''.join(cutils.event2ical(e, schedules[sid], altf).encode()))
+            for abstract, altf in altfs.items())
+    return output
+
+def ical_event(eid):
+    e = cdata.event_data(eid)
+    return _ical_events(e['conference'], [e])[eid]
+
+def _i_ical_event(sender, **kw):
+    if 'cache_keys' in kw:
+        # the keys of event_data, "event:<id>"
+        return [ 'ical:%s' % k for k in kw['cache_keys'] ]
+    if sender is cmodels.EventTrack:
+        return 'ical:event:%s' % kw['instance'].event_id
+    # the conference hq coordinates are in every event
+    eids = cmodels.Event.objects.values_list('id', flat=True)
+    return [ 'ical:event:%s' % x for x in eids ]
+
+ical_event = cache_me(
+    models=(cmodels.EventTrack, cmodels.SpecialPlace),
+    key='ical:event:%(eid)s')(ical_event, _i_ical_event)
+
+# the keys of event_data are not the ones of ical_event, they are mapped by
+# the invalidator instead of being passed through.
+def _on_event_data_invalidated(sender, **kw):
+    keys = _i_ical_event(sender, **kw)
+    if keys:
+        ical_event.invalidate(keys)
+
+cdata.event_data.invalidated.connect(_on_event_data_invalidated, weak=False)
+
+def conference_ics(conference, abstract=False):
+    """
+    The ics file of the conference calendar; returns a dict with the `body`
+    of the file, its `etag` and its `last_modified` date (UTC).
+
+    The VEVENT blocks are cached one by one, so when an event changes only
+    its block is encoded again.
+    """
+    tts = [ tt for sid, tt in cutils.TimeTable2.forConference(conference) ]
+    events = cutils.timetables_events(tts)
+
+    blocks = ical_event.get_from_cache([ (e['id'],) for e in events ])
+    missing = [ e for e, b in zip(events, blocks) if b is cachef.CacheFunction.CACHE_MISS ]
+    if missing:
+        encoded = _ical_events(conference, missing)
+        ical_event.set_many_to_cache(
+            [ (e['id'],) for e in missing ],
+            [ encoded[e['id']] for e in missing ])
+        blocks = [
+            encoded[e['id']] if b is cachef.CacheFunction.CACHE_MISS else b
+            for e, b in zip(events, blocks) ]
+
+    altf = utils.ical_altf(conference, abstract=abstract)
+    cal = altf({
+        'uid': '1',
+        'events': [ ical.Encoded(b[abstract]) for b in blocks ],
+    }, 'calendar')
+    body = ''.join(ical.Calendar(**cal).encode())
+    return {
+        'body': body,
+        'etag': hashlib.md5(body).hexdigest(),
+        'last_modified': datetime.utcnow(),
+    }
+
+def _i_conference_ics(sender, **kw):
+    # every change to the events (or to the conferences, for the calendar
+    # ttl) bumps the version of all the calendars.
+    return 'ical'
+
+conference_ics = cache_me(
+    signals=(ical_event.invalidated,),
+    models=(cmodels.Conference, cmodels.Schedule, cmodels.Event),
+    local=True,
+    namespace='ical',
+    key='ical:conference:%(conference)s:%(abstract)s')(conference_ics, _i_conference_ics)
+
+def user_schedule(uid, conference):
+    """
+    The materialized "my schedule" of a user: a dict with the `events` the
+    user is interested in or has booked (schedule id -> event ids), the
+    `partner` program fares of the user's tickets and a `version` that
+    changes every time the data is computed again.
+    """
+    events = defaultdict(list)
+    qs = cmodels.Event.objects\
+        .filter(eventinterest__user=uid, eventinterest__interest__gt=0)\
+        .filter(schedule__conference=conference)\
+        .values('id', 'schedule')
+    for x in qs:
+        events[x['schedule']].append(x['id'])
+
+    qs = cmodels.EventBooking.objects\
+        .filter(user=uid, event__schedule__conference=conference)\
+        .values('event', 'event__schedule')
+    for x in qs:
+        if x['event'] not in events[x['event__schedule']]:
+            events[x['event__schedule']].append(x['event'])
+
+    fids = set(cmodels.Ticket.objects\
+        .filter(user=uid)\
+        .filter(fare__conference=conference, fare__ticket_type='partner')\
+        .values_list('fare', flat=True))
+    partner = [ f for f in cdata.fares(conference) if f['id'] in fids ]
+
+    return {
+        'events': dict(events),
+        'partner': partner,
+        'version': int(time.time() * 1000),
+    }
+
+def _i_user_schedule(sender, **kw):
+    o = kw['instance']
+    if sender is cmodels.Fare:
+        # the fares are copied in the schedule of every user
+        return 'user_schedule'
+    elif sender is cmodels.Ticket:
+        conference = o.fare.conference
+    else:
+        conference = o.event.schedule.conference
+    return 'user_schedule:%s:%s' % (o.user_id, conference)
+
+user_schedule = cache_me(
+    models=(cmodels.EventInterest, cmodels.EventBooking, cmodels.Ticket, cmodels.Fare),
+    namespace=('user_schedule', 'user_schedule:%(uid)s:%(conference)s'),
+    key='user_schedule:%(uid)s:%(conference)s')(user_schedule, _i_user_schedule)
+
+def _live_track_state(events, t0):
+    """
+    The (current, next) events of a track at the time `t0`, or None if the
+    track has no events or the current one is already over; it follows the rules of
+    TimeTable2.iterOnTracks(start=('current', t0)).
+    """
+    if not events:
+        return None
+    starts = [ e['time'].time() for e in events ]
+    ix = bisect_left(starts, t0)
+    if ix == len(events) or (ix > 0 and starts[ix] != t0):
+        ix -= 1
+    curr = events[ix]
+    if (curr['time'] + timedelta(seconds=curr['duration']*60)).time() < t0:
+        return None
+    try:
+        next = events[ix + 1]
+    except IndexError:
+        next = None
+    return curr, next
+
+def live_timeline(conference, date):
+    """
+    The precomputed live state of a conference day; a dict with:
+
+        `events`: the events of every track (as in TimeTable2.iterOnTracks)
+        `boundaries`: the sorted list of times when the state changes
+        `states`: the state of every interval between two boundaries (the
+                  first one is the state before the first boundary), a dict
+                  track -> (current event, next event) or None
+
+    Special events are not part of the states.
+    """
+    sid = cmodels.Schedule.objects\
+        .values_list('id', flat=True)\
+        .get(conference=conference, date=date)
+    tt = cutils.TimeTable2.fromSchedules([sid])[0][1]
+    events = dict((track, list(evs)) for track, evs in tt.iterOnTracks())
+    tt.removeEventsByTag('special')
+    tracks = dict((track, list(evs)) for track, evs in tt.iterOnTracks())
+
+    boundaries = set()
+    for evs in tracks.values():
+        for e in evs:
+            boundaries.add(e['time'].time())
+            # an event is still the current one at its end time
+            end = e['time'] + timedelta(seconds=e['duration']*60, microseconds=1)
+            boundaries.add(end.time())
+    boundaries = sorted(boundaries)
+
+    states = []
+    for t0 in [ datetime.min.time() ] + boundaries:
+        states.append(dict(
+            (track, _live_track_state(evs, t0)) for track, evs in tracks.items()))
+    return {
+        'events': events,
+        'boundaries': boundaries,
+        'states': states,
+    }
+
+def _i_live_timeline(sender, **kw):
+    return 'live'
+
+live_timeline = cache_me(
+    signals=(
+        cdata.schedule_data.invalidated,
+        cdata.event_data.invalidated,
+        cdata.talk_data.invalidated,
+    ),
+    models=(cmodels.EventTrack,),
+    local=True,
+    namespace='live',
+    key='live:%(conference)s:%(date)s')(live_timeline, _i_live_timeline)
+
+def live_state(conference, date, t0):
+    """
+    Returns the live state of the conference at the time `t0` of the day
+    `date` (see live_timeline) and the time of its next change (None if it
+    does not change anymore).
+    """
+    timeline = live_timeline(conference, date)
+    ix = bisect_right(timeline['boundaries'], t0)
+    try:
+        until = timeline['boundaries'][ix]
+    except IndexError:
+        until = None
+    return timeline['states'][ix], until
@@ -262,3 +262,6 @@ def _on_event_booked(sender, **kw):
         ThreadSubscription.objects.unsubscribe(talk, user)
 
 event_booked.connect(_on_event_booked)
+
+# the listeners that keep the attendee search up to date
+import p3.search
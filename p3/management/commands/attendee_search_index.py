@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from p3 import models
+from p3 import search
+
+class Command(BaseCommand):
+    """
+    Rebuilds the attendee search of the registration desk for a conference
+    (needed once, after that the entries are kept up to date by p3.search).
+    """
+    args = '<conference>'
+
+    def handle(self, *args, **options):
+        try:
+            conference = args[0]
+        except IndexError:
+            raise CommandError('conference not specified')
+        search.rebuild(conference)
+        print '%d attendees indexed' % models.AttendeeSearchEntry.objects\
+            .filter(conference=conference, deleted=False)\
+            .count()
@@ -529,5 +529,24 @@ class P3Profile(models.Model):
         log.info('email from "%s" to "%s" sent', from_.email, self.profile.user.email)
 
 
+class AttendeeSearchEntry(models.Model):
+    """
+    An attendee (a valid conference ticket) as searched by the registration
+    desk, see p3.search.
+    """
+    # no cascade: the entry of a deleted ticket is replaced by a tombstone
+    # by p3.search
+    ticket = models.OneToOneField(Ticket, primary_key=True, related_name='+',
+        on_delete=models.DO_NOTHING, db_constraint=False)
+    conference = models.CharField(max_length=20, db_index=True)
+    name = models.CharField(max_length=200)
+    email = models.CharField(max_length=254)
+    fare_code = models.CharField(max_length=10)
+    # the ticket is no longer valid; kept so that the in-memory indexes of
+    # the other processes see the removal with the other changes
+    deleted = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+
 #TODO: what is this import doing here?!
 import p3.listeners
@@ -0,0 +1,310 @@
+# -*- coding: UTF-8 -*-
+"""
+Search of the attendees for the registration desk.
+
+Every valid conference ticket has an AttendeeSearchEntry with the attendee
+name and email, rebuilt when the ticket, its TicketConference, its order
+or the user account of the attendee change; the entry of a ticket no
+longer valid is replaced by a tombstone. Every process keeps, for each
+conference, a trigram index of the entries in memory, refreshed before a
+search with the entries changed (or removed) since the previous one.
+"""
+import threading
+import unicodedata
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from assopy.models import Order, OrderItem
+from conference.models import Ticket
+from p3.models import AttendeeSearchEntry, TicketConference
+
+def normalize(text):
+    """
+    Lower case and without accents, "José" is found searching "jose".
+    """
+    text = unicodedata.normalize('NFKD', unicode(text).lower())
+    return u''.join(c for c in text if not unicodedata.combining(c))
+
+def trigrams(word):
+    """
+    The trigrams of a word; the padding on the left makes the prefixes of
+    one and two characters trigrams too.
+    """
+    word = u'  ' + word
+    return set(word[ix:ix+3] for ix in range(len(word) - 2))
+
+def _query_trigrams(term):
+    if len(term) < 3:
+        return set([ (u'  ' + term)[-3:] ])
+    return set(term[ix:ix+3] for ix in range(len(term) - 2))
+
+def attendee_entries(tids):
+    """
+    Returns the AttendeeSearchEntry (unsaved) of the valid conference
+    tickets among `tids`. The name is the one of the user account of the
+    attendee, or the name on the ticket, or the email of the attendee (the
+    same rules of the build_ticket_search_app command).
+    """
+    tickets = list(Ticket.objects\
+        .filter(
+            id__in=tids,
+            fare__ticket_type='conference',
+            orderitem__order___complete=True,
+            frozen=False)\
+        .values(
+            'id', 'name', 'fare__conference', 'fare__code',
+            'user__first_name', 'user__last_name', 'user__email',
+            'p3_conference__assigned_to'))
+    emails = set(t['p3_conference__assigned_to'].strip().lower()
+        for t in tickets if t['p3_conference__assigned_to'])
+    accounts = {}
+    if emails:
+        q = Q()
+        for email in emails:
+            q |= Q(email__iexact=email)
+        for email, first, last in User.objects\
+                .filter(q, is_active=True)\
+                .values_list('email', 'first_name', 'last_name'):
+            accounts[email.lower()] = u'%s %s' % (first, last)
+
+    output = []
+    for t in tickets:
+        assigned = (t['p3_conference__assigned_to'] or '').strip()
+        if assigned:
+            name = accounts.get(assigned.lower(), u'')
+            email = assigned
+        else:
+            name = u'%s %s' % (t['user__first_name'], t['user__last_name'])
+            email = t['user__email']
+        name = name.strip()
+        if not name:
+            name = t['name'].strip()
+            if u'@' not in name:
+                name = name.title()
+        if not name:
+            name = email
+        output.append(AttendeeSearchEntry(
+            ticket_id=t['id'],
+            conference=t['fare__conference'],
+            name=name,
+            email=email,
+            fare_code=t['fare__code'],
+        ))
+    return output
+
+def index_tickets(tids):
+    """
+    Rebuilds the entries of the tickets; the ones no longer valid (or of
+    deleted tickets) become tombstones.
+    """
+    tids = list(tids)
+    if not tids:
+        return
+    entries = attendee_entries(tids)
+    found = set(e.ticket_id for e in entries)
+    indexed = AttendeeSearchEntry.objects\
+        .filter(ticket__in=tids)\
+        .values_list('ticket', 'conference')
+    for tid, conference in indexed:
+        if tid not in found:
+            entries.append(AttendeeSearchEntry(ticket_id=tid, conference=conference, deleted=True))
+    AttendeeSearchEntry.objects.filter(ticket__in=tids).delete()
+    AttendeeSearchEntry.objects.bulk_create(entries)
+
+def rebuild(conference):
+    """
+    Rebuilds the entries of all the tickets of the conference.
+    """
+    tids = list(Ticket.objects\
+        .filter(fare__conference=conference)\
+        .values_list('id', flat=True))
+    for ix in range(0, len(tids), 500):
+        index_tickets(tids[ix:ix+500])
+    # the entries of the tickets deleted in the meantime
+    gone = set(AttendeeSearchEntry.objects\
+        .filter(conference=conference, deleted=False)\
+        .values_list('ticket', flat=True)) - set(tids)
+    index_tickets(gone)
+
+class TrigramIndex(object):
+    """
+    In-memory trigram index of the entries of a conference.
+    """
+    # an entry saved by a transaction committed after the previous refresh
+    # can have an older `updated`; the overlap picks it up.
+    OVERLAP = timedelta(seconds=60)
+
+    def __init__(self, conference):
+        self.conference = conference
+        self.postings = defaultdict(set)
+        self.entries = {}
+        self.updated = None
+        self.lock = threading.Lock()
+
+    def add(self, entry):
+        self.remove(entry.ticket_id)
+        words = normalize(u'%s %s %s' % (entry.name, entry.email, entry.ticket_id)).split()
+        grams = set()
+        for w in words:
+            grams |= trigrams(w)
+        for g in grams:
+            self.postings[g].add(entry.ticket_id)
+        self.entries[entry.ticket_id] = {
+            'ticket': entry.ticket_id,
+            'name': entry.name,
+            'email': entry.email,
+            'fare': entry.fare_code,
+            '_words': words,
+            '_grams': grams,
+        }
+
+    def remove(self, tid):
+        try:
+            grams = self.entries.pop(tid)['_grams']
+        except KeyError:
+            return
+        for g in grams:
+            p = self.postings[g]
+            p.discard(tid)
+            if not p:
+                del self.postings[g]
+
+    def refresh(self):
+        """
+        Loads the entries changed since the previous refresh and drops the
+        removed ones (their tombstones).
+        """
+        qs = AttendeeSearchEntry.objects.filter(conference=self.conference)
+        if self.updated is None:
+            qs = qs.filter(deleted=False)
+        else:
+            qs = qs.filter(updated__gte=self.updated - self.OVERLAP)
+        for entry in qs:
+            if entry.deleted:
+                self.remove(entry.ticket_id)
+            else:
+                self.add(entry)
+            if self.updated is None or entry.updated > self.updated:
+                self.updated = entry.updated
+
+    def search(self, query, limit=10):
+        """
+        Returns the entries with all the terms of the query as substrings of
+        their name, email or ticket id; the entries where the terms are
+        prefixes of the words come first.
+        """
+        terms = normalize(query).split()
+        if not terms:
+            return []
+        candidates = None
+        for term in terms:
+            for g in _query_trigrams(term):
+                p = self.postings.get(g, set())
+                candidates = p.copy() if candidates is None else candidates & p
+                if not candidates:
+                    return []
+
+        def score(e):
+            s = 0
+            for term in terms:
+                if any(w == term for w in e['_words']):
+                    s += 3
+                elif any(w.startswith(term) for w in e['_words']):
+                    s += 2
+                elif any(term in w for w in e['_words']):
+                    s += 1
+                else:
+                    # the trigrams matched but not in this order
+                    return 0
+            return s
+
+        results = []
+        for tid in candidates:
+            e = self.entries[tid]
+            s = score(e)
+            if s:
+                results.append((-s, e['name'], tid))
+        results.sort()
+        output = []
+        for _, _, tid in results[:limit]:
+            e = self.entries[tid]
+            output.append(dict((k, v) for k, v in e.items() if not k.startswith('_')))
+        return output
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def search_attendees(conference, query, limit=10):
+    """
+    Returns up to `limit` attendees of the conference (dicts with ticket,
+    name, email and fare) matching `query`.
+    """
+    with _indexes_lock:
+        try:
+            index = _indexes[conference]
+        except KeyError:
+            index = _indexes[conference] = TrigramIndex(conference)
+    with index.lock:
+        index.refresh()
+        return index.search(query, limit=limit)
+
+def _on_ticket_changed(sender, **kw):
+    index_tickets([ kw['instance'].id ])
+
+def _on_ticket_deleted(sender, **kw):
+    # the ticket is gone, its entry becomes a tombstone
+    index_tickets([ kw['instance'].id ])
+
+def _on_ticket_conference_changed(sender, **kw):
+    index_tickets([ kw['instance'].ticket_id ])
+
+def _on_order_changed(sender, **kw):
+    index_tickets(Ticket.objects\
+        .filter(orderitem__order=kw['instance'])\
+        .values_list('id', flat=True))
+
+def _on_order_item_changed(sender, **kw):
+    if kw['instance'].ticket_id:
+        index_tickets([ kw['instance'].ticket_id ])
+
+# the fields of the user account used by attendee_entries
+_USER_FIELDS = ('first_name', 'last_name', 'email', 'is_active')
+
+def _skip_user_save(kw):
+    # a save that does not touch the indexed fields, eg. the one of the
+    # last_login on every login
+    fields = kw.get('update_fields')
+    return bool(fields) and not set(fields) & set(_USER_FIELDS)
+
+def _on_user_pre_save(sender, **kw):
+    o = kw['instance']
+    o._old_search_fields = None
+    if o.pk and not _skip_user_save(kw):
+        o._old_search_fields = User.objects\
+            .filter(pk=o.pk)\
+            .values_list(*_USER_FIELDS)\
+            .first()
+
+def _on_user_changed(sender, **kw):
+    if _skip_user_save(kw):
+        return
+    o = kw['instance']
+    old = getattr(o, '_old_search_fields', None)
+    if old is not None and old == tuple(getattr(o, f) for f in _USER_FIELDS):
+        return
+    q = Q(user=o, p3_conference__assigned_to='') | Q(user=o, p3_conference=None)
+    if o.email:
+        q |= Q(p3_conference__assigned_to__iexact=o.email)
+    index_tickets(Ticket.objects.filter(q).values_list('id', flat=True))
+
+post_save.connect(_on_ticket_changed, sender=Ticket)
+post_delete.connect(_on_ticket_deleted, sender=Ticket)
+post_save.connect(_on_ticket_conference_changed, sender=TicketConference)
+post_save.connect(_on_order_changed, sender=Order)
+post_save.connect(_on_order_item_changed, sender=OrderItem)
+pre_save.connect(_on_user_pre_save, sender=User)
+post_save.connect(_on_user_changed, sender=User)
@@ -4,16 +4,21 @@ from conference.models import Ticket, Speaker, Talk
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.conf import settings
-from django.db.models import Q, Count
+from django.db.models import Q
 from p3 import models
+from assopy import models as amodels
+from conference import cachef
 from conference import models as cmodels
 
+cache_me = cachef.CacheFunction(prefix='p3:stats:')
+
 
 def _create_option(id, title, total_qs, **kwargs):
     output = {
         'id': id,
         'title': title,
-        'total': total_qs.count(),
+        # a queryset or a list of the rows of the tickets snapshot
+        'total': len(total_qs) if isinstance(total_qs, list) else total_qs.count(),
     }
     output.update(kwargs)
     return output
@@ -51,56 +56,140 @@ def _unassigned_tickets(conf, ticket_type='conference', only_complete=True):
         .filter(Q(p3_conference=None)|Q(name='')|Q(p3_conference__assigned_to=''))
 
 
-def shirt_sizes(conf):
-    sizes = dict(models.TICKET_CONFERENCE_SHIRT_SIZES)
-    qs = _assigned_tickets(conf)\
-        .values('p3_conference__shirt_size')\
-        .annotate(total=Count('id'))
+# The ticket stats are computed from a snapshot of the tickets of the
+# conference, loaded with a single query and stored by column: every stat
+# and every drill-down list is a scan of the snapshot.
+_SNAPSHOT_COLUMNS = (
+    ('id', 'id'),
+    ('name', 'name'),
+    ('ticket_type', 'ticket_type'),
+    ('fare', 'fare__code'),
+    ('fare_type', 'fare__ticket_type'),
+    ('complete', 'orderitem__order___complete'),
+    ('method', 'orderitem__order__method'),
+    ('uid', 'user'),
+    ('first_name', 'user__first_name'),
+    ('last_name', 'user__last_name'),
+    ('email', 'user__email'),
+    ('p3', 'p3_conference__id'),
+    ('assigned_to', 'p3_conference__assigned_to'),
+    ('shirt_size', 'p3_conference__shirt_size'),
+    ('diet', 'p3_conference__diet'),
+    ('days', 'p3_conference__days'),
+)
+
+def tickets_snapshot(conf):
+    """
+    The tickets (not frozen) of the conference, as a dict of columns (see
+    _SNAPSHOT_COLUMNS); `accounts` maps the emails the tickets are assigned
+    to the (id, first name, last name) of the user with that email.
+    """
+    names = [ name for name, _ in _SNAPSHOT_COLUMNS ]
+    columns = dict((name, []) for name in names)
+    rows = Ticket.objects\
+        .filter(fare__conference=conf, frozen=False)\
+        .values_list(*[ lookup for _, lookup in _SNAPSHOT_COLUMNS ])
+    for row in rows:
+        for name, value in zip(names, row):
+            columns[name].append(value)
+
+    accounts = {}
+    users = User.objects\
+        .filter(email__in=models.TicketConference.objects\
+            .filter(ticket__fare__conference=conf)\
+            .exclude(assigned_to='')\
+            .values('assigned_to'))\
+        .values_list('email', 'id', 'first_name', 'last_name')
+    for email, uid, first_name, last_name in users:
+        accounts[email] = (uid, first_name, last_name)
+    return {
+        'size': len(columns['id']),
+        'columns': columns,
+        'accounts': accounts,
+    }
 
-    output = []
-    for x in qs:
-        output.append({
-            'title': sizes.get(x['p3_conference__shirt_size']),
-            'total': x['total'],
-        })
+def _i_tickets_snapshot(sender, **kw):
+    if sender is User and kw.get('update_fields') and set(kw['update_fields']) <= set(['last_login']):
+        return None
+    return 'tickets_snapshot'
+
+tickets_snapshot = cache_me(
+    models=(Ticket, models.TicketConference, amodels.Order, amodels.OrderItem, User),
+    namespace='tickets_snapshot',
+    key='tickets_snapshot:%(conf)s')(tickets_snapshot, _i_tickets_snapshot)
 
+
+def _select(snap, ticket_type=None, fare_code=None, only_complete=True):
+    """
+    The filters of `_tickets` applied to the snapshot; returns the indexes
+    of the matching rows.
+    """
+    c = snap['columns']
+    output = []
+    for ix in xrange(snap['size']):
+        if not c['complete'][ix] and (only_complete or c['method'][ix] != 'bank'):
+            continue
+        if ticket_type and c['fare_type'][ix] != ticket_type:
+            continue
+        if fare_code:
+            if fare_code.endswith('%'):
+                if not c['fare'][ix].startswith(fare_code[:-1]):
+                    continue
+            elif c['fare'][ix] != fare_code:
+                continue
+        output.append(ix)
     return output
-shirt_sizes.short_description = "Tshirts size"
 
 
-def diet_types(conf):
-    diets = dict(models.TICKET_CONFERENCE_DIETS)
-    qs = _assigned_tickets(conf)\
-        .values('p3_conference__diet')\
-        .annotate(total=Count('id'))
+def _is_assigned(snap, ix):
+    # same as `_assigned_tickets`
+    c = snap['columns']
+    return c['p3'][ix] is not None and c['name'][ix] != '' and c['assigned_to'][ix] != ''
 
+
+def _choices_repartition(snap, column, choices):
+    c = snap['columns']
+    totals = defaultdict(lambda: 0)
+    for ix in _select(snap, 'conference'):
+        if _is_assigned(snap, ix):
+            totals[c[column][ix]] += 1
+
+    order = dict((k, ix) for ix, (k, _) in enumerate(choices))
+    titles = dict(choices)
     output = []
-    for x in qs:
+    for k, total in sorted(totals.items(), key=lambda x: order.get(x[0], len(order))):
         output.append({
-            'title': diets.get(x['p3_conference__diet']),
-            'total': x['total'],
+            'title': titles.get(k),
+            'total': total,
         })
     return output
+
+
+def shirt_sizes(conf):
+    return _choices_repartition(
+        tickets_snapshot(conf), 'shirt_size', models.TICKET_CONFERENCE_SHIRT_SIZES)
+shirt_sizes.short_description = "Tshirts size"
+
+
+def diet_types(conf):
+    return _choices_repartition(
+        tickets_snapshot(conf), 'diet', models.TICKET_CONFERENCE_DIETS)
 diet_types.short_description = "Diet"
 
 
 def presence_days(conf, code=None):
-    qs = {
-        'all': {
-            'c': _assigned_tickets(conf),
-            'n': _unassigned_tickets(conf, only_complete=False),
-        },
-        'nostaff': {
-            'c': _assigned_tickets(conf).exclude(ticket_type='staff'),
-            'n': _unassigned_tickets(conf, only_complete=False).exclude(ticket_type='staff'),
-        }
-    }
-    totals = {}
-    for key in qs:
-        totals[key] = {
-            'c': qs[key]['c'].count(),
-            'n': qs[key]['n'].count(),
-        }
+    snap = tickets_snapshot(conf)
+    c = snap['columns']
+    assigned = [ ix for ix in _select(snap, 'conference') if _is_assigned(snap, ix) ]
+    unassigned = [
+        ix for ix in _select(snap, 'conference', only_complete=False)
+        if not _is_assigned(snap, ix) ]
+    groups = (
+        ('all', assigned, unassigned),
+        ('nostaff',
+            [ ix for ix in assigned if c['ticket_type'][ix] != 'staff' ],
+            [ ix for ix in unassigned if c['ticket_type'][ix] != 'staff' ]),
+    )
     output = {
         'columns': (
             ('total', 'Total'),
@@ -110,24 +199,20 @@ def presence_days(conf, code=None):
         'data': [],
     }
 
-    days = {
-        'all': defaultdict(lambda: 0),
-        'nostaff': defaultdict(lambda: 0),
-    }
-    for key in qs:
-        for x in qs[key]['c'].values_list('p3_conference__days', flat=True):
-            val = filter(None, map(lambda v: v.strip(), x.split(',')))
+    for key, complete, other in groups:
+        days = defaultdict(lambda: 0)
+        for ix in complete:
+            val = filter(None, map(lambda v: v.strip(), c['days'][ix].split(',')))
             if not val:
-                days[key]['x'] += 1
+                days['x'] += 1
             else:
                 for v in val:
-                    days[key][v] += 1
+                    days[v] += 1
 
-    for key in days:
-        dX = days[key].get('x', 0)
-        tC = totals[key]['c']
-        tN = totals[key]['n']
-        for day, count in sorted(days[key].items()):
+        dX = days.get('x', 0)
+        tC = len(complete)
+        tN = len(other)
+        for day, count in sorted(days.items()):
             if day != 'x':
                 nc = float(count) / (tC - dX) * (tC + tN)
             else:
@@ -144,39 +229,68 @@ def presence_days(conf, code=None):
 presence_days.short_description = "Conference attendance"
 
 
+def _user_link(uid, first_name, last_name):
+    return '<a href="%s">%s %s</a>' % (
+        reverse('admin:auth_user_change', args=(uid,)),
+        first_name,
+        last_name)
+
+
+def _ticket_link(tid):
+    return '<a href="%s">%s</a>' % (
+        reverse('admin:conference_ticket_change', args=(tid,)),
+        tid)
+
+
 def tickets_status(conf, code=None):
-    orphan_tickets = _tickets(conf, 'conference')\
-        .filter(p3_conference__isnull=False)\
-        .exclude(p3_conference__assigned_to='')\
-        .exclude(p3_conference__assigned_to__in=User.objects.values('email'))
-    multiple_assignments = _assigned_tickets(conf, 'conference')\
-        .values('p3_conference__assigned_to')\
-        .annotate(total=Count('id'))\
-        .filter(total__gt=1)
+    snap = tickets_snapshot(conf)
+    c = snap['columns']
+    sold = _select(snap, 'conference')
+    assigned = [ ix for ix in sold if _is_assigned(snap, ix) ]
+    per_email = defaultdict(lambda: 0)
+    for ix in assigned:
+        per_email[c['assigned_to'][ix]] += 1
+    multiple_emails = set(k for k, v in per_email.items() if v > 1)
+
+    rows = {
+        'ticket_sold': sold,
+        'assigned_tickets': assigned,
+        'unassigned_tickets': [ ix for ix in sold if not _is_assigned(snap, ix) ],
+        'multiple_assignments': [ ix for ix in sold if c['assigned_to'][ix] in multiple_emails ],
+        'orphan_tickets': [
+            ix for ix in sold
+            if c['p3'][ix] is not None
+            and c['assigned_to'][ix]
+            and c['assigned_to'][ix] not in snap['accounts'] ],
+        'voupe03_tickets': _select(snap, fare_code='VOUPE03'),
+    }
     if 0: # FIXME: remove hotels and sim
         sim_tickets = _tickets(conf, fare_code='SIM%')\
             .filter(Q(p3_conference_sim=None)|Q(name='')|Q(p3_conference_sim__document=''))\
             .select_related('p3_conference_sim')
-    voupe03 = _tickets(conf, fare_code='VOUPE03')
-    from p3.utils import spam_recruiter_by_conf
-    spam_recruiting = spam_recruiter_by_conf(conf)
+    if code is None or code == 'spam_recruiting':
+        from p3.utils import spam_recruiter_by_conf
+        spam_recruiting = spam_recruiter_by_conf(conf)
     if code is None:
         # FIXME: remove hotel and sim (sim_tickets has been removed from the parameters of ticket_status_no_code function
-        output = ticket_status_no_code(conf, multiple_assignments, orphan_tickets, spam_recruiting, voupe03)
+        output = ticket_status_no_code(rows, len(multiple_emails), spam_recruiting)
 
     else:
         if code in ('ticket_sold', 'assigned_tickets', 'unassigned_tickets', 'multiple_assignments', ):
-            output = ticket_status_for_un_assigned_sold_tickets(code, conf, multiple_assignments)
+            output = ticket_status_for_un_assigned_sold_tickets(snap, rows[code])
 
         elif code in ('orphan_tickets',):
-            output = ticket_status_for_orphant_tickets(code, orphan_tickets)
+            output = ticket_status_for_orphant_tickets(snap, rows[code])
 
         elif code in ('voupe03_tickets',):
-            output = ticket_status_for_voupe03_tickets(code, voupe03)
+            output = ticket_status_for_voupe03_tickets(snap, rows[code])
 
         elif code == 'spam_recruiting':
             output = ticket_status_for_spam_recruiting(spam_recruiting)
 
+        else:
+            raise ValueError('Unsupported stats code: %r' % code)
+
         if 0:
             # elif code in ('sim_tickets',):
             #     output = ticket_status_for_sim_tickets(code, sim_tickets)
@@ -185,8 +299,52 @@ def tickets_status(conf, code=None):
     return output
 
 
-def ticket_status_for_un_assigned_sold_tickets(code, conf, multiple_assignments):
-    output = {
+def _ticket_assignee(snap, ix):
+    """
+    The email and the account (id, first name, last name, or None) of the
+    attendee of a ticket: the assigned person or the buyer.
+    """
+    c = snap['columns']
+    if c['assigned_to'][ix]:
+        email = c['assigned_to'][ix]
+        return email, snap['accounts'].get(email)
+    return c['email'][ix], (c['uid'][ix], c['first_name'][ix], c['last_name'][ix])
+
+
+def ticket_status_for_un_assigned_sold_tickets(snap, ixs):
+    c = snap['columns']
+
+    def order(ix):
+        u = _ticket_assignee(snap, ix)[1]
+        if u:
+            key = u[1] + u[2]
+        else:
+            key = c['name'][ix]
+        return key or c['first_name'][ix] + c['last_name'][ix]
+
+    # p3_conference can be None because it's filled lazily when
+    # the ticket is saved for the first time
+    ixs = sorted((ix for ix in ixs if c['p3'][ix] is not None), key=order)
+
+    def rows():
+        for ix in ixs:
+            buyer = (c['uid'][ix], c['first_name'][ix], c['last_name'][ix])
+            email, u = _ticket_assignee(snap, ix)
+            if u:
+                name = _user_link(*u)
+            else:
+                name = '%s <strong>Ticket not assigned</strong>' % c['name'][ix]
+            yield {
+                'ticket': _ticket_link(c['id'][ix]),
+                'name': name,
+                'email': email,
+                'fare': c['fare'][ix],
+                'buyer': _user_link(*buyer),
+                'buyer_email': c['email'][ix],
+                'uid': (u or buyer)[0],
+            }
+
+    return {
         'columns': (
             ('ticket', 'Ticket'),
             ('name', 'Attendee name'),
@@ -195,76 +353,25 @@ def ticket_status_for_un_assigned_sold_tickets(code, conf, multiple_assignments)
             ('buyer', 'Buyer'),
             ('buyer_email', 'Buyer Email'),
         ),
-        'data': [],
+        'data': rows(),
     }
-    if code == 'ticket_sold':
-        qs = _tickets(conf, 'conference')
-    elif code == 'assigned_tickets':
-        qs = _assigned_tickets(conf)
-    elif code == 'unassigned_tickets':
-        qs = _unassigned_tickets(conf)
-    elif code == 'multiple_assignments':
-        qs = _tickets(conf, 'conference') \
-            .filter(p3_conference__assigned_to__in=multiple_assignments \
-                    .values('p3_conference__assigned_to'))
-    else:
-        raise ValueError('Unsupported stats code: %r' % code)
-    qs = qs.select_related('p3_conference', 'user')
-    assignees = dict([
-        (u.email, u) for u in User.objects \
-            .filter(email__in=qs \
-                    .exclude(p3_conference__assigned_to='') \
-                    .values('p3_conference__assigned_to'))])
-    data = output['data']
-    for x in qs:
-        ticket = '<a href="%s">%s</a>' % (
-            reverse('admin:conference_ticket_change', args=(x.id,)),
-            x.id)
-        # p3_conference can be None because it's filled lazily when
-        # the ticket is saved for the first time
-        try:
-            x.p3_conference
-        except models.TicketConference.DoesNotExist:
-            continue
-        if x.p3_conference and x.p3_conference.assigned_to:
-            email = x.p3_conference.assigned_to
-            u = assignees.get(email)
-        else:
-            email = x.user.email
-            u = x.user
-        if u:
-            name = '<a href="%s">%s %s</a>' % (
-                reverse('admin:auth_user_change', args=(u.id,)),
-                u.first_name,
-                u.last_name)
-            order = u.first_name + u.last_name
-        else:
-            name = '%s <strong>Ticket not assigned</strong>' % x.name
-            order = x.name
-        buyer = '<a href="%s">%s %s</a>' % (
-            reverse('admin:auth_user_change', args=(x.user.id,)),
-            x.user.first_name,
-            x.user.last_name)
-        if not order:
-            order = x.user.first_name + x.user.last_name
-        buyer_email = x.user.email
-        row = {
-            'ticket': ticket,
-            'name': name,
-            'email': email,
-            'fare': x.fare.code,
-            'buyer': buyer,
-            'buyer_email': buyer_email,
-            '_order': order,
-            'uid': (u or x.user).id,
-        }
-        data.append(row)
-    data.sort(key=lambda x: x['_order'])
-    return output
 
 
-def ticket_status_for_orphant_tickets(code, orphan_tickets):
-    output = {
+def ticket_status_for_orphant_tickets(snap, ixs):
+    c = snap['columns']
+
+    def rows():
+        for ix in ixs:
+            yield {
+                'ticket': _ticket_link(c['id'][ix]),
+                'name': c['name'][ix],
+                'email': c['assigned_to'][ix],
+                'fare': c['fare'][ix],
+                'buyer': _user_link(c['uid'][ix], c['first_name'][ix], c['last_name'][ix]),
+                'buyer_email': c['email'][ix],
+            }
+
+    return {
         'columns': (
             ('ticket', 'Ticket'),
             ('name', 'Attendee name'),
@@ -273,81 +380,57 @@ def ticket_status_for_orphant_tickets(code, orphan_tickets):
             ('buyer', 'Buyer'),
             ('buyer_email', 'Buyer Email'),
         ),
-        'data': [],
+        'data': rows(),
     }
-    if code == 'orphan_tickets':
-        qs = orphan_tickets
-    else:
-        raise ValueError('Unsupported stats code: %r' % code)
-    qs = qs.select_related('p3_conference', 'user', 'fare')
-    data = output['data']
-    for x in qs:
-        ticket = '<a href="%s">%s</a>' % (
-            reverse('admin:conference_ticket_change', args=(x.id,)),
-            x.id)
-        buyer = '<a href="%s">%s %s</a>' % (
-            reverse('admin:auth_user_change', args=(x.user.id,)),
-            x.user.first_name,
-            x.user.last_name)
-        data.append({
-            'ticket': ticket,
-            'name': x.name,
-            'email': x.p3_conference.assigned_to,
-            'fare': x.fare.code,
-            'buyer': buyer,
-            'buyer_email': x.user.email,
-        })
-    return output
 
 
 def ticket_status_for_spam_recruiting(spam_recruiting):
-    output = {
+    def rows():
+        qs = spam_recruiting.order_by('first_name', 'last_name')
+        for x in qs.iterator():
+            buyer_name = '%s %s' % (x.first_name, x.last_name)
+            name = '<a href="%s">%s</a>' % (
+                reverse('admin:auth_user_change', args=(x.id,)), buyer_name)
+            yield {
+                'name': name,
+                'uid': x.id,
+                'email': x.email,
+            }
+
+    return {
         'columns': (
             ('uid', 'User ID'),
             ('name', 'Attendee name'),
         ),
-        'data': [],
+        'data': rows(),
     }
-    qs = spam_recruiting.order_by('first_name', 'last_name')
-    data = output['data']
-    for x in qs:
-        buyer_name = '%s %s' % (x.first_name, x.last_name)
-        name = '<a href="%s">%s</a>' % (
-            reverse('admin:auth_user_change', args=(x.id,)), buyer_name)
-        data.append({
-            'name': name,
-            'uid': x.id,
-            'email': x.email,
-        })
-    return output
 
 
-def ticket_status_for_voupe03_tickets(code, voupe03):
-    output = {
+def ticket_status_for_voupe03_tickets(snap, ixs):
+    c = snap['columns']
+
+    def buyer_name(ix):
+        return '%s %s' % (c['first_name'][ix], c['last_name'][ix])
+
+    def rows():
+        for ix in sorted(ixs, key=lambda ix: c['name'][ix] or buyer_name(ix)):
+            buyer = '<a href="%s">%s</a>' % (
+                reverse('admin:auth_user_change', args=(c['uid'][ix],)), buyer_name(ix))
+            yield {
+                'name': c['name'][ix] or buyer_name(ix),
+                'buyer': buyer,
+                'uid': c['uid'][ix],
+                'email': c['email'][ix],
+            }
+
+    return {
         'columns': (
             ('uid', 'User ID'),
             ('name', 'Attendee name'),
             ('buyer', 'Buyer'),
         ),
-        'data': [],
+        'data': rows(),
     }
-    if code == 'voupe03_tickets':
-        qs = voupe03
-    else:
-        raise ValueError('Unsupported stats code: %r' % code)
-    qs = qs.select_related('user')
-    data = output['data']
-    for x in sorted(qs, key=lambda x: x.name or '%s %s' % (x.user.first_name, x.user.last_name)):
-        buyer_name = '%s %s' % (x.user.first_name, x.user.last_name)
-        buyer = '<a href="%s">%s</a>' % (
-            reverse('admin:auth_user_change', args=(x.user.id,)), buyer_name)
-        data.append({
-            'name': x.name or buyer_name,
-            'buyer': buyer,
-            'uid': x.user.id,
-            'email': x.user.email,
-        })
-    return output
 
 
 if 0: # FIXME: remove hotels and sim
@@ -385,26 +468,46 @@ if 0: # FIXME: remove hotels and sim
         return output
 
 
-def ticket_status_no_code(conf, multiple_assignments, orphan_tickets, spam_recruiting, voupe03):
+def ticket_status_no_code(rows, multiple_assignments, spam_recruiting):
     return [
-        _create_option('ticket_sold', 'Sold tickets', _tickets(conf, 'conference')),
-        _create_option('assigned_tickets', 'Assigned tickets', _assigned_tickets(conf)),
-        _create_option('unassigned_tickets', 'Unassigned tickets', _unassigned_tickets(conf)),
+        _create_option('ticket_sold', 'Sold tickets', rows['ticket_sold']),
+        _create_option('assigned_tickets', 'Assigned tickets', rows['assigned_tickets']),
+        _create_option('unassigned_tickets', 'Unassigned tickets', rows['unassigned_tickets']),
         # _create_option('sim_tickets', 'Tickets with SIM card orders', sim_tickets),  # FIXME: remove hotels and sim
-        _create_option('voupe03_tickets', 'Social event tickets (VOUPE03)', voupe03),
+        _create_option('voupe03_tickets', 'Social event tickets (VOUPE03)', rows['voupe03_tickets']),
         _create_option('spam_recruiting', 'Recruiting emails (opt-in)', spam_recruiting),
-        _create_option('multiple_assignments', 'Tickets assigned to the same person', multiple_assignments),
-        _create_option('orphan_tickets', 'Assigned tickets without user record (orphaned)', orphan_tickets)
+        {
+            'id': 'multiple_assignments',
+            'title': 'Tickets assigned to the same person',
+            'total': multiple_assignments,
+        },
+        _create_option('orphan_tickets', 'Assigned tickets without user record (orphaned)', rows['orphan_tickets'])
     ]
 
 
 tickets_status.short_description = 'Tickets stats'
 
+def _speaker_rows(speakers):
+    for x in speakers:
+        yield {
+            'name': '<a href="%s">%s %s</a>' % (
+                reverse('admin:auth_user_change', args=(x.user_id,)),
+                x.user.first_name,
+                x.user.last_name),
+            'email': x.user.email,
+            'uid': x.user_id,
+        }
+
+
 def speaker_status(conf, code=None):
-    t = _tickets(conf, 'conference')
-    spk_noticket = Speaker.objects.byConference(conf)\
-        .exclude(user__in=t.values('user'))\
-        .exclude(user__email__in=t.extra(where=["assigned_to!=''"]).values('p3_conference__assigned_to'))
+    snap = tickets_snapshot(conf)
+    c = snap['columns']
+    sold = _select(snap, 'conference')
+    buyers = set(c['uid'][ix] for ix in sold)
+    assignees = set(c['assigned_to'][ix] for ix in sold if c['assigned_to'][ix])
+    spk_noticket = [
+        x for x in Speaker.objects.byConference(conf).select_related('user')
+        if x.user_id not in buyers and x.user.email not in assignees ]
     spk_nodata = Speaker.objects.byConference(conf)\
         .filter(Q(
                 user__attendeeprofile__image='',
@@ -429,29 +532,19 @@ def speaker_status(conf, code=None):
         }
     else:
         if code == 'no_ticket':
-            qs = spk_noticket
+            qs = sorted(spk_noticket, key=lambda x: (x.user.first_name, x.user.last_name))
         elif code == 'no_data':
-            qs = spk_nodata
+            qs = spk_nodata\
+                .select_related('user')\
+                .order_by('user__first_name', 'user__last_name')\
+                .iterator()
         output = {
             'columns': (
                 ('name', 'Name'),
                 ('email', 'Email'),
             ),
-            'data': [],
+            'data': _speaker_rows(qs),
         }
-        data = output['data']
-        qs = qs\
-            .select_related('user')\
-            .order_by('user__first_name', 'user__last_name')
-        for x in qs:
-            data.append({
-                'name': '<a href="%s">%s %s</a>' % (
-                    reverse('admin:auth_user_change', args=(x.user_id,)),
-                    x.user.first_name,
-                    x.user.last_name),
-                'email': x.user.email,
-                'uid': x.user_id,
-            })
     return output
 speaker_status.short_description = 'Speakers stats'
 
@@ -481,21 +574,8 @@ def conference_speakers(conf, code=None):
                 ('name', 'Name'),
                 ('email', 'Email'),
             ),
-            'data': [],
+            'data': _speaker_rows(qs.select_related('user').iterator()),
         }
-        data = output['data']
-        qs = qs\
-            .select_related('user')\
-            .order_by('user__first_name', 'user__last_name')
-        for x in qs:
-            data.append({
-                'name': '<a href="%s">%s %s</a>' % (
-                    reverse('admin:auth_user_change', args=(x.user_id,)),
-                    x.user.first_name,
-                    x.user.last_name),
-                'email': x.user.email,
-                'uid': x.user_id,
-            })
     return output
 conference_speakers.short_description = 'Speakers'
 
@@ -577,14 +657,20 @@ def conference_speakers_day(conf, code=None):
 conference_speakers_day.short_description = 'Speaker for day'
 
 def pp_tickets(conf, code=None):
+    snap = tickets_snapshot(conf)
+    c = snap['columns']
     fcodes = cmodels.Fare.objects\
         .filter(conference=conf, ticket_type='partner')\
         .order_by('code')\
         .values_list('code', flat=True)
-    qs = {}
+    rows = {}
     for fcode in fcodes:
-        qs[fcode] = _tickets(conf, fare_code=fcode)
-    all_attendees = User.objects.filter(id__in=_tickets(conf, ticket_type='partner').values('user'))
+        rows[fcode] = _select(snap, fare_code=fcode)
+    # one row for every buyer of a partner program ticket
+    all_attendees = {}
+    for ix in _select(snap, ticket_type='partner'):
+        all_attendees.setdefault(c['uid'][ix], ix)
+    all_attendees = [ all_attendees[uid] for uid in sorted(all_attendees) ]
     if code is None:
         output = [
             _create_option('all', 'Tickets partner program', all_attendees)
@@ -596,40 +682,28 @@ def pp_tickets(conf, code=None):
         for fcode in fcodes:
             output.append({
                 'id': fcode,
-                'total': qs[fcode].count(),
+                'total': len(rows[fcode]),
                 'title': fcode + ' - ' + titles[fcode],
             })
     else:
+        def data(ixs):
+            for ix in ixs:
+                buyer_name = '%s %s' % (c['first_name'][ix], c['last_name'][ix])
+                yield {
+                    'name': '' if code == 'all' else (c['name'][ix] or buyer_name),
+                    'buyer': '<a href="%s">%s</a>' % (
+                        reverse('admin:auth_user_change', args=(c['uid'][ix],)),
+                        buyer_name),
+                    'email': c['email'][ix],
+                    'uid': c['uid'][ix],
+                }
         output = {
             'columns': (
                 ('name', 'Attendee name'),
                 ('buyer', 'Buyer'),
                 ('email', 'Email'),
             ),
-            'data': [],
+            'data': data(all_attendees if code == 'all' else rows[code]),
         }
-        data = output['data']
-        if code == 'all':
-            for x in all_attendees:
-                data.append({
-                    'name': '',
-                    'buyer': '<a href="%s">%s %s</a>' % (
-                        reverse('admin:auth_user_change', args=(x.id,)),
-                        x.first_name,
-                        x.last_name),
-                    'email': x.email,
-                    'uid': x.id,
-                })
-        else:
-            for x in qs[code]:
-                data.append({
-                    'name': x.name or ('%s %s' % (x.user.first_name, x.user.last_name)),
-                    'buyer': '<a href="%s">%s %s</a>' % (
-                        reverse('admin:auth_user_change', args=(x.user_id,)),
-                        x.user.first_name,
-                        x.user.last_name),
-                    'email': x.user.email,
-                    'uid': x.user_id,
-                })
     return output
 pp_tickets.short_description = 'Tickets Partner program'
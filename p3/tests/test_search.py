@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+import json
+
+import mock
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django_factory_boy import auth as auth_factories
+
+from assopy.stripe.tests.factories import AssopyUserFactory, OrderItemFactory, VatFactory
+from assopy.tests.factories.order import CreditCardOrderFactory
+from conference.tests.factories.conference import ConferenceFactory
+from conference.tests.factories.fare import FareFactory, TicketFactory
+from p3 import search
+from p3.models import AttendeeSearchEntry
+from p3.tests.factories.ticket_conference import TicketConferenceFactory
+
+
+class TestTrigrams(TestCase):
+    def test_prefixes(self):
+        self.assertEqual(search.trigrams(u'ada'), set([u'  a', u' ad', u'ada']))
+
+    def test_normalize(self):
+        self.assertEqual(search.normalize(u'José Ramírez'), u'jose ramirez')
+
+
+@mock.patch('email_template.utils.email')
+@mock.patch('django.core.mail.send_mail')
+class TestSearchAttendees(TestCase):
+    def setUp(self):
+        search._indexes.clear()
+        self.conference = ConferenceFactory()
+
+    def _ticket(self, first_name, last_name):
+        user = auth_factories.UserFactory(first_name=first_name, last_name=last_name)
+        fare = FareFactory(conference=self.conference.code, ticket_type='conference')
+        ticket = TicketFactory(fare=fare, user=user, frozen=False)
+        TicketConferenceFactory(ticket=ticket, assigned_to=user.email)
+        order = CreditCardOrderFactory(user=AssopyUserFactory(user=user))
+        order._complete = True
+        order.save()
+        OrderItemFactory(order=order, ticket=ticket, price=1, vat=VatFactory())
+        return ticket
+
+    def _search(self, query):
+        return [ x['ticket'] for x in search.search_attendees(self.conference.code, query) ]
+
+    def test_search(self, *mocks):
+        jose = self._ticket(u'José', u'Ramírez')
+        ada = self._ticket(u'Ada', u'Lovelace')
+
+        self.assertEqual(self._search(u'jose'), [jose.id])
+        self.assertEqual(self._search(u'ram jo'), [jose.id])
+        self.assertEqual(self._search(u'lace'), [ada.id])
+        self.assertEqual(self._search(str(ada.id)), [ada.id])
+        self.assertEqual(self._search(u'grace'), [])
+
+    def test_incremental_updates(self, *mocks):
+        ada = self._ticket(u'Ada', u'Lovelace')
+        self.assertEqual(self._search(u'ada'), [ada.id])
+
+        ada.user.first_name = u'Augusta'
+        ada.user.save()
+        self.assertEqual(self._search(u'ada'), [])
+        self.assertEqual(self._search(u'augusta'), [ada.id])
+
+        ada.frozen = True
+        ada.save()
+        self.assertEqual(self._search(u'augusta'), [])
+
+    def test_removal_seen_by_other_processes(self, *mocks):
+        ada = self._ticket(u'Ada', u'Lovelace')
+        other = search.TrigramIndex(self.conference.code)
+        other.refresh()
+        self.assertEqual([ x['ticket'] for x in other.search(u'ada') ], [ada.id])
+
+        ada.frozen = True
+        ada.save()
+        # only the changed entries are loaded
+        with self.assertNumQueries(1):
+            other.refresh()
+        self.assertEqual(other.search(u'ada'), [])
+
+        tid = ada.id
+        ada.delete()
+        self.assertTrue(AttendeeSearchEntry.objects.get(ticket=tid).deleted)
+
+    def test_user_saves_without_changes(self, *mocks):
+        user = self._ticket(u'Ada', u'Lovelace').user
+        with mock.patch.object(search, 'index_tickets') as index_tickets:
+            user.save(update_fields=['last_login'])
+            user.save()
+            self.assertFalse(index_tickets.called)
+            user.first_name = u'Augusta'
+            user.save()
+            self.assertTrue(index_tickets.called)
+
+    def test_view(self, *mocks):
+        ada = self._ticket(u'Ada', u'Lovelace')
+        staff = auth_factories.UserFactory(password='password1234', is_staff=True)
+        self.client.login(username=staff.username, password='password1234')
+
+        url = reverse('p3-attendee-search', kwargs={'conference': self.conference.code})
+        response = self.client.get(url, {'q': 'love'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([ x['ticket'] for x in json.loads(response.content) ], [ada.id])
@@ -1,6 +1,8 @@
 import unittest
 import mock
+from django.core.cache import cache
 from django.test import TestCase
+from django.test.utils import override_settings
 from django_factory_boy import auth as auth_factories
 
 from assopy.stripe.tests.factories import (
@@ -109,3 +111,56 @@ class StatsTestCase(TestCase):
     def test_pp_tickets(self):
         from p3.stats import pp_tickets
         repartition = pp_tickets(self.conference)
+
+    def _sold_ticket(self):
+        fare = FareFactory(conference=self.conference, ticket_type='conference')
+        ticket = TicketFactory(fare=fare, user=self.user, frozen=False)
+        TicketConferenceFactory(ticket=ticket, assigned_to=self.user.email)
+        order = CreditCardOrderFactory(user=self.assopy_user)
+        order._complete = True
+        order.save()
+        OrderItemFactory(order=order, ticket=ticket, price=1, vat=VatFactory())
+        return ticket
+
+    @mock.patch('email_template.utils.email')
+    @mock.patch('django.core.mail.send_mail')
+    def test_tickets_status_from_snapshot(self, mock_send_email, mock_email):
+        from p3.stats import tickets_status, _tickets, _assigned_tickets, _unassigned_tickets
+        self._sold_ticket()
+
+        totals = dict((x['id'], x['total']) for x in tickets_status(self.conference))
+        self.assertEqual(totals['ticket_sold'], _tickets(self.conference, 'conference').count())
+        self.assertEqual(totals['assigned_tickets'], _assigned_tickets(self.conference).count())
+        self.assertEqual(totals['unassigned_tickets'], _unassigned_tickets(self.conference).count())
+        self.assertEqual(totals['orphan_tickets'], 0)
+
+        details = tickets_status(self.conference, 'assigned_tickets')
+        self.assertEqual([ x['uid'] for x in details['data'] ], [ self.user.id ])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @mock.patch('email_template.utils.email')
+    @mock.patch('django.core.mail.send_mail')
+    def test_tickets_snapshot_invalidation(self, mock_send_email, mock_email):
+        from p3.stats import tickets_snapshot
+        cache.clear()
+        ticket = self._sold_ticket()
+        self.assertEqual(tickets_snapshot(self.conference)['size'], 1)
+
+        ticket.frozen = True
+        ticket.save()
+        self.assertEqual(tickets_snapshot(self.conference)['size'], 0)
+
+    @mock.patch('email_template.utils.email')
+    @mock.patch('django.core.mail.send_mail')
+    def test_stats_details_csv_is_streamed(self, mock_send_email, mock_email):
+        from django.core.urlresolvers import reverse
+        self._sold_ticket()
+        admin = auth_factories.UserFactory(password='password1234', is_staff=True, is_superuser=True)
+        self.client.login(username=admin.username, password='password1234')
+
+        url = reverse('admin:conference-ticket-stats-details-csv', args=(self.conference.code,))
+        response = self.client.get(url, {'code': 'tickets_status.assigned_tickets'})
+        self.assertTrue(response.streaming)
+        lines = ''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn(self.user.email, lines[1])
@@ -1,5 +1,9 @@
+import importlib
 import unittest
+from datetime import time
 
+import mock
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test import override_settings
@@ -7,7 +11,13 @@ from django_factory_boy import auth as auth_factories
 
 from conference.tests.factories.attendee_profile import AttendeeProfileFactory
 from conference.tests.factories.conference import ConferenceFactory
+from conference.tests.factories.event import EventFactory, EventTrackFactory
 from p3.tests.factories.schedule import ScheduleFactory
+from p3.tests.factories.track import TrackFactory
+
+# p3.views does `from p3.views.schedule import *`, that rebinds the
+# `schedule` attribute of the package to the schedule view.
+schedule_views = importlib.import_module('p3.views.schedule')
 
 
 class TestWhosComing(TestCase):
@@ -202,3 +212,105 @@ class TestView(TestCase):
         })
         response = self.client.get(url, follow=True)
         self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class TestScheduleFragments(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.conference = ConferenceFactory()
+        schedule = ScheduleFactory(
+            conference=self.conference.code,
+            date=self.conference.conference_start)
+        self.event = EventFactory(
+            schedule=schedule, talk=None, custom='Opening',
+            start_time=time(9, 0), duration=30)
+        EventTrackFactory(event=self.event, track=TrackFactory(schedule=schedule))
+
+    def fragments(self):
+        return schedule_views._conference_schedule_fragments(self.conference.code)
+
+    def test_days_are_rendered_once(self):
+        render = schedule_views._render_schedule_days
+        with mock.patch.object(schedule_views, '_render_schedule_days', wraps=render) as mock_render:
+            first = self.fragments()
+            second = self.fragments()
+        self.assertEqual(mock_render.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertIn('Opening', first[0][1])
+
+    def test_event_change_bumps_the_schedule_version(self):
+        self.fragments()
+        self.event.custom = 'Keynote'
+        self.event.save()
+        self.assertIn('Keynote', self.fragments()[0][1])
+
+
+@override_settings(CONFERENCE_CONFERENCE='epbeta', CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class TestScheduleIcs(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.conference = ConferenceFactory(code='epbeta')
+        schedule = ScheduleFactory(
+            conference=self.conference.code,
+            date=self.conference.conference_start)
+        self.event = EventFactory(
+            schedule=schedule, talk=None, custom='Opening',
+            start_time=time(9, 0), duration=30)
+        EventTrackFactory(event=self.event, track=TrackFactory(schedule=schedule))
+        self.url = reverse('p3-schedule-ics', kwargs={
+            'conference': self.conference.code,
+        })
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SUMMARY:Opening', response.content)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_event_change(self):
+        etag = self.client.get(self.url)['ETag']
+        self.event.custom = 'Keynote'
+        self.event.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SUMMARY:Keynote', response.content)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class TestUserSchedule(TestCase):
+    def setUp(self):
+        from p3 import dataaccess
+        cache.clear()
+        self.user_schedule = dataaccess.user_schedule
+        self.user = auth_factories.UserFactory()
+        self.conference = ConferenceFactory()
+        self.schedule = ScheduleFactory(conference=self.conference.code)
+        self.events = [
+            EventFactory(schedule=self.schedule, talk=None, start_time=time(9 + x, 0))
+            for x in range(2) ]
+
+    def test_materialized(self):
+        from conference.models import EventBooking, EventInterest
+        EventInterest.objects.create(user=self.user, event=self.events[0], interest=1)
+        data = self.user_schedule(self.user.id, self.conference.code)
+        self.assertEqual(data['events'], {self.schedule.id: [self.events[0].id]})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user_schedule(self.user.id, self.conference.code), data)
+
+        EventBooking.objects.create(user=self.user, event=self.events[1])
+        data = self.user_schedule(self.user.id, self.conference.code)
+        self.assertEqual(
+            sorted(data['events'][self.schedule.id]),
+            sorted(e.id for e in self.events))
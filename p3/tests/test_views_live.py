@@ -1,4 +1,5 @@
 import datetime
+import importlib
 import unittest
 
 import mock
@@ -13,6 +14,9 @@ from django_factory_boy import auth as auth_factories
 from p3.tests.factories.schedule import ScheduleFactory
 from p3.tests.factories.track import TrackFactory
 
+# p3.views re-exports the views, `p3.views.live` is the live view function
+live_views = importlib.import_module('p3.views.live')
+
 
 class TestLiveViews(TestCase):
     def setUp(self):
@@ -72,3 +76,70 @@ class TestLiveViews(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get('content-type'), 'application/json')
         self.assertJSONEqual(response.content, {})
+
+
+class TestLiveState(TestCase):
+    def setUp(self):
+        from conference.tests.factories.event import EventFactory, EventTrackFactory
+        self.conference = ConferenceFactory(code='epbeta', conference_start=datetime.date.today())
+        self.schedule = ScheduleFactory(conference=self.conference.code, date=datetime.date.today())
+        track = TrackFactory(schedule=self.schedule, track='track1')
+        self.events = []
+        for hour in (9, 10):
+            e = EventFactory(
+                schedule=self.schedule, talk=None, custom='event',
+                start_time=datetime.time(hour, 0), duration=45)
+            EventTrackFactory(event=e, track=track)
+            self.events.append(e)
+
+    def state(self, t0):
+        from p3.dataaccess import live_state
+        return live_state(self.conference.code, self.schedule.date, t0)
+
+    def test_current_and_next(self):
+        state, until = self.state(datetime.time(9, 30))
+        curr, next = state['track1']
+        self.assertEqual(curr['id'], self.events[0].id)
+        self.assertEqual(next['id'], self.events[1].id)
+        self.assertEqual(until, datetime.time(9, 45, 0, 1))
+
+    def test_before_the_first_event(self):
+        state, until = self.state(datetime.time(8, 0))
+        self.assertEqual(state['track1'][0]['id'], self.events[0].id)
+        self.assertEqual(until, datetime.time(9, 0))
+
+    def test_between_events(self):
+        state, until = self.state(datetime.time(9, 50))
+        self.assertIsNone(state['track1'])
+        self.assertEqual(until, datetime.time(10, 0))
+
+    def test_end_of_the_day(self):
+        state, until = self.state(datetime.time(11, 0))
+        self.assertIsNone(state['track1'])
+        self.assertIsNone(until)
+
+    def test_same_as_timetable(self):
+        from conference.utils import TimeTable2
+        tt = TimeTable2.fromSchedule(self.schedule.id)
+        for minutes in range(7 * 60, 12 * 60, 5):
+            t0 = datetime.time(minutes // 60, minutes % 60)
+            for track, events in tt.iterOnTracks(start=('current', t0)):
+                expected = events[0]
+                if (expected['time'] + datetime.timedelta(seconds=expected['duration']*60)).time() < t0:
+                    expected = None
+                state, _ = self.state(t0)
+                if expected is None:
+                    self.assertIsNone(state[track])
+                else:
+                    self.assertEqual(state[track][0]['id'], expected['id'])
+
+    @override_settings(
+        CONFERENCE_CONFERENCE='epbeta', DEBUG=False,
+        P3_LIVE_EMBED=lambda request, track=None, event=None: None)
+    @mock.patch.object(live_views, 'LIVE_STREAM_TIMEOUT', 0)
+    def test_stream(self):
+        response = self.client.get(reverse('p3-live-events-stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = list(response.streaming_content)
+        self.assertTrue(chunks[0].startswith('retry:'))
+        self.assertTrue(chunks[1].startswith('data: '))
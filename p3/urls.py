@@ -24,9 +24,11 @@ urlpatterns = patterns('p3.views',
 
     url(r'^whos-coming$', 'whos_coming', name='p3-whos-coming', kwargs={'conference': None}),
     url(r'^(?P<conference>[\w-]+)/whos-coming$', 'whos_coming', name='p3-whos-coming-conference'),
+    url(r'^(?P<conference>[\w-]+)/attendees/search$', 'attendee_search', name='p3-attendee-search'),
 
     url(r'^live/$', 'live', name='p3-live'),
     url(r'^live/events$', 'live_events', name='p3-live-events'),
+    url(r'^live/events/stream$', 'live_events_stream', name='p3-live-events-stream'),
     url(r'^live/(?P<track>[\w-]+)/$', 'live_track', name='p3-live-track'),
     url(r'^live/(?P<track>[\w-]+)/video$', 'live_track_video', name='p3-live-track-video'),
     url(r'^live/(?P<track>[\w-]+)/events$', 'live_track_events', name='p3-live-track-events'),
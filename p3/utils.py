@@ -182,7 +182,11 @@ def invalidate_template_cache(fragment_name, *variables):
     cache.delete(cache_key)
     return
 
-def conference2ical(conf, user=None, abstract=False):
+def ical_altf(conf, user=None, abstract=False):
+    """
+    Returns the `altf` function used by conference2ical to customize the
+    calendar of the conference (or of the user schedule) and its events.
+    """
     from conference import dataaccess
     from conference import models as cmodels
     from datetime import timedelta
@@ -233,24 +237,21 @@ def conference2ical(conf, user=None, abstract=False):
                 ab = e['talk']['abstract'] if e['talk'] else e['abstract']
                 data['description'] = ab
         return data
+    return altf
+
+def conference2ical(conf, user=None, abstract=False):
+    altf = ical_altf(conf, user=user, abstract=abstract)
     if user is None:
         from conference.utils import conference2ical as f
         cal = f(conf, altf=altf)
     else:
         from conference.utils import TimeTable2
         from conference.utils import timetables2ical as f
+        from p3.dataaccess import user_schedule
 
-        qs = cmodels.Event.objects\
-            .filter(eventinterest__user=user, eventinterest__interest__gt=0)\
-            .filter(schedule__conference=conf)\
-            .values('id', 'schedule')
-
-        events = defaultdict(list)
-        for x in qs:
-            events[x['schedule']].append(x['id'])
-
+        events = user_schedule(user, conf)['events']
         sids = sorted(events.keys())
-        timetables = [ TimeTable2.fromEvents(x, events[x]) for x in sids ]
+        timetables = [ tt for sid, tt in TimeTable2.fromSchedules(sids, eids=events) ]
         cal = f(timetables, altf=altf)
     return cal
 
@@ -4,6 +4,7 @@ from django import http
 from django.conf import settings
 from django.contrib import auth
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
 from django.db import transaction
@@ -14,11 +15,12 @@ from django.template import RequestContext, Template
 import p3.forms as p3forms
 from p3 import dataaccess
 from p3 import models
+from p3 import search
 from p3 import utils as p3utils
 import assopy.models as amodels
 from assopy.forms import RefundItemForm
 from assopy.views import HttpResponseRedirectSeeOther
-from common.decorators import render_to_template
+from common.decorators import render_to_json, render_to_template
 from assopy import utils as autils
 from conference import forms as cforms
 from conference import models as cmodels
@@ -438,6 +440,18 @@ def whos_coming(request, conference=None):
         tpl = 'p3/whos_coming.html'
     return render(request, tpl, ctx)
 
+@staff_member_required
+@render_to_json
+def attendee_search(request, conference):
+    """
+    Typeahead search of the attendees for the registration desk.
+    """
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        return http.HttpResponseBadRequest('limit malformed')
+    return search.search_attendees(conference, request.GET.get('q', ''), limit=limit)
+
 
 from p3.views.cart import *
 from p3.views.live import *
@@ -1,5 +1,6 @@
 # -*- coding: UTF-8 -*-
 import datetime
+import time
 
 from django import http
 from django.conf import settings
@@ -7,10 +8,22 @@ from django.core.urlresolvers import reverse
 from django.shortcuts import render
 
 from common.decorators import render_to_json
+from common.jsonify import json_dumps
 from conference import models as cmodels
-from conference.utils import TimeTable2
 from p3 import dataaccess
 
+# lifetime (in seconds) of a live_events_stream connection, the browser
+# reconnects after `LIVE_STREAM_RETRY` seconds; the state is checked at
+# every event boundary and at least every `LIVE_STREAM_POLL` seconds, to
+# catch the changes to the schedule.
+# An open stream holds a whole worker when the site is served by sync
+# workers (the gunicorn default), so the default is a short poll; longer
+# connections are meant for deployments with an async worker class
+# (gunicorn -k gevent or eventlet).
+LIVE_STREAM_TIMEOUT = getattr(settings, 'P3_LIVE_STREAM_TIMEOUT', 20)
+LIVE_STREAM_RETRY = getattr(settings, 'P3_LIVE_STREAM_RETRY', 5)
+LIVE_STREAM_POLL = getattr(settings, 'P3_LIVE_STREAM_POLL', 10)
+
 
 def _live_conference():
     conf = cmodels.Conference.objects.current()
@@ -54,54 +67,35 @@ def live_track_video(request, track):
 
 @render_to_json
 def live_track_events(request, track):
-    # FIXME: We don't handle the case where the track does not exist
     conf, date = _live_conference()
 
-    tid = cmodels.Track.objects\
-        .get(track=track, schedule__date=date).id
-    tt = TimeTable2.fromTracks([tid])
+    timeline = dataaccess.live_timeline(conf.code, date)
     output = []
-    for _, events in tt.iterOnTracks():
-        for e in events:
-            if e.get('talk'):
-                speakers = ', '.join([ x['name'] for x in e['talk']['speakers']])
-            else:
-                speakers = None
-            output.append({
-                'name': e['name'],
-                'time': e['time'],
-                'duration': e['duration'],
-                'tags': e['tags'],
-                'speakers': speakers,
-            })
+    for e in timeline['events'].get(track, []):
+        if e.get('talk'):
+            speakers = ', '.join([ x['name'] for x in e['talk']['speakers']])
+        else:
+            speakers = None
+        output.append({
+            'name': e['name'],
+            'time': e['time'],
+            'duration': e['duration'],
+            'tags': e['tags'],
+            'speakers': speakers,
+        })
     return output
 
-@render_to_json
-def live_events(request):
-    conf, date = _live_conference()
-    sid = cmodels.Schedule.objects\
-        .values('id')\
-        .get(conference=conf.code, date=date)
-
-    tt = TimeTable2.fromSchedule(sid['id'])
-    tt.removeEventsByTag('special')
-    t0 = datetime.datetime.now().time()
-
+def _live_events(request, state):
     tracks = settings.P3_LIVE_TRACKS.keys()
     events = {}
-    for track, tevts in tt.iterOnTracks(start=('current', t0)):
-        curr = None
-        try:
-            curr = dict(tevts[0])
-            curr['next'] = dict(tevts[1])
-        except IndexError:
-            pass
-        # I've deleted all special events, t0 could be on one of them
-        if curr and (curr['time'] + datetime.timedelta(seconds=curr['duration']*60)).time() < t0:
-            curr = None
-
+    for track, current in state.items():
         if track not in tracks:
             continue
+        curr = None
+        if current is not None:
+            curr = dict(current[0])
+            if current[1] is not None:
+                curr['next'] = dict(current[1])
         events[track] = curr
 
     def event_url(event):
@@ -150,3 +144,42 @@ def live_events(request):
             'next': next,
         }
     return output
+
+@render_to_json
+def live_events(request):
+    conf, date = _live_conference()
+    state, _ = dataaccess.live_state(conf.code, date, datetime.datetime.now().time())
+    return _live_events(request, state)
+
+def live_events_stream(request):
+    """
+    Server-sent events version of live_events; the lobby screens receive
+    the new state only when it changes, instead of polling live_events.
+    """
+    conf, date = _live_conference()
+
+    def stream():
+        deadline = time.time() + LIVE_STREAM_TIMEOUT
+        last = None
+        yield 'retry: %d\n\n' % (LIVE_STREAM_RETRY * 1000)
+        while True:
+            now = datetime.datetime.now()
+            state, until = dataaccess.live_state(conf.code, date, now.time())
+            data = json_dumps(_live_events(request, state))
+            if data != last:
+                yield 'data: %s\n\n' % data
+                last = data
+            else:
+                yield ': keep-alive\n\n'
+
+            wait = LIVE_STREAM_POLL
+            if until is not None:
+                delta = datetime.datetime.combine(now.date(), until) - now
+                wait = min(wait, delta.total_seconds())
+            if time.time() + wait > deadline:
+                break
+            time.sleep(max(wait, 0))
+
+    response = http.StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -7,10 +7,17 @@ from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.views.decorators.http import condition
 
 from common.decorators import render_to_json
+from conference import cachef
+from conference import dataaccess as cdata
 from conference import models as cmodels
 from conference.utils import TimeTable2
+from p3 import dataaccess
+
+cache_me = cachef.CacheFunction(prefix='p3:')
 
 
 def _partner_as_event(fares):
@@ -59,16 +66,9 @@ def _build_timetables(schedules, events=None, partner=None):
         Because of partner program not covered by listed schedule).
         `Partner` must be compatible with the output of` _partner_as_event`.
     """
-    tts = []
-
-    if schedules and not events:
-        for row in schedules:
-            tt = TimeTable2.fromSchedule(row['id'])
-            tts.append((row['id'], tt))
-    else:
-        for row in schedules:
-            tt = TimeTable2.fromEvents(row['id'], events[row['id']])
-            tts.append((row['id'], tt))
+    tts = TimeTable2.fromSchedules(
+        [ row['id'] for row in schedules ],
+        eids=events or None)
 
     if partner:
         for date, evts in partner.items():
@@ -108,53 +108,128 @@ def _build_timetables(schedules, events=None, partner=None):
     return tts
 
 
-def _conference_timetables(conference):
-    """ Return the TimeTable about the conference."""
-    # The timetables must contain both events in the db and "artificial"
-    # events from partner program
-    sids = cmodels.Schedule.objects\
-        .filter(conference=conference)\
-        .values_list('id', flat=True)
+def _render_schedule_days(schedules):
+    """
+    Renders the timetables of the passed schedules (as returned by
+    `schedules_data`, all of the same conference); returns a dict that maps
+    every schedule id to its html, an empty string for the days without
+    events.
+    """
+    output = dict((row['id'], '') for row in schedules)
+    if not schedules:
+        return output
+    conference = schedules[0]['conference']
+    dates = set(row['date'] for row in schedules)
+    pfares = [ f for f in cdata.fares(conference) if f['ticket_type'] == 'partner' ]
+    partner = dict(
+        (d, evts) for d, evts in _partner_as_event(pfares).items() if d in dates)
+
+    sdata = dict((row['id'], row) for row in schedules)
+    for sid, tt in _build_timetables(schedules, partner=partner):
+        output[sid] = render_to_string('p3/fragments/schedule_day.html', {
+            'sdata': sdata[sid],
+            'timet': tt,
+        })
+    return output
 
-    from conference.dataaccess import fares, schedules_data
-    pfares = [ f for f in fares(conference) if f['ticket_type'] == 'partner' ]
-    partner = _partner_as_event(pfares)
 
-    schedules = schedules_data(sids)
-    tts = _build_timetables(schedules, partner=partner)
-    return tts
+def schedule_day_html(sid):
+    """
+    The html of the timetable of a single day of the schedule.
+    """
+    return _render_schedule_days(cdata.schedules_data([sid]))[sid]
+
+
+def _i_schedule_day_html(sender, **kw):
+    # every change to the events, talks, tracks or partner fares of any
+    # schedule bumps the schedule version.
+    return 'schedule'
+
+schedule_day_html = cache_me(
+    signals=(
+        cdata.schedule_data.invalidated,
+        cdata.event_data.invalidated,
+        cdata.talk_data.invalidated,
+    ),
+    models=(cmodels.EventTrack, cmodels.Fare),
+    namespace='schedule',
+    key='schedule_html:%(sid)s')(schedule_day_html, _i_schedule_day_html)
+
+
+def _conference_schedule_fragments(conference):
+    """
+    Returns the list of (schedule id, html) of the days of the conference
+    with at least one event; the html comes from the cache and only the
+    missing days are rendered (with a single TimeTable build).
+    """
+    sids = list(cmodels.Schedule.objects\
+        .filter(conference=conference)\
+        .order_by('date')\
+        .values_list('id', flat=True))
+
+    fragments = schedule_day_html.get_from_cache([ (sid,) for sid in sids ])
+    missing = [ sid for sid, html in zip(sids, fragments) if html is cachef.CacheFunction.CACHE_MISS ]
+    if missing:
+        rendered = _render_schedule_days(cdata.schedules_data(missing))
+        schedule_day_html.set_many_to_cache(
+            [ (sid,) for sid in missing ],
+            [ rendered[sid] for sid in missing ])
+        fragments = [
+            rendered[sid] if html is cachef.CacheFunction.CACHE_MISS else html
+            for sid, html in zip(sids, fragments) ]
+    return [ (sid, html) for sid, html in zip(sids, fragments) if html ]
 
 
 def schedule(request, conference):
-    tts = _conference_timetables(conference)
+    fragments = _conference_schedule_fragments(conference)
     ctx = {
         'conference': conference,
-        'sids': [ x[0] for x in tts ],
-        'timetables': tts,
+        'sids': [ x[0] for x in fragments ],
+        'fragments': fragments,
     }
     return render(request, 'p3/schedule.html', ctx)
 
 
+def _conference_ics(request, conference, mode='conference'):
+    # only the conference-wide calendar is cached, the personal one is
+    # built on every request
+    if mode != 'conference':
+        return None
+    return dataaccess.conference_ics(conference, abstract='abstract' in request.GET)
+
+
+def _ics_etag(request, *args, **kwargs):
+    ics = _conference_ics(request, *args, **kwargs)
+    return ics['etag'] if ics else None
+
+
+def _ics_last_modified(request, *args, **kwargs):
+    ics = _conference_ics(request, *args, **kwargs)
+    return ics['last_modified'] if ics else None
+
+
+@condition(etag_func=_ics_etag, last_modified_func=_ics_last_modified)
 def schedule_ics(request, conference, mode='conference'):
     if mode == 'my-schedule':
         if not request.user.is_authenticated():
             raise http.Http404()
-        uid = request.user.id
-    else:
-        uid = None
-    from p3.utils import conference2ical
-    cal = conference2ical(conference, user=uid, abstract='abstract' in request.GET)
-    return http.HttpResponse(list(cal.encode()), content_type='text/calendar')
+        from conference import ical
+        from p3.utils import conference2ical
+        cal = conference2ical(conference, user=request.user.id, abstract='abstract' in request.GET)
+        return http.StreamingHttpResponse(ical.stream(cal), content_type='text/calendar')
+    ics = _conference_ics(request, conference, mode)
+    return http.HttpResponse(ics['body'], content_type='text/calendar')
 
 
 def schedule_list(request, conference):
     sids = cmodels.Schedule.objects\
         .filter(conference=conference)\
+        .order_by('date')\
         .values_list('id', flat=True)
     ctx = {
         'conference': conference,
         'sids': sids,
-        'timetables': zip(sids, map(TimeTable2.fromSchedule, sids)),
+        'timetables': TimeTable2.fromSchedules(sids),
     }
     return render(request, 'p3/schedule_list.html', ctx)
 
@@ -166,32 +241,10 @@ def jump_to_my_schedule(request):
 
 @login_required
 def my_schedule(request, conference):
-    qs = cmodels.Event.objects\
-        .filter(eventinterest__user=request.user, eventinterest__interest__gt=0)\
-        .filter(schedule__conference=conference)\
-        .values('id', 'schedule')
-
-    events = defaultdict(list)
-    for x in qs:
-        events[x['schedule']].append(x['id'])
-
-    qs = cmodels.EventBooking.objects\
-        .filter(user=request.user, event__schedule__conference=conference)\
-        .values('event', 'event__schedule')
-    for x in qs:
-        events[x['event__schedule']].append(x['event'])
-
-    qs = cmodels.Ticket.objects\
-        .filter(user=request.user)\
-        .filter(fare__conference=conference, fare__ticket_type='partner')\
-       .values_list('fare', flat=True)
-
-    from conference.dataaccess import fares, schedules_data
-    pfares = [ f for f in fares(conference) if f['id'] in qs ]
-    partner = _partner_as_event(pfares)
-
-    schedules = schedules_data(events.keys())
-    tts = _build_timetables(schedules, events=events, partner=partner)
+    data = dataaccess.user_schedule(request.user.id, conference)
+    partner = _partner_as_event(data['partner'])
+    schedules = cdata.schedules_data(data['events'].keys())
+    tts = _build_timetables(schedules, events=data['events'], partner=partner)
     ctx = {
         'conference': conference,
         'sids': [ x[0] for x in tts ],
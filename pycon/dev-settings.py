@@ -9,6 +9,7 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     }
 }
+CONFERENCE_CACHEF_LOCAL_SIZE = 0
 
 PAYPAL_TEST = True
 
@@ -590,6 +590,16 @@ CONFERENCE_FORMS = {
     'EventBooking': 'p3.forms.P3EventBookingForm',
 }
 
+CONFERENCE_CACHEF_LOCAL_SIZE = 1000
+CONFERENCE_CACHEF_LOCAL_TIMEOUT = 30
+CONFERENCE_CACHEF_STATS_MODULES = (
+    'conference.dataaccess',
+    'p3.dataaccess',
+    'p3.views.schedule',
+    'assopy.dataaccess',
+    'p3.stats',
+)
+
 CONFERENCE_TALKS_RANKING_FILE = SITE_DATA_ROOT + '/rankings.txt'
 CONFERENCE_ADMIN_TICKETS_STATS_EMAIL_LOG = SITE_DATA_ROOT + '/admin_ticket_emails.txt'
 CONFERENCE_ADMIN_TICKETS_STATS_EMAIL_LOAD_LIBRARY = ['p3', 'conference']
@@ -743,20 +753,22 @@ def CONFERENCE_SCHEDULE_ATTENDEES(schedule, forecast):
     from p3.stats import presence_days
     from conference.models import Schedule
 
-    if not isinstance(schedule, Schedule):
-        output = {}
-        for s in Schedule.objects.filter(conference=schedule):
-            output[s.id] = CONFERENCE_SCHEDULE_ATTENDEES(s, forecast)
-        return output
-    d = schedule.date.strftime('%Y-%m-%d')
-    s = presence_days(schedule.conference)
-    for row in s['data']:
-        if row['title'] == '%s (no staff)' % d:
-            if forecast:
-                return row['total_nc']
-            else:
-                return row['total']
-    return 0
+    if isinstance(schedule, Schedule):
+        schedules = [schedule]
+        conference = schedule.conference
+    else:
+        schedules = Schedule.objects.filter(conference=schedule)
+        conference = schedule
+    # presence_days is computed once for all the schedules
+    totals = {}
+    for row in presence_days(conference)['data']:
+        totals[row['title']] = row['total_nc'] if forecast else row['total']
+    output = {}
+    for s in schedules:
+        output[s.id] = totals.get('%s (no staff)' % s.date.strftime('%Y-%m-%d'), 0)
+    if isinstance(schedule, Schedule):
+        return output[schedule.id]
+    return output
 
 
 CONFERENCE_ADMIN_ATTENDEE_STATS = (
@@ -1196,7 +1208,9 @@ def cron_cleanup():
 
 CRONTAB_COMMAND_PREFIX = 'DATA_DIR=%s OTHER_STUFF=%s' % (DATA_DIR, OTHER_STUFF)
 CRONJOBS = [
-    ('@weekly', 'pycon.settings.cron_cleanup')
+    ('@weekly', 'pycon.settings.cron_cleanup'),
+    # mass mailings queued from the admin stats
+    ('* * * * *', 'django.core.management.call_command', ['send_bulk_mail']),
 ]
 
 